@@ -0,0 +1,128 @@
+"""
+慢速連線的背壓（latest-state-wins）
+
+收訊號差的手機讀得慢，每則更新都照送的話，舊的卡片/清單會一路堆在 channel 與 daphne 的 buffer 裡，
+等它們送到時早就過時了。
+
+做法（每條 FindConsumer 連線各一份）：
+- 前端每處理完 board.delta 就回 {"action": "ack", "seq": N}（有節流）。
+  沒送過 ack 的舊前端不受影響，照舊每則都送。
+- 已送出但還沒 ack 的訊息數 >= FIND_WS_MAX_IN_FLIGHT → 這條連線「落後」了：
+  新事件不直接送，先放進 Outbox，以「同一張卡片 / 同一位乘客」為 key，只留最新狀態
+  （driver_updated 取代舊的 driver_updated；seats_changed 取代舊的 seats_changed……）。
+- 等 ack 回來有空位，把 Outbox 合併成一則 board.delta 送出，帶 gap_ok=true：
+  被合併掉的 seq 前端不必 resync。
+- Outbox 裡的 key 超過 FIND_WS_OUTBOX_MAX_KEYS（例如連線其實已經死了）→ 整包丟掉，
+  下一次有空位時改送一份完整快照。
+
+計數（本程序所有連線加總，給監控用）：stats["coalesced"] 被新狀態取代的事件數、
+stats["dropped"] 因為改送快照而整個丟掉的事件數。
+"""
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+MAX_IN_FLIGHT = getattr(settings, "FIND_WS_MAX_IN_FLIGHT", 8)
+OUTBOX_MAX_KEYS = getattr(settings, "FIND_WS_OUTBOX_MAX_KEYS", 500)
+
+# 整張卡片 / 整個乘客項目的事件：新的會完全取代舊的
+FULL_STATE = {
+    "driver_added", "driver_updated", "driver_removed",
+    "driver_entered", "driver_moved", "driver_left",
+    "passenger_added", "passenger_updated", "passenger_removed",
+}
+
+stats = {"queued": 0, "coalesced": 0, "dropped": 0, "flushes": 0, "snapshots": 0}
+
+
+def event_key(ev) -> tuple:
+    if ev.get("driver_id") is not None:
+        return ("driver", ev["driver_id"])
+    if ev.get("passenger_id") is not None:
+        return ("passenger", ev["passenger_id"])
+    return ("event", ev.get("type"), ev.get("seq"))
+
+
+class Outbox:
+    """落後時暫存的事件：每個 key 最多一個完整狀態 + 一個局部更新（seats_changed）"""
+
+    def __init__(self):
+        self._slots: OrderedDict = OrderedDict()   # key -> [full_event | None, partial_event | None]
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, events) -> int:
+        """放進去；回傳被取代（合併掉）的事件數"""
+        coalesced = 0
+        for ev in events:
+            key = event_key(ev)
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = [None, None]
+            else:
+                self._slots.move_to_end(key)
+            if ev["type"] in FULL_STATE:
+                # 完整狀態：之前的局部更新也一起作廢
+                coalesced += (slot[0] is not None) + (slot[1] is not None)
+                slot[0], slot[1] = ev, None
+            else:
+                coalesced += slot[1] is not None
+                slot[1] = ev
+        stats["queued"] += len(events)
+        stats["coalesced"] += coalesced
+        return coalesced
+
+    def drain(self) -> list:
+        out = [ev for slot in self._slots.values() for ev in slot if ev is not None]
+        self._slots.clear()
+        return out
+
+    def discard(self) -> int:
+        n = sum((slot[0] is not None) + (slot[1] is not None) for slot in self._slots.values())
+        self._slots.clear()
+        stats["dropped"] += n
+        return n
+
+
+class FlowControl:
+    """單一連線的 in-flight 計數 + Outbox"""
+
+    def __init__(self):
+        self.enabled = False       # 前端送過 ack 才啟用
+        self.in_flight = deque()   # 已送出、未 ack 的訊息（記最後一個 seq）
+        self.outbox = Outbox()
+        self.needs_snapshot = False
+
+    def reset(self):
+        """送了完整快照 / 重新訂閱：之前的都不算了"""
+        self.in_flight.clear()
+        self.outbox.discard()
+        self.needs_snapshot = False
+
+    @property
+    def behind(self) -> bool:
+        return self.enabled and (len(self.in_flight) >= MAX_IN_FLIGHT or len(self.outbox) > 0 or self.needs_snapshot)
+
+    def sent(self, last_seq):
+        if self.enabled and last_seq is not None:
+            self.in_flight.append(last_seq)
+
+    def ack(self, seq):
+        self.enabled = True
+        while self.in_flight and self.in_flight[0] <= seq:
+            self.in_flight.popleft()
+
+    def hold(self, events):
+        """落後時把事件收起來；太多就整包放棄，改等著送快照"""
+        if self.needs_snapshot:
+            stats["dropped"] += len(events)
+            return
+        self.outbox.add(events)
+        if len(self.outbox) > OUTBOX_MAX_KEYS:
+            self.outbox.discard()
+            self.needs_snapshot = True
+
+    @property
+    def has_room(self) -> bool:
+        return len(self.in_flight) < MAX_IN_FLIGHT
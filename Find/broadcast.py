@@ -0,0 +1,404 @@
+"""
+即時廣播排程器（合併廣播）
+
+以前每一次 DriverTrip / PassengerRequest 的 post_save / post_delete 都會：
+重查全部司機與乘客 → 渲染兩份清單 → group_send 給所有人。
+報名高峰時一秒十次存檔就是十次全量渲染、十次全量廣播。
+
+現在改成：signal 只負責「標記哪些司機/乘客變髒了」，
+排程器在一個視窗（FIND_BROADCAST_WINDOW_MS，預設 250ms）內收集，
+時間到才渲染一次、送出一則合併後的更新。
+
+- 計時器在「第一筆變更」進來時啟動，之後的變更不會把它往後推，
+  所以任何一筆變更最多等一個視窗（再加上渲染時間）就會送出 → 過時時間有上限。
+- 兩次 flush 之間至少間隔一個視窗 → 每個視窗最多廣播一次。
+- FIND_BROADCAST_WINDOW_MS = 0 時不合併，變更後立即在呼叫端執行緒廣播（除錯用）。
+
+廣播內容（FIND_BROADCAST_MODE）：
+- "delta"（預設）：只送變動的部分，見 BoardDeltaBuilder。
+- "full"：舊作法，整份 drivers_html / passengers_html。
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+from django.template.loader import render_to_string
+
+from .encoding import dumps
+
+logger = logging.getLogger(__name__)
+
+FIND_GROUP = "find_group"
+DB_ALIAS = "find_db"
+
+
+# ASGI server 的 event loop（consumer 連線時登記）。
+# 計時器執行緒要 group_send 時丟回這個 loop 執行，
+# 不必每次 async_to_sync 都開一個新 loop（channels_redis 也會因此每次重建連線）。
+_server_loop: asyncio.AbstractEventLoop | None = None
+
+
+def bind_event_loop(loop):
+    global _server_loop
+    _server_loop = loop
+
+
+def group_send(group: str, message: dict):
+    """可以從任何同步執行緒呼叫的 group_send"""
+    channel_layer = get_channel_layer()
+    loop = _server_loop
+    if loop is not None and loop.is_running():
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is None:
+            asyncio.run_coroutine_threadsafe(channel_layer.group_send(group, message), loop).result(timeout=10)
+            return
+    async_to_sync(channel_layer.group_send)(group, message)
+
+
+def render_board_lists():
+    """
+    渲染首頁的司機清單（第一頁，預設排序）與（未指派司機的）乘客清單，
+    回傳 (drivers_html, passengers_html, drivers_next)；drivers_next = 第二頁的 cursor（沒有 = None）
+    """
+    # views 會反過來 import 這個模組，這裡延遲 import 避免循環
+    from .models import PassengerRequest
+    from .views import driver_card_page
+
+    # 跟首頁的預設第一頁是同一份（pagecache.py），同一資料版本只渲染一次
+    page = driver_card_page(sort="date_desc")
+    passengers = (
+        PassengerRequest.objects.using(DB_ALIAS)
+        .filter(is_matched=False, driver__isnull=True, is_waitlisted=False)
+        .order_by("-id")
+    )
+    drivers_html = render_to_string("Find/_driver_list.html", {"cards_html": page.html})
+    passengers_html = render_to_string("Find/_passenger_list.html", {"passengers": passengers})
+    return drivers_html, passengers_html, page.next
+
+
+def send_full_update(driver_ids, passenger_ids):
+    """預設的 flush：取目前版本的清單快照，對 find_group 送出一則合併後的 send.update"""
+    from .snapshot import get_board_snapshot
+    # 同一版本的快照跟新連線共用，不會重複渲染
+    snap = get_board_snapshot()
+    drivers_html, passengers_html = snap.drivers_html, snap.passengers_html
+    group_send(
+        FIND_GROUP,
+        {
+            "type": "send.update",
+            "drivers_html": drivers_html,
+            "passengers_html": passengers_html,
+            "drivers_next": snap.drivers_next,
+            # 這次合併了哪些變更（前端目前用不到，方便除錯/之後做局部更新）
+            "driver_ids": sorted(driver_ids),
+            "passenger_ids": sorted(passenger_ids),
+        },
+    )
+
+
+# ---- 差量（delta）事件 ----
+# 卡片上會顯示、需要比對變動的欄位；只有座位數變動時送 seats_changed 就好，不必整張卡片
+SEAT_FIELDS = frozenset({"seats_filled", "seats_total"})
+
+
+def _pax_brief(p):
+    return [p.id, p.passenger_name, p.departure, p.seats_needed]
+
+
+def driver_card_fields(d) -> dict:
+    """司機卡片（_driver_card.html）上看得到的欄位，JSON 可序列化"""
+    return {
+        "driver_name": d.driver_name,
+        "gender": d.gender,
+        "contact": "" if (d.hide_contact and d.email) else (d.contact or ""),
+        "hide_contact": bool(d.hide_contact and d.email),
+        "departure": d.departure,
+        "destination": d.destination,
+        "date": d.date.isoformat() if d.date else None,
+        "return_date": d.return_date.isoformat() if d.return_date else None,
+        "fare_note": d.fare_note,
+        "flexible_pickup": d.flexible_pickup,
+        "note": d.note,
+        "seats_filled": d.seats_filled,
+        "seats_total": d.seats_total,
+        "pending": [_pax_brief(p) for p in getattr(d, "pending_list", [])],
+        "accepted": [_pax_brief(p) for p in getattr(d, "accepted_list", [])],
+    }
+
+
+class BoardDeltaBuilder:
+    """
+    把 dirty 的司機/乘客 id 轉成差量事件：
+      driver_added / driver_updated / seats_changed / driver_removed
+      passenger_added / passenger_updated / passenger_removed
+    每個事件都有遞增的 seq；前端發現 seq 跳號就送 {"action": "resync"} 要整份快照。
+
+    為了判斷「新增 / 修改 / 只有座位變」，這裡記住上次送出去的卡片欄位（程序內）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._drivers: dict[int, dict] = {}   # driver_id -> 上次送出的 card fields
+        self._passengers: set[int] = set()    # 目前在「未指派乘客」清單上的 id
+
+    def current_seq(self) -> int:
+        return self._seq
+
+    def build(self, driver_ids, passenger_ids) -> tuple[list[dict], dict]:
+        """
+        回傳 (events, cards)：
+          events：送給前端的差量事件
+          cards：{"<driver_id>": {"fields": 篩選比對欄位, "html": 卡片}}，只給伺服器端的篩選訂閱用
+        """
+        from .models import PassengerRequest
+        from .subscriptions import driver_match_fields
+        from .views import driver_cards_qs
+
+        driver_ids = set(driver_ids)
+        passenger_ids = set(passenger_ids)
+        drivers = {
+            d.id: d for d in driver_cards_qs(only_active=False).filter(id__in=driver_ids)
+        } if driver_ids else {}
+        passengers = {
+            p.id: p for p in PassengerRequest.objects.using(DB_ALIAS).filter(
+                id__in=passenger_ids, is_matched=False, driver__isnull=True, is_waitlisted=False
+            )
+        } if passenger_ids else {}
+
+        events = []
+        cards = {}
+        with self._lock:
+            for did in sorted(driver_ids):
+                d = drivers.get(did)
+                old = self._drivers.get(did)
+                if d is None or not d.is_active:
+                    self._drivers.pop(did, None)
+                    events.append(self._event("driver_removed", driver_id=did))
+                    continue
+                fields = driver_card_fields(d)
+                self._drivers[did] = fields
+                html = render_to_string("Find/_driver_card.html", {"d": d})
+                cards[str(did)] = {"fields": driver_match_fields(d), "html": html}
+                if old is None:
+                    events.append(self._event("driver_added", driver_id=did, html=html))
+                    continue
+                changed = sorted(k for k in fields if fields[k] != old.get(k))
+                if not changed:
+                    continue
+                if SEAT_FIELDS.issuperset(changed):
+                    events.append(self._event(
+                        "seats_changed", driver_id=did,
+                        seats_filled=d.seats_filled, seats_total=d.seats_total,
+                        seats_left=d.seats_left,
+                    ))
+                else:
+                    events.append(self._event("driver_updated", driver_id=did, changed=changed, html=html))
+
+            for pid in sorted(passenger_ids):
+                p = passengers.get(pid)
+                if p is None:
+                    self._passengers.discard(pid)
+                    events.append(self._event("passenger_removed", passenger_id=pid))
+                    continue
+                kind = "passenger_updated" if pid in self._passengers else "passenger_added"
+                self._passengers.add(pid)
+                events.append(self._event(
+                    kind, passenger_id=pid,
+                    html=render_to_string("Find/_passenger_item.html", {"p": p}),
+                ))
+        return events, cards
+
+    def _event(self, type_, **data):
+        # 呼叫端已持有 self._lock
+        self._seq += 1
+        return {"type": type_, "seq": self._seq, **data}
+
+
+delta_builder = BoardDeltaBuilder()
+
+stats = {"delta_messages": 0, "delta_events": 0, "delta_bytes": 0}
+
+
+def send_board_delta(driver_ids, passenger_ids):
+    """delta 模式的 flush：只送變動的卡片／欄位（一則訊息，內含多個事件）"""
+    events, cards = delta_builder.build(driver_ids, passenger_ids)
+    if not events:
+        return
+    # 先序列化一次，JSON 連線直接轉送字串，不必每條連線各自 dumps
+    text = dumps({"type": "board.delta", "events": events})
+    stats["delta_messages"] += 1
+    stats["delta_events"] += len(events)
+    stats["delta_bytes"] += len(text.encode("utf-8"))
+
+    # events/cards 給有篩選訂閱的連線在伺服器端各自過濾；沒訂閱的直接轉送 text
+    group_send(FIND_GROUP, {"type": "board.delta", "text": text, "events": events, "cards": cards})
+
+
+class BroadcastScheduler:
+    """收集 dirty 的司機/乘客 id，每個視窗最多 flush 一次"""
+
+    def __init__(self, window_ms: int = 250, flush_handler=None):
+        self.window = max(0, window_ms) / 1000.0
+        self.flush_handler = flush_handler or send_board_delta
+
+        self._lock = threading.Lock()
+        self._dirty_drivers: set[int] = set()
+        self._dirty_passengers: set[int] = set()
+        self._first_dirty_at: float | None = None
+        self._last_flush_at = 0.0
+        self._timer: threading.Timer | None = None
+        self._flushing = False
+
+        self.stats = {
+            "marks": 0,             # mark_dirty 被呼叫幾次
+            "flushes": 0,           # 實際廣播幾次
+            "errors": 0,
+            "max_staleness_ms": 0,  # 第一筆變更 → 開始 flush 的最長等待
+        }
+
+    # ---- 對外 API ----
+    def mark_dirty(self, drivers=(), passengers=()):
+        drivers = {int(i) for i in drivers if i}
+        passengers = {int(i) for i in passengers if i}
+        if not drivers and not passengers:
+            return
+
+        if self.window == 0:
+            # 不合併：直接在呼叫端 flush
+            with self._lock:
+                self.stats["marks"] += 1
+            self._run_handler(drivers, passengers, time.monotonic())
+            return
+
+        with self._lock:
+            self.stats["marks"] += 1
+            self._dirty_drivers |= drivers
+            self._dirty_passengers |= passengers
+            if self._first_dirty_at is None:
+                self._first_dirty_at = time.monotonic()
+            # flush 進行中的話，結束時會自己再排下一次
+            if self._timer is None and not self._flushing:
+                self._schedule_locked()
+
+    def flush_now(self):
+        """立即送出目前累積的變更（測試 / 關機前用）"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self._flush()
+
+    @property
+    def pending(self) -> bool:
+        with self._lock:
+            return bool(self._dirty_drivers or self._dirty_passengers)
+
+    # ---- 內部 ----
+    def _schedule_locked(self):
+        now = time.monotonic()
+        # 收集一個視窗，同時與上次 flush 至少間隔一個視窗
+        due = max(self._first_dirty_at + self.window, self._last_flush_at + self.window)
+        self._timer = threading.Timer(max(0.0, due - now), self._flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            if not (self._dirty_drivers or self._dirty_passengers):
+                self._first_dirty_at = None
+                return
+            drivers, self._dirty_drivers = self._dirty_drivers, set()
+            passengers, self._dirty_passengers = self._dirty_passengers, set()
+            first_dirty_at, self._first_dirty_at = self._first_dirty_at, None
+            self._flushing = True
+
+        started = time.monotonic()
+        try:
+            self._run_handler(drivers, passengers, first_dirty_at or started)
+        finally:
+            # 計時器執行緒不會經過 request 週期，自己收掉 DB 連線
+            close_old_connections()
+            with self._lock:
+                self._flushing = False
+                self._last_flush_at = started
+                if (self._dirty_drivers or self._dirty_passengers) and self._timer is None:
+                    self._schedule_locked()
+
+    def _run_handler(self, drivers, passengers, first_dirty_at):
+        staleness_ms = int((time.monotonic() - first_dirty_at) * 1000)
+        try:
+            self.flush_handler(drivers, passengers)
+            with self._lock:
+                self.stats["flushes"] += 1
+                self.stats["max_staleness_ms"] = max(self.stats["max_staleness_ms"], staleness_ms)
+        except Exception:
+            logger.exception("broadcast flush failed (drivers=%s, passengers=%s)", drivers, passengers)
+            with self._lock:
+                self.stats["errors"] += 1
+
+
+# 全程序共用一個排程器
+scheduler = BroadcastScheduler(
+    window_ms=getattr(settings, "FIND_BROADCAST_WINDOW_MS", 250),
+    flush_handler=(
+        send_full_update
+        if getattr(settings, "FIND_BROADCAST_MODE", "delta") == "full"
+        else send_board_delta
+    ),
+)
+
+
+def mark_dirty(drivers=(), passengers=()):
+    scheduler.mark_dirty(drivers=drivers, passengers=passengers)
+
+
+# ---- 給 view 用的批次廣播 ----
+def broadcast_driver_cards(driver_ids, passenger_ids=()):
+    """
+    首頁卡片：不在這裡各自查詢、渲染，交給排程器跟 signals 的標記合併，
+    flush 時 BoardDeltaBuilder 用一次 id__in 查詢把所有變動的卡片一起渲染，送一則 board.delta。
+    """
+    mark_dirty(drivers=driver_ids, passengers=passenger_ids)
+
+
+def manage_group(driver_id) -> str:
+    """司機管理頁的 group（DriverManageConsumer 加入的那個）"""
+    return f"driver_manage_{driver_id}"
+
+
+def render_manage_panels(driver_ids) -> dict:
+    """批次渲染多位司機管理頁的待確認／已接受兩欄：司機一次查詢、乘客一次查詢"""
+    from .models import DriverTrip, PassengerRequest
+
+    ids = {int(i) for i in driver_ids if i}
+    if not ids:
+        return {}
+    drivers = DriverTrip.objects.using(DB_ALIAS).in_bulk(ids)
+    pax_by_driver = {did: ([], []) for did in drivers}
+    for p in (PassengerRequest.objects.using(DB_ALIAS)
+              .filter(driver_id__in=drivers.keys())
+              .order_by("-id")):
+        pax_by_driver[p.driver_id][1 if p.is_matched else 0].append(p)
+
+    return {
+        did: render_to_string("Find/_manage_panels.html", {
+            "driver": d, "pending": pax_by_driver[did][0], "accepted": pax_by_driver[did][1],
+        })
+        for did, d in drivers.items()
+    }
+
+
+def broadcast_manage_panels(driver_ids):
+    """每位司機的管理頁是各自的 audience：渲染一次、各送一則"""
+    for did, html in render_manage_panels(driver_ids).items():
+        group_send(manage_group(did), {"type": "manage.panels", "html": html})
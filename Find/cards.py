@@ -0,0 +1,44 @@
+"""
+司機卡片的欄位投影（card projection）
+
+首頁清單以前每位司機、每位預抓的乘客都是整列讀出來：備註、司機備忘、密碼、email、聯絡方式……
+但 _driver_card.html 只用得到其中一部分。清單渲染（views.driver_card_page）改用下面的欄位清單
+.only() 讀取，其餘欄位留在 DB。
+
+改模板時要一起改這裡：模板碰到沒讀出來的欄位，Django 會每張卡片各補查一次（N+1），
+不會報錯。python manage.py bench_card_projection 會比較兩種讀法的列數 / 位元組數。
+
+各模板需要的欄位：
+  _driver_card.html（司機）
+    標題列       id, driver_name, seats_filled, seats_total
+    三行資訊     departure, destination, fare_note, date, return_date, flexible_pickup
+    司機資訊     gender（get_gender_display）, contact, hide_contact, email（只看有沒有填）, note
+  _driver_card.html（每位待確認 / 已接受乘客）
+    id, passenger_name, departure, seats_needed
+  _driver_list.html
+    is_active
+  其他
+    fare_is_free                 pagination.row_key（取下一頁的 cursor）
+    driver, is_matched（乘客）   Prefetch 分成 pending_list / accepted_list
+"""
+
+DRIVER_CARD_FIELDS = (
+    "id", "driver_name", "seats_filled", "seats_total",
+    "departure", "destination", "fare_note", "date", "return_date", "flexible_pickup",
+    "gender", "contact", "hide_contact", "email", "note",
+    "is_active",
+    "fare_is_free",
+)
+
+PASSENGER_CARD_FIELDS = (
+    "id", "passenger_name", "departure", "seats_needed",
+    "driver", "is_matched",
+)
+
+
+def project_drivers(qs):
+    return qs.only(*DRIVER_CARD_FIELDS)
+
+
+def project_passengers(qs):
+    return qs.only(*PASSENGER_CARD_FIELDS)
@@ -0,0 +1,85 @@
+"""
+Request 內的變更收集器
+
+以前一個 request 會零散地觸發好幾次廣播，例如：
+- join_driver：整份清單重算 + broadcast_driver_card（5 次查詢、同一張卡片渲染兩次、送兩則）
+- pax_memo：manage.pax + driver_partial + manage.panels 三則
+
+現在 view 只記錄「哪些東西變了」，request 結束、交易提交後才統一送出：
+- 首頁：司機卡片／乘客 → broadcast_driver_cards（和 signals 合併成一則 board.delta）
+- 管理頁：每位司機一則 manage.panels（批次查詢、渲染）
+
+用法：
+    @require_POST
+    @collect_changes
+    @transaction.atomic(using=DB_ALIAS)
+    def pax_accept(request, pax_id):
+        ...
+        touch(drivers=[d.id], passengers=[p.id], panels=[d.id])
+
+不在 collect_changes 包住的程式裡呼叫 touch()，會在交易提交後單獨送出。
+"""
+import threading
+from functools import wraps
+
+from .broadcast import broadcast_driver_cards, broadcast_manage_panels
+from .dispatch import dispatch_on_commit
+
+_local = threading.local()
+
+
+class ChangeSet:
+    __slots__ = ("drivers", "passengers", "panels")
+
+    def __init__(self):
+        self.drivers: set[int] = set()
+        self.passengers: set[int] = set()
+        self.panels: set[int] = set()
+
+    def add(self, drivers=(), passengers=(), panels=()):
+        self.drivers.update(i for i in drivers if i)
+        self.passengers.update(i for i in passengers if i)
+        self.panels.update(i for i in panels if i)
+
+    def __bool__(self):
+        return bool(self.drivers or self.passengers or self.panels)
+
+    def submit(self):
+        """交易提交後交給背景佇列（同一組變更還在排隊時會被合併；佇列滿了就在這裡直接送）"""
+        if self:
+            # update() 的變更、管理頁都不會再由 signals 補送，不能丟
+            dispatch_on_commit(flush_changes, frozenset(self.drivers),
+                               frozenset(self.passengers), frozenset(self.panels), inline_if_full=True)
+
+
+def flush_changes(drivers, passengers, panels):
+    if drivers or passengers:
+        broadcast_driver_cards(drivers, passengers)
+    if panels:
+        broadcast_manage_panels(panels)
+
+
+def touch(*, drivers=(), passengers=(), panels=()):
+    """記錄這個 request 改到的司機卡片、乘客、司機管理頁"""
+    changes = getattr(_local, "changes", None)
+    if changes is not None:
+        changes.add(drivers, passengers, panels)
+        return
+    single = ChangeSet()
+    single.add(drivers, passengers, panels)
+    single.submit()
+
+
+def collect_changes(view):
+    """view decorator：request 期間的 touch() 合併起來，結束時送一次"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        outer = getattr(_local, "changes", None)
+        changes = _local.changes = ChangeSet()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _local.changes = outer
+            # view 內的 atomic 已經結束；外層若還有交易（例如 ATOMIC_REQUESTS），會等它提交
+            changes.submit()
+    return wrapper
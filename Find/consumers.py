@@ -2,13 +2,25 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from asgiref.sync import sync_to_async
-from django.db import models
 from channels.db import database_sync_to_async
 from django.template.loader import render_to_string
 from .models import PassengerRequest, DriverTrip
 from django.db import transaction
+from .snapshot import get_board_snapshot
+from .broadcast import bind_event_loop
+from .locations import resolve_location_filters
+from .matching import propose_driver
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .subscriptions import BoardSubscription, driver_match_fields, normalize_filters, normalize_sort
+from .waitlist import entry_status, waitlist_group
+from .encoding import NegotiatedEncodingMixin
+from . import backpressure
+from . import metrics
+import asyncio
+
+class DriverManageConsumer(metrics.InstrumentedConsumerMixin, NegotiatedEncodingMixin, AsyncJsonWebsocketConsumer):
+    metrics_label = "driver_manage"
 
-class DriverManageConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.driver_id = self.scope["url_route"]["kwargs"]["driver_id"]
         sess_key = f"driver_auth_{self.driver_id}"
@@ -17,31 +29,42 @@ class DriverManageConsumer(AsyncJsonWebsocketConsumer):
             return
         self.group_name = f"driver_manage_{self.driver_id}"
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        metrics.group_joined(self.group_name)
+        await self.accept_negotiated()
 
     async def disconnect(self, code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        group_name = getattr(self, "group_name", None)   # 未授權的連線在 connect 就被關掉，沒有 group
+        if group_name is None:
+            return
+        await self.channel_layer.group_discard(group_name, self.channel_name)
         await self.channel_layer.group_discard("find_group", self.channel_name)
+        metrics.group_left(group_name)
+
+    # send_json 也走協商好的編碼
+    async def send_json(self, content, close=False):
+        await self.send_event(content)
+        if close:
+            await self.close()
 
     # 對應 type: "send.update"
     async def send_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "send.update",
             "drivers_html": event.get("drivers_html"),
             "passengers_html": event.get("passengers_html"),
-        }))
+        })
 
     # 對應 type: "send.partial"
     async def send_partial(self, event):
         payload = event.get("payload")
         if payload is not None:
-            await self.send(text_data=json.dumps({"type": "send.partial", "payload": payload}))
+            await self.send_event({"type": "send.partial", "payload": payload})
         else:
-            await self.send(text_data=json.dumps({
+            await self.send_event({
                 "type": "send.partial",
                 "driver_id": event.get("driver_id"),
                 "html": event.get("html"),
-            }))
+            })
 
     # 你後端廣播時用的 type，要對應這個 handler 名稱
     async def manage_panels_update(self, event):
@@ -61,76 +84,235 @@ class DriverManageConsumer(AsyncJsonWebsocketConsumer):
             "pax_id": event.get("pax_id"),
             "html": event.get("html",""),
         })
-class FindConsumer(AsyncWebsocketConsumer):
-    
+class FindConsumer(metrics.InstrumentedConsumerMixin, NegotiatedEncodingMixin, AsyncWebsocketConsumer):
+    metrics_label = "find"
+
     async def connect(self):
+        bind_event_loop(asyncio.get_running_loop())
         self.group = "find_group"
+        self.subscription = None   # 有送 subscribe 才會在伺服器端篩選
+        self.sub_seq = 0           # 篩選後事件的序號（每條連線各自編號）
+        self.flow = backpressure.FlowControl()   # 慢速連線：未 ack 太多就只留最新狀態
+        self.waitlist_groups = set()             # watch_waitlist 加入的候補 group
         await self.channel_layer.group_add(self.group, self.channel_name)
-        await self.accept()
+        metrics.group_joined(self.group)
+        await self.accept_negotiated()
         await self.send_current_data()
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard("find_group", self.channel_name)
+        metrics.group_left("find_group")
+        for group in getattr(self, "waitlist_groups", ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
+            metrics.group_left(group)
 
     # 刪掉重複/舊的 send_update，只保留這個版本：
     async def send_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "send.update",             # ← 改這行
             "drivers_html": event.get("drivers_html", ""),
             "passengers_html": event.get("passengers_html", ""),
+            "drivers_next": event.get("drivers_next"),
             "sort": event.get("sort"),
-        }))
+        })
+
+    # 差量更新：沒訂閱 → broadcast 已經序列化好，直接轉送；有訂閱 → 依這條連線的篩選條件過濾
+    async def board_delta(self, event):
+        if self.subscription is None:
+            events = event.get("events", [])
+        else:
+            events = self.subscription.apply(event.get("events", []), event.get("cards", {}))
+        if not events:
+            return
+
+        # 前端還沒消化完之前送的 → 先收進 outbox，同一張卡片只留最新狀態
+        if self.flow.behind:
+            self.flow.hold(events)
+            return
+
+        if self.subscription is None:
+            await self.send_prepared(event["text"], {"type": "board.delta", "events": events})
+            self.flow.sent(events[-1].get("seq"))
+        else:
+            await self._send_filtered(events)
+
+    async def _send_filtered(self, events, **extra):
+        for ev in events:
+            self.sub_seq += 1
+            ev["seq"] = self.sub_seq
+        await self.send_event({"type": "board.delta", "events": events, "filtered": True, **extra})
+        self.flow.sent(self.sub_seq)
+
+    async def _flush_outbox(self):
+        """ack 回來有空位了：outbox 合併成一則送出（或在丟棄過之後改送快照）"""
+        flow = self.flow
+        if not flow.has_room:
+            return
+        if flow.needs_snapshot:
+            backpressure.stats["snapshots"] += 1
+            await self.resync()
+            return
+        events = flow.outbox.drain()
+        if not events:
+            return
+        backpressure.stats["flushes"] += 1
+        if self.subscription is None:
+            # 被合併掉的 seq 不會再送，前端看到 gap_ok 就不必 resync
+            await self.send_event({"type": "board.delta", "events": events, "gap_ok": True})
+            flow.sent(max(ev["seq"] for ev in events))
+        else:
+            await self._send_filtered(events, gap_ok=True)
+
+    async def resync(self):
+        sub = self.subscription
+        if sub is not None:
+            await self.subscribe({"filters": sub.filters, "sort": sub.sort, "snapshot": True,
+                                  "until": encode_cursor(sub.sort, sub.until) if sub.until else None})
+        else:
+            await self.send_current_data()
+
+    @staticmethod
+    def _until(cursor, sort):
+        """前端送來的 next cursor → pagination key；沒帶 / 格式不對 = 沒有分頁邊界"""
+        try:
+            return decode_cursor(cursor, sort) if cursor else None
+        except InvalidCursor:
+            return None
+
+    @database_sync_to_async
+    def _load_subscription(self, filters, sort, with_html, until=None, after=None):
+        from .views import driver_cards_qs
+        filters = resolve_location_filters(filters)
+        drivers = list(driver_cards_qs(filters=filters, sort=sort, after=after, until=until))
+        html = render_to_string("Find/_driver_list.html", {"drivers": drivers}) if with_html else None
+        return filters, [(d.id, driver_match_fields(d)) for d in drivers], html
+
+    async def subscribe(self, data):
+        sort = normalize_sort(data.get("sort"))
+        until = self._until(data.get("until"), sort)
+        filters, cards, drivers_html = await self._load_subscription(
+            normalize_filters(data.get("filters")), sort, bool(data.get("snapshot")), until=until)
+        sub = BoardSubscription(filters, sort, until)
+        sub.reset(cards)
+        self.subscription = sub
+        self.sub_seq = 0
+        self.flow.reset()
+        payload = {"type": "subscribed", "seq": 0, "sort": sort, "ids": sub.ids}
+        if drivers_html is not None:
+            payload["drivers_html"] = drivers_html
+        await self.send_event(payload)
+
+    async def load_page(self, data):
+        """前端捲動載入了下一頁（HTTP driver_page）：把那一段加進訂閱範圍，回傳那一段目前的 ids 讓前端對齊"""
+        sub = self.subscription
+        if sub is None or sub.until is None:
+            return
+        until = self._until(data.get("until"), sub.sort)
+        if data.get("until") and until is None:
+            return      # 不是目前排序的 cursor（前端剛換了排序，新的 subscribe 會重設範圍）
+        _, cards, _ = await self._load_subscription(sub.filters, sub.sort, False, until=until, after=sub.until)
+        sub.extend(cards, until)
+        await self.send_event({"type": "paged", "ids": [did for did, _ in cards]})
+
+    async def watch_waitlist(self, data):
+        """遞補時只送給這位乘客（waitlist.notify_promoted → waitlist.promoted）"""
+        check = database_sync_to_async(entry_status)
+        status = await check(data.get("entry_id"), data.get("token"))
+        if status is None:
+            await self.send_event({"type": "waitlist.error", "entry_id": data.get("entry_id")})
+            return
+        group = waitlist_group(status["entry_id"])
+        if group not in self.waitlist_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.waitlist_groups.add(group)
+            metrics.group_joined(group)
+            # 加入 group 前剛好遞補的話收不到通知：加入後再查一次
+            status = await check(data.get("entry_id"), data.get("token")) or status
+        kind = "waitlist.promoted" if status["position"] == 0 else "waitlist.watching"
+        await self.send_event({"type": kind, **status})
+
+    async def waitlist_promoted(self, event):
+        await self.send_event({
+            "type": "waitlist.promoted",
+            "entry_id": event["entry_id"],
+            "driver_id": event["driver_id"],
+            "passenger_id": event["passenger_id"],
+        })
 
     async def receive(self, text_data=None, bytes_data=None):
+        # 前端只送文字 JSON（ack / resync / subscribe…）；協商成二進位編碼也一樣，二進位 frame 直接忽略
+        if text_data is None:
+            return
         data = json.loads(text_data)
-        pass
+        self.record_received(data.get("action"))
+
+        # 前端處理完 board.delta 回報的 seq：釋放 in-flight，落後的話把 outbox 送出去
+        if data.get("action") == "ack":
+            try:
+                self.flow.ack(int(data.get("seq")))
+            except (TypeError, ValueError):
+                return
+            await self._flush_outbox()
+            return
+
+        # 前端發現 seq 跳號 → 重送整份快照（有訂閱的話，重送篩選後的清單）
+        if data.get("action") == "resync":
+            await self.resync()
+            return
+
+        # 伺服器端篩選訂閱：{"action": "subscribe", "filters": {...}, "sort": "...", "snapshot": bool}
+        if data.get("action") == "subscribe":
+            await self.subscribe(data)
+            return
+
+        # 無限捲動載入了下一頁：{"action": "page", "until": 這一頁的 next cursor（最後一頁 = null）}
+        if data.get("action") == "page":
+            await self.load_page(data)
+            return
+
+        # 排候補的乘客：{"action": "watch_waitlist", "entry_id": ..., "token": ...}（join_driver 回傳的）
+        if data.get("action") == "watch_waitlist":
+            await self.watch_waitlist(data)
+            return
+
+        if data.get("action") == "unsubscribe":
+            self.subscription = None
+            await self.send_current_data()
+            return
 
         if data.get("action") == "join":
+            # 乘客請系統幫忙找司機：挑順路、座位夠的司機，掛到他的待確認（matching.propose_driver）
             passenger_id = data.get("passenger_id")
-
-            try:
-                passenger = await sync_to_async(PassengerRequest.objects.get)(id=passenger_id)
-            except PassengerRequest.DoesNotExist:
-                await self.send(text_data=json.dumps({
+            exists = await database_sync_to_async(
+                lambda: PassengerRequest.objects.using("find_db").filter(id=passenger_id).exists()
+            )()
+            if not exists:
+                await self.send_event({
                     "type": "join_result",
                     "success": False,
                     "message": "乘客不存在"
-                }))
+                })
                 return
 
-            driver = await sync_to_async(
-                lambda: DriverTrip.objects.filter(is_active=True, seats_filled__lt=models.F("seats_total")).first()
-            )()
-
+            driver = await database_sync_to_async(propose_driver)(passenger_id)
             if driver:
-                passenger.is_matched = True
-                driver.seats_filled += passenger.seats_needed
-
-                await sync_to_async(passenger.save)()
-                await sync_to_async(driver.save)()
-
-                # 成功回應
-                await self.send(text_data=json.dumps({
+                # 廣播由 propose_driver 在交易提交後送出
+                await self.send_event({
                     "type": "join_result",
-                    "success": True
-                }))
-
-                # 廣播最新資料
-                await self.channel_layer.group_send(
-                    "find_group",
-                    {"type": "broadcast_update"}
-                )
+                    "success": True,
+                    "driver_id": driver.id,
+                })
             else:
-                await self.send(text_data=json.dumps({
+                await self.send_event({
                     "type": "join_result",
                     "success": False,
-                    "message": "目前沒有可用的司機"
-                }))
+                    "message": "目前沒有順路且有空位的司機"
+                })
     # Single driver card patch
     async def send_partial(self, event):
         driver_html = event.get("driver_html") or event.get("html") or ""
         payload = event.get("payload", {})
-        await self.send(text_data=json.dumps(payload))
+        await self.send_event(payload)
 
 
      # ---- 將「同步 ORM 查詢」包成 async 可用 ----
@@ -144,7 +326,7 @@ class FindConsumer(AsyncWebsocketConsumer):
         )
         passengers = list(
             PassengerRequest.objects.using("find_db")
-            .filter(is_matched=False)
+            .filter(is_matched=False, is_waitlisted=False)
             .order_by("-id")
         )
         # 分組；注意：不要用底線開頭的屬性名
@@ -169,12 +351,10 @@ class FindConsumer(AsyncWebsocketConsumer):
             print(f"⚠️ DriverTrip {driver_id} 不存在")
 
     async def send_current_data(self):
-        passengers_html, drivers_html = await self.render_lists()
-        await self.send(text_data=json.dumps({
-            "type": "send.update",             # ← 也改這行
-            "passengers_html": passengers_html,
-            "drivers_html": drivers_html,
-        }))
+        # 全程序共用的快照：同一資料版本只渲染一次，之後的連線直接送序列化好的 payload
+        snap = await database_sync_to_async(get_board_snapshot)()
+        self.flow.reset()   # 快照就是最新狀態，之前排著的都不用送了
+        await self.send_prepared(snap.payload_text, snap.payload)
 
     async def broadcast_update(self):
         passengers_html, drivers_html = await self.render_lists()
@@ -190,15 +370,9 @@ class FindConsumer(AsyncWebsocketConsumer):
 
     @sync_to_async
     def render_lists(self):
-        """把查詢和模板渲染放進 sync_to_async"""
-        passengers = PassengerRequest.objects.using("find_db").filter(is_matched=False)
-        drivers = build_driver_cards()
-        html = render_to_string("Find/_driver_list.html", {"drivers": drivers})
-
-        passengers_html = render_to_string("Find/_passenger_list.html", {"passengers": passengers})
-        drivers_html = render_to_string("Find/_driver_list.html", {"drivers": drivers})
-
-        return passengers_html, drivers_html
+        """取目前版本的清單快照（不會每次都重新查詢、渲染）"""
+        snap = get_board_snapshot()
+        return snap.passengers_html, snap.drivers_html
 
 async def driver_card(self, event):
     await self.send_json({
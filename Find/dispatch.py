@@ -0,0 +1,168 @@
+"""
+背景派送佇列：把「交易提交後的廣播」移出 request 執行緒
+
+pax_accept / pax_reject / pax_update / join_driver / driver_manage 以前在回應前
+（或 transaction.on_commit 裡，一樣是同一條執行緒）做：再查 DB → 渲染模板 → Redis group_send。
+HTTP 回應因此要等這些都做完。
+
+現在改成：交易提交後只把工作丟進佇列就回應，由背景 worker 執行緒負責渲染與廣播。
+
+- FIND_DISPATCH_MODE："thread"（預設，背景 worker）或 "inline"（在呼叫端直接執行，除錯/測試用）
+- FIND_DISPATCH_WORKERS：worker 執行緒數（預設 1，廣播順序與提交順序一致）
+- FIND_DISPATCH_MAX_DEPTH：佇列上限；滿了就丟棄、計數並記 log。丟了就不會再送的工作
+  （changes.flush_changes 的卡片 / 管理頁、waitlist.notify_promoted）用 inline_if_full=True：
+  佇列滿了改在呼叫端直接執行（stats["inlined"]），回應慢一點但不會漏送
+- 同一個 key（預設 = 函式 + 參數）還在排隊時，再送進來會被合併，不會重複執行
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class DispatchQueue:
+    def __init__(self, *, mode: str = "thread", workers: int = 1, max_depth: int = 1000):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, max_depth))
+        self._pending_keys: set = set()
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+        self.stats = {
+            "submitted": 0,
+            "coalesced": 0,       # 同 key 已在佇列中，合併掉
+            "dropped": 0,         # 佇列滿了
+            "inlined": 0,         # 佇列滿了，inline_if_full 改在呼叫端執行
+            "processed": 0,
+            "failed": 0,
+            "max_depth": 0,
+            "wait_ms_total": 0.0,  # 排隊等待時間
+            "wait_ms_max": 0.0,
+            "run_ms_total": 0.0,   # 實際執行時間
+            "run_ms_max": 0.0,
+        }
+
+    # ---- 對外 API ----
+    def submit(self, fn, *args, key=None, inline_if_full: bool = False) -> bool:
+        """
+        丟一個工作進佇列；回傳是否有排進去 / 執行了（被合併或丟棄回 False）。
+        inline_if_full：佇列滿了不丟棄，直接在呼叫端執行
+        """
+        if key is None:
+            key = (getattr(fn, "__qualname__", repr(fn)),) + args
+
+        if self.mode == "inline":
+            with self._lock:
+                self.stats["submitted"] += 1
+            self._run(fn, args, time.monotonic())
+            return True
+
+        with self._lock:
+            self.stats["submitted"] += 1
+            if key in self._pending_keys:
+                self.stats["coalesced"] += 1
+                return False
+            try:
+                self._queue.put_nowait((key, fn, args, time.monotonic()))
+            except queue.Full:
+                if not inline_if_full:
+                    self.stats["dropped"] += 1
+                    logger.warning("dispatch queue full, dropped %s%r", getattr(fn, "__name__", fn), args)
+                    return False
+                self.stats["inlined"] += 1
+            else:
+                self._pending_keys.add(key)
+                self.stats["max_depth"] = max(self.stats["max_depth"], self._queue.qsize())
+                self._ensure_workers_locked()
+                return True
+        logger.warning("dispatch queue full, running %s%r inline", getattr(fn, "__name__", fn), args)
+        self._run(fn, args, time.monotonic())
+        return True
+
+    def on_commit(self, fn, *args, key=None, using: str = "find_db", inline_if_full: bool = False):
+        """交易提交後才排入佇列（不在交易中就立即排入）"""
+        transaction.on_commit(lambda: self.submit(fn, *args, key=key, inline_if_full=inline_if_full), using=using)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def join(self, timeout: float | None = None) -> bool:
+        """等佇列清空（測試 / benchmark 用）；逾時回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._pending_keys and self._queue.unfinished_tasks == 0:
+                    return True
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            data = dict(self.stats)
+        data["depth"] = self.depth
+        done = max(1, data["processed"] + data["failed"])
+        data["wait_ms_avg"] = data["wait_ms_total"] / done
+        data["run_ms_avg"] = data["run_ms_total"] / done
+        return data
+
+    # ---- worker ----
+    def _ensure_workers_locked(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker, name=f"find-dispatch-{len(self._threads)}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            key, fn, args, enqueued_at = self._queue.get()
+            with self._lock:
+                # 先移除 key：執行中若又有同 key 的工作進來，要再跑一次（拿最新狀態）
+                self._pending_keys.discard(key)
+            try:
+                self._run(fn, args, enqueued_at)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def _run(self, fn, args, enqueued_at):
+        started = time.monotonic()
+        wait_ms = (started - enqueued_at) * 1000
+        ok = True
+        try:
+            fn(*args)
+        except Exception:
+            ok = False
+            logger.exception("dispatch task failed: %s%r", getattr(fn, "__name__", fn), args)
+        run_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self.stats["processed" if ok else "failed"] += 1
+            self.stats["wait_ms_total"] += wait_ms
+            self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], wait_ms)
+            self.stats["run_ms_total"] += run_ms
+            self.stats["run_ms_max"] = max(self.stats["run_ms_max"], run_ms)
+
+
+dispatcher = DispatchQueue(
+    mode=getattr(settings, "FIND_DISPATCH_MODE", "thread"),
+    workers=getattr(settings, "FIND_DISPATCH_WORKERS", 1),
+    max_depth=getattr(settings, "FIND_DISPATCH_MAX_DEPTH", 1000),
+)
+
+
+def dispatch(fn, *args, key=None, inline_if_full: bool = False):
+    """立即排入背景佇列"""
+    return dispatcher.submit(fn, *args, key=key, inline_if_full=inline_if_full)
+
+
+def dispatch_on_commit(fn, *args, key=None, using: str = "find_db", inline_if_full: bool = False):
+    """find_db 交易提交後排入背景佇列"""
+    dispatcher.on_commit(fn, *args, key=key, using=using, inline_if_full=inline_if_full)
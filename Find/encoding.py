@@ -0,0 +1,141 @@
+"""
+WebSocket 傳輸編碼（可協商）
+
+事件內容大多是跳脫過的 HTML，json.dumps 又把中文寫成 \\uXXXX（一個字 6 bytes）。
+前端可以在建立連線時用 subprotocol 協商更精簡的格式：
+
+    new WebSocket(url, ["find.deflate", "find.msgpack", "find.json"])
+
+- find.json：純文字 JSON（沒帶 subprotocol 時的預設，舊前端不受影響）
+- find.msgpack：msgpack 二進位 frame（channels_redis 本來就依賴 msgpack）
+- find.deflate：JSON 再用 raw deflate 壓縮的二進位 frame，每則可以獨立解壓。
+  每條連線保留「最近送出的明文」（FIND_WS_DEFLATE_WBITS，預設 32KB）當作下一則的
+  預設字典（zdict），同一條連線上重複出現的卡片 HTML 只送引用，後面的訊息越送越小。
+  前端也保留同樣的明文尾巴，用 pako.inflateRaw(..., {dictionary}) 解壓，
+  所以訊息必須依序、每則解一次。
+
+伺服器偏好順序：FIND_WS_ENCODINGS（逗號分隔，預設 "deflate,msgpack,json"），
+取第一個前端也有提供的；都沒有就用 JSON。
+"""
+import json
+import zlib
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:  # channels_redis 沒裝就沒有
+    msgpack = None
+
+SUBPROTOCOL_PREFIX = "find."
+
+# 字典 = 最近 2**wbits bytes 的明文（每條連線常駐的記憶體也就是這麼多）；前端最多保留 32KB
+DEFLATE_WBITS = min(15, max(9, getattr(settings, "FIND_WS_DEFLATE_WBITS", 15)))
+DEFLATE_LEVEL = getattr(settings, "FIND_WS_DEFLATE_LEVEL", 6)
+
+
+def dumps(obj) -> str:
+    """所有要送給前端的 JSON 都用這個（中文直接輸出，不轉成 \\uXXXX）"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+class JsonCodec:
+    name = "json"
+    binary = False
+
+    def encode(self, obj) -> str:
+        return dumps(obj)
+
+    def encode_prepared(self, text: str, obj) -> str:
+        """text 是 dumps(obj) 已經序列化好的版本（快照 / board.delta），直接轉送"""
+        return text
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    binary = True
+
+    def encode(self, obj) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def encode_prepared(self, text: str, obj) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+
+class DeflateCodec:
+    name = "deflate"
+    binary = True
+
+    def __init__(self):
+        self._window = 1 << DEFLATE_WBITS
+        self._history = b""    # 這條連線最近送出的明文（下一則的字典）
+
+    def _compress(self, text: str) -> bytes:
+        raw = text.encode("utf-8")
+        if self._history:
+            c = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -DEFLATE_WBITS, zdict=self._history)
+        else:
+            c = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -DEFLATE_WBITS)
+        data = c.compress(raw) + c.flush()
+        self._history = (self._history + raw)[-self._window:]
+        return data
+
+    def encode(self, obj) -> bytes:
+        return self._compress(dumps(obj))
+
+    def encode_prepared(self, text: str, obj) -> bytes:
+        return self._compress(text)
+
+
+JSON = JsonCodec()   # 無狀態，所有連線共用
+
+
+def available_codecs() -> dict:
+    codecs = {"json": JsonCodec, "deflate": DeflateCodec}
+    if msgpack is not None:
+        codecs["msgpack"] = MsgpackCodec
+    return codecs
+
+
+def negotiate(subprotocols) -> tuple:
+    """
+    依伺服器偏好選出編碼。
+    回傳 (codec 實例, 要回覆給前端的 subprotocol 或 None)
+    """
+    offered = {p[len(SUBPROTOCOL_PREFIX):]: p for p in (subprotocols or []) if p.startswith(SUBPROTOCOL_PREFIX)}
+    codecs = available_codecs()
+    prefs = getattr(settings, "FIND_WS_ENCODINGS", "deflate,msgpack,json")
+    for name in (n.strip() for n in prefs.split(",")):
+        if name in offered and name in codecs:
+            codec = JSON if name == "json" else codecs[name]()
+            return codec, offered[name]
+    return JSON, None
+
+
+class NegotiatedEncodingMixin:
+    """
+    給 consumer 用：accept 時協商編碼，之後一律透過 send_event / send_prepared 送出。
+    """
+    codec = JSON
+
+    async def accept_negotiated(self):
+        self.codec, subprotocol = negotiate(self.scope.get("subprotocols"))
+        await self.accept(subprotocol=subprotocol)
+
+    def record_sent(self, kind, nbytes: int):
+        """送出後的 hook（metrics.InstrumentedConsumerMixin 會覆寫）"""
+
+    async def _send_encoded(self, data, kind=None):
+        if self.codec.binary:
+            await self.send(bytes_data=data)
+            self.record_sent(kind, len(data))
+        else:
+            await self.send(text_data=data)
+            self.record_sent(kind, len(data.encode("utf-8")))
+
+    async def send_event(self, obj):
+        await self._send_encoded(self.codec.encode(obj), obj.get("type"))
+
+    async def send_prepared(self, text: str, obj):
+        """已經 dumps 好的 payload：JSON 直接轉送，其他編碼用 obj 重新編碼"""
+        await self._send_encoded(self.codec.encode_prepared(text, obj), obj.get("type"))
@@ -0,0 +1,275 @@
+"""
+首頁篩選選項的計數（facet store）
+
+以前每次渲染首頁都要對 DriverTrip 跑兩次 GROUP BY COUNT（出發地 / 目的地），
+日期選項還要把整份司機清單讀進 Python 再收集。
+現在 FacetCount 存好「上架中的司機」在每個維度、每個值各有幾位：
+
+  dep / des：Location id（跟 driver_cards_qs 的地點篩選一樣，自填的地點算在最接近的城市）
+  date / ret：出發 / 回程日期（YYYY-MM-DD）
+
+DriverTrip 存檔 / 刪除時（signals.py）在同一個交易裡 +1 / -1：
+pre_save / pre_delete 先從 DB 讀出舊值，post_save 再讀一次新值比對（post_delete = 全部 -1）。
+讀取只碰 FacetCount（和 Location 的名稱），筆數 = 選項數，跟司機數量無關。
+
+bulk_create / bulk_update / update() 不會觸發 signals，那種情況跑 python manage.py rebuild_facets。
+
+drill-down（drilldown_counts）：使用者選了篩選條件之後，其他維度還剩幾位。
+FacetCount 只有全域計數，這裡另外把上架司機讀成一份精簡的 tuple 清單（依資料版本快取，
+同 snapshot.py），每次請求只在記憶體裡掃一遍、同時算出所有維度：
+每個維度的計數套用「其他維度」的篩選（自己這個維度的選擇不算，才能看到換成別的值有幾位）。
+"""
+import threading
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from .locations import resolve_location_filters
+from .models import DriverTrip, FacetCount, Location
+from .search import search_q
+from .snapshot import data_version
+
+DB_ALIAS = "find_db"
+DIMENSIONS = ("dep", "des", "date", "ret")
+
+# 會影響計數的欄位（存檔的 update_fields 都沒碰到就不用更新）
+FACET_FIELDS = frozenset({"is_active", "date", "return_date", "departure", "destination",
+                          "departure_loc", "destination_loc"})
+_COLUMNS = ("is_active", "departure_loc_id", "destination_loc_id", "date", "return_date")
+
+
+def _facets(is_active, dep, des, date, ret) -> set:
+    if not is_active:
+        return set()
+    out = {("date", str(date))}
+    if dep:
+        out.add(("dep", str(dep)))
+    if des:
+        out.add(("des", str(des)))
+    if ret:
+        out.add(("ret", str(ret)))
+    return out
+
+
+def stored_facets(pk, using: str = DB_ALIAS) -> set:
+    """
+    DB 裡目前這筆算進哪些 (dimension, value)；不存在 = 空集合。
+    存檔前後都從 DB 讀，不用 instance 上的值（date 可能還是表單送來的字串）
+    """
+    if pk is None:
+        return set()
+    row = DriverTrip.objects.using(using).filter(pk=pk).values_list(*_COLUMNS).first()
+    return _facets(*row) if row else set()
+
+
+def touches_facets(update_fields) -> bool:
+    return update_fields is None or bool(FACET_FIELDS & set(update_fields))
+
+
+def _bump(dimension, value, delta, using):
+    qs = FacetCount.objects.using(using).filter(dimension=dimension, value=value)
+    if qs.update(count=F("count") + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic(using=using):
+            FacetCount.objects.using(using).create(dimension=dimension, value=value, count=delta)
+    except IntegrityError:
+        # 同時有別的請求建了同一列
+        qs.update(count=F("count") + delta)
+
+
+def apply_facet_delta(old, new, using: str = DB_ALIAS):
+    """舊值 -1、新值 +1（依固定順序更新，避免兩個交易互相等鎖）"""
+    old, new = set(old), set(new)
+    changes = [(key, 1) for key in new - old] + [(key, -1) for key in old - new]
+    for (dimension, value), delta in sorted(changes):
+        _bump(dimension, value, delta, using)
+
+
+# ---- 讀取 ----
+def facet_counts(dimension: str, using: str = DB_ALIAS) -> dict:
+    return dict(
+        FacetCount.objects.using(using).filter(dimension=dimension, count__gt=0).values_list("value", "count")
+    )
+
+
+def location_facets(dimension: str, using: str = DB_ALIAS) -> list[tuple[str, int]]:
+    """dep / des → [(地點名稱, 司機數)]，依地理順序（Location.rank）再依名稱"""
+    counts = facet_counts(dimension, using)
+    locs = Location.objects.using(using).filter(id__in=[int(v) for v in counts]).order_by("rank", "name")
+    return [(loc.name, counts[str(loc.id)]) for loc in locs]
+
+
+def date_facets(dimension: str, using: str = DB_ALIAS) -> list[str]:
+    """date / ret → 有上架司機的日期（由早到晚）"""
+    return sorted(facet_counts(dimension, using))
+
+
+# ---- 重建 ----
+def compute_facets(using: str = DB_ALIAS) -> dict:
+    """直接從 DriverTrip 算：{(dimension, value): count}"""
+    active = DriverTrip.objects.using(using).filter(is_active=True)
+    out = {}
+    for dimension, field in (("dep", "departure_loc"), ("des", "destination_loc"),
+                             ("date", "date"), ("ret", "return_date")):
+        rows = (active.filter(**{f"{field}__isnull": False}).order_by()
+                .values_list(field).annotate(n=Count("id")))
+        out.update({(dimension, str(value)): n for value, n in rows})
+    return out
+
+
+def rebuild_facets(using: str = DB_ALIAS) -> int:
+    """整份重算；回傳有幾個 (dimension, value)"""
+    counts = compute_facets(using)
+    with transaction.atomic(using=using):
+        FacetCount.objects.using(using).all().delete()
+        FacetCount.objects.using(using).bulk_create(
+            [FacetCount(dimension=d, value=v, count=n) for (d, v), n in sorted(counts.items())],
+            batch_size=500)
+    return len(counts)
+
+
+# ---- drill-down：依目前篩選，各維度還剩幾位 ----
+DRILLDOWN_DIMENSIONS = ("dep", "des", "date", "ret", "gender", "seats", "fare")
+SEATS_FACET_MAX = 6       # 可用座位：≥1 … ≥6 各幾位
+FARE_BUCKETS = (("le100", 100), ("le300", 300), ("le500", 500), ("le1000", 1000))   # 之後是 gt1000
+
+# 一位上架司機 = 一個 tuple（欄位順序見 _ROW_FIELDS）
+_ROW_FIELDS = ("id", "departure_loc_id", "destination_loc_id", "date", "return_date", "gender",
+               "seats_total", "seats_filled", "fare_amount", "fare_is_free", "fare_note")
+_board = {}               # db alias -> (資料版本, rows, {location_id: (name, rank)})
+_board_lock = threading.Lock()
+
+
+def fare_bucket(amount, is_free) -> str:
+    if is_free:
+        return "free"
+    if amount is None:
+        return "other"     # 有寫費用但不是數字
+    for key, top in FARE_BUCKETS:
+        if amount <= top:
+            return key
+    return "gt1000"
+
+
+def _board_rows(using: str):
+    version = data_version()
+    cached = _board.get(using)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+    with _board_lock:
+        cached = _board.get(using)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        rows = tuple(
+            (i, dep, des, d.isoformat(), r.isoformat() if r else None, gender,
+             total - filled, amount, free, (note or "").lower())
+            for i, dep, des, d, r, gender, total, filled, amount, free, note in
+            DriverTrip.objects.using(using).filter(is_active=True).order_by().values_list(*_ROW_FIELDS)
+        )
+        locations = {i: (name, rank) for i, name, rank in
+                     Location.objects.using(using).values_list("id", "name", "rank")}
+        _board[using] = (version, rows, locations)
+        return rows, locations
+
+
+def _row_tests(f: dict, using: str) -> list:
+    """[(維度, row -> bool)]：只列出有設定的篩選；q 不是面板上的維度，當成一定要符合"""
+    tests = []
+    if f.get("dep_in"):
+        dep_ids = set(f["dep_loc_ids"])
+        tests.append(("dep", lambda r: r[1] in dep_ids))
+    if f.get("des_in"):
+        des_ids = set(f["des_loc_ids"])
+        tests.append(("des", lambda r: r[2] in des_ids))
+    if f.get("date_in"):
+        dates = set(f["date_in"])
+        tests.append(("date", lambda r: r[3] in dates))
+    if f.get("ret_in"):
+        rets = set(f["ret_in"])
+        tests.append(("ret", lambda r: r[4] in rets))
+    if f.get("gender_in"):
+        genders = set(f["gender_in"])
+        tests.append(("gender", lambda r: r[5] in genders))
+    if f.get("need_seats") is not None:
+        need = int(f["need_seats"])
+        tests.append(("seats", lambda r: r[6] >= need))
+
+    # 費用（同 driver_cards_qs：<= 門檻時免費也算）；費用關鍵字也算在費用這個維度
+    fare_num, fare_mode = f.get("fare_num"), f.get("fare_mode")
+    fare_q = (f.get("fare_q") or "").strip().lower()
+    if fare_num is not None and fare_mode in ("lte", "gte") or fare_q:
+        def fare_ok(r):
+            if fare_q and fare_q not in r[9]:
+                return False
+            if fare_num is None or fare_mode not in ("lte", "gte"):
+                return True
+            if fare_mode == "lte":
+                return r[8] or (r[7] is not None and r[7] <= fare_num)
+            return r[7] is not None and r[7] >= fare_num
+        tests.append(("fare", fare_ok))
+
+    if (f.get("q") or "").strip():
+        hits = set(DriverTrip.objects.using(using).filter(is_active=True)
+                   .filter(search_q(f["q"].strip())).values_list("id", flat=True))
+        tests.append(("q", lambda r: r[0] in hits))
+    return tests
+
+
+def drilldown_counts(filters: dict | None, using: str = DB_ALIAS) -> dict:
+    """
+    filters 同 driver_cards_qs。回傳：
+      total：符合全部篩選的司機數
+      dep / des：[(地點名稱, n)]（地理順序）、date / ret：[(YYYY-MM-DD, n)]
+      gender：{"M": n, ...}、seats：{"1": ≥1 個空位的司機數, ..., "6": ...}
+      fare：{"free" / "le100" / "le300" / "le500" / "le1000" / "gt1000" / "other": n}
+    """
+    f = resolve_location_filters(filters, using)
+    rows, locations = _board_rows(using)
+    tests = _row_tests(f, using)
+    counts = {dim: Counter() for dim in DRILLDOWN_DIMENSIONS}
+    total = 0
+
+    for r in rows:
+        failed = None
+        for dim, ok in tests:
+            if not ok(r):
+                if failed is not None:
+                    break          # 兩個以上的維度不符合：哪個維度都不算
+                failed = dim
+        else:
+            if failed is None:
+                total += 1
+            # 只有一個維度不符合：這位司機只算進那個維度（換成別的值就會出現）
+            if failed in (None, "dep") and r[1] is not None:
+                counts["dep"][r[1]] += 1
+            if failed in (None, "des") and r[2] is not None:
+                counts["des"][r[2]] += 1
+            if failed in (None, "date"):
+                counts["date"][r[3]] += 1
+            if failed in (None, "ret") and r[4] is not None:
+                counts["ret"][r[4]] += 1
+            if failed in (None, "gender"):
+                counts["gender"][r[5]] += 1
+            if failed in (None, "seats"):
+                for n in range(1, min(r[6], SEATS_FACET_MAX) + 1):
+                    counts["seats"][str(n)] += 1
+            if failed in (None, "fare"):
+                counts["fare"][fare_bucket(r[7], r[8])] += 1
+
+    def by_location(counter):
+        named = [(locations[i], n) for i, n in counter.items() if i in locations]
+        return [(name, n) for (name, rank), n in sorted(named, key=lambda x: (x[0][1], x[0][0]))]
+
+    return {
+        "total": total,
+        "dep": by_location(counts["dep"]),
+        "des": by_location(counts["des"]),
+        "date": sorted(counts["date"].items()),
+        "ret": sorted(counts["ret"].items()),
+        "gender": dict(counts["gender"]),
+        "seats": dict(counts["seats"]),
+        "fare": dict(counts["fare"]),
+    }
+
@@ -0,0 +1,422 @@
+"""
+座位帳本（選用）：熱門行程的座位計數放在 Redis，晚一點才寫回 find_db
+
+seats.py 的條件式 UPDATE 不必鎖到交易結束，但同一位司機的每次接受都還是打在 find_db 的同一列。
+熱門行程一貼出來，join_driver / pax_accept 同時湧進來，MySQL 仍然在那一列上排隊。
+
+FIND_SEAT_LEDGER = "redis" 時，seats.py 改在 Redis 裡扣座位：
+  find:seats:<司機 id>   hash  total / filled（目前已佔）/ base（find_db 目前的 seats_filled）/ ver
+  find:seats:dirty       set   filled 還沒寫回 find_db 的司機
+扣座位、還座位各是一支 Lua script（Redis 一次跑完一整支 script，同時進來的請求不會超賣）。
+第一次用到的司機從 find_db 載入，只在 key 不存在時寫入，多個程序同時載入也只會算一次。
+
+寫回（write-behind）：
+  - 背景執行緒每 FIND_SEAT_LEDGER_FLUSH_MS 毫秒把 dirty 的司機用一條 UPDATE 寫回 find_db
+  - 寫完後 ver 沒變才移出 dirty；寫回途中又有人扣座位的話，下一輪再寫一次
+  - 上下架判斷（seats.deactivate_if_full / reactivate_if_open）前會先寫回那位司機，
+    is_active 看到的是最新的座位數
+  - 多個程序的寫回用 Redis lock 排隊，舊值不會蓋掉新值
+
+啟動對帳（reconcile）：每個程序第一次用到帳本時跑一次，也可以手動跑 manage.py seat_ledger --reconcile
+  - find_db 的 seats_filled 跟 base 不一樣（帳本關閉期間，或在 admin 改過）：
+    filled 加上差額，兩邊的變動都保留
+  - seats_total 以 find_db 為準
+  - 最後把 dirty 全部寫回（上一個程序結束前沒寫完的部分）
+
+FIND_SEAT_LEDGER = "memory"：同樣的邏輯放在程序內，用一把 threading.Lock 代替 Redis 的單執行緒。
+給測試、壓測、單一程序的開發環境用。
+
+帳本不在 find_db 的交易裡：座位先在帳本扣，乘客狀態之後才寫進 find_db。
+會動到座位的交易用 seats.seat_transaction 包（可以巢狀），交易回滾時在帳本扣 / 還的座位反向做一次；
+外層如果是單純的 transaction.atomic，回滾時帳本不會跟著倒回：views.py 會動到座位的交易都用 seat_transaction。
+
+    python manage.py seat_ledger --status | --flush | --reconcile
+    python manage.py bench_seat_allocation --ledger         # 跟鎖司機列、條件式 UPDATE 比較
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from .changes import touch
+from .locations import DB_ALIAS
+from .models import DriverTrip
+from .snapshot import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "find:seats:"
+DIRTY = PREFIX + "dirty"
+FLUSH_LOCK = PREFIX + "flush"
+
+# reserve / release 的回傳：帳本裡沒有這位司機（呼叫端載入後再試一次）
+MISS = -1
+
+# KEYS[1] = 司機 hash，KEYS[2] = dirty set；ARGV[1] = 人數，ARGV[2] = 司機 id
+_RESERVE = """
+local t = redis.call('HMGET', KEYS[1], 'total', 'filled')
+if not t[1] then return -1 end
+local filled = tonumber(t[2]) + tonumber(ARGV[1])
+if filled > tonumber(t[1]) then return 0 end
+redis.call('HSET', KEYS[1], 'filled', filled)
+redis.call('HINCRBY', KEYS[1], 'ver', 1)
+redis.call('SADD', KEYS[2], ARGV[2])
+return 1
+"""
+
+_RELEASE = """
+local filled = redis.call('HGET', KEYS[1], 'filled')
+if not filled then return -1 end
+redis.call('HSET', KEYS[1], 'filled', math.max(0, tonumber(filled) - tonumber(ARGV[1])))
+redis.call('HINCRBY', KEYS[1], 'ver', 1)
+redis.call('SADD', KEYS[2], ARGV[2])
+return 1
+"""
+
+# ARGV[1] = seats_total，ARGV[2] = seats_filled（find_db）；已經有人載入過就不動
+_LOAD = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], 'total', ARGV[1], 'filled', ARGV[2], 'base', ARGV[2], 'ver', 0)
+return 1
+"""
+
+# 對帳：ARGV[1] = seats_total，ARGV[2] = find_db 的 seats_filled，ARGV[3] = 司機 id
+_REBASE = """
+local t = redis.call('HMGET', KEYS[1], 'filled', 'base')
+if not t[1] then return -1 end
+local db = tonumber(ARGV[2])
+local filled = math.max(0, tonumber(t[1]) + db - tonumber(t[2]))
+redis.call('HSET', KEYS[1], 'total', ARGV[1], 'filled', filled, 'base', db)
+redis.call('HINCRBY', KEYS[1], 'ver', 1)
+redis.call('SADD', KEYS[2], ARGV[3])
+return filled
+"""
+
+# 寫回完成：ARGV[1] = 寫回時的 ver，ARGV[2] = 寫進 find_db 的值，ARGV[3] = 司機 id
+_CLEAN = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('HSET', KEYS[1], 'base', ARGV[2])
+if redis.call('HGET', KEYS[1], 'ver') == ARGV[1] then redis.call('SREM', KEYS[2], ARGV[3]) end
+return 1
+"""
+
+
+class SeatLedger:
+    """共用的載入 / 寫回 / 對帳；底下的原子操作由 RedisLedger / MemoryLedger 實作"""
+
+    def __init__(self, using: str = DB_ALIAS):
+        self.using = using
+        self.stats = {"reserved": 0, "full": 0, "released": 0, "loads": 0, "flushes": 0, "written": 0}
+        self._reconciled = False
+        self._flusher = None
+        self._start_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    # ---- 原子操作（子類別實作）----
+    def _reserve(self, driver_id, n) -> int: raise NotImplementedError
+    def _release(self, driver_id, n) -> int: raise NotImplementedError
+    def _load(self, driver_id, total, filled): raise NotImplementedError
+    def _rebase(self, driver_id, total, db_filled): raise NotImplementedError
+    def _clean(self, driver_id, ver, written): raise NotImplementedError
+    def _read(self, driver_ids) -> dict: raise NotImplementedError   # id → (total, filled, ver)
+    def _base(self, driver_id): raise NotImplementedError
+    def _dirty(self) -> list: raise NotImplementedError
+    def _known(self) -> list: raise NotImplementedError
+    def _flush_lock(self): raise NotImplementedError
+    def forget(self, driver_id): raise NotImplementedError
+
+    # ---- 對外 API ----
+    def reserve(self, driver_id, n: int) -> bool:
+        """filled += n（座位夠才加）；成功回傳 True"""
+        self.start()
+        ok = self._with_load(self._reserve, driver_id, n)
+        self.stats["reserved" if ok else "full"] += 1
+        return ok
+
+    def release(self, driver_id, n: int) -> bool:
+        """filled -= n（不會小於 0）"""
+        self.start()
+        ok = self._with_load(self._release, driver_id, n)
+        if ok:
+            self.stats["released"] += 1
+        return ok
+
+    def seats(self, driver_id):
+        """(seats_total, 已佔座位)；司機不存在回傳 None"""
+        self.start()
+        row = self._read([driver_id]).get(driver_id)
+        if row is None:
+            if not self.load(driver_id):
+                return None
+            row = self._read([driver_id]).get(driver_id)
+        return row and row[:2]
+
+    def load(self, driver_id) -> bool:
+        row = (DriverTrip.objects.using(self.using).filter(id=driver_id)
+               .values_list("seats_total", "seats_filled").first())
+        if row is None:
+            return False
+        self._load(driver_id, *row)
+        self.stats["loads"] += 1
+        return True
+
+    def _with_load(self, op, driver_id, n) -> bool:
+        out = op(driver_id, n)
+        if out == MISS:
+            if not self.load(driver_id):
+                return False
+            out = op(driver_id, n)
+        return out == 1
+
+    def flush(self, driver_ids=None) -> int:
+        """dirty 的司機（或指定的司機）寫回 find_db.seats_filled；回傳寫了幾位"""
+        with self._flush_lock():
+            ids = self._dirty() if driver_ids is None else list(driver_ids)
+            rows = self._read(ids)
+            if not rows:
+                return 0
+            with transaction.atomic(using=self.using):
+                DriverTrip.objects.using(self.using).filter(id__in=list(rows)).update(seats_filled=Case(
+                    *[When(id=i, then=Value(filled)) for i, (_, filled, _) in rows.items()],
+                    output_field=IntegerField()))
+                # update() 不觸發 signals：資料版本、卡片廣播自己補（卡片看的是 find_db 的 seats_filled）
+                transaction.on_commit(bump_data_version, using=self.using)
+                touch(drivers=list(rows))
+                # 外層交易回滾的話，這幾位還留在 dirty，下一輪再寫
+                transaction.on_commit(lambda: self._cleaned(rows), using=self.using)
+        self.stats["flushes"] += 1
+        self.stats["written"] += len(rows)
+        return len(rows)
+
+    def _cleaned(self, rows):
+        for i, (_, filled, ver) in rows.items():
+            self._clean(i, ver, filled)
+
+    def reconcile(self) -> dict:
+        """find_db 跟帳本對帳，再把 dirty 全部寫回；回傳 {"drift": 調整過的司機數, "flushed": 寫回幾位}"""
+        drift = 0
+        known = self._known()
+        db = {i: (total, filled) for i, total, filled in DriverTrip.objects.using(self.using)
+              .filter(id__in=known).values_list("id", "seats_total", "seats_filled")}
+        rows = self._read(known)
+        with self._flush_lock():
+            for i in known:
+                if i not in db:
+                    self.forget(i)       # 司機已經刪除
+                    continue
+                total, filled = db[i]
+                base = self._base(i)
+                if base is not None and (base != filled or rows.get(i, (total,))[0] != total):
+                    self._rebase(i, total, filled)
+                    drift += 1
+        self._reconciled = True
+        return {"drift": drift, "flushed": self.flush()}
+
+    def sync_driver(self, driver_id):
+        """司機存檔（driver_manage 改了座位數）：帳本跟 find_db 的 seats_total / seats_filled 對一次"""
+        row = (DriverTrip.objects.using(self.using).filter(id=driver_id)
+               .values_list("seats_total", "seats_filled").first())
+        if row is not None and self._rebase(driver_id, *row) != MISS:
+            return
+        self.forget(driver_id)
+
+    # ---- 背景寫回 ----
+    def start(self):
+        """這個程序第一次用到帳本：先對帳，再開背景寫回（FIND_SEAT_LEDGER_FLUSH_MS = 0 就不開）"""
+        if self._flusher is not None:
+            return
+        with self._start_lock:
+            if self._flusher is not None:
+                return
+            if not self._reconciled:
+                try:
+                    self.reconcile()
+                except Exception:
+                    logger.exception("seat ledger reconcile failed")
+            interval = settings.FIND_SEAT_LEDGER_FLUSH_MS
+            self._flusher = threading.Thread(target=self._run, args=(interval / 1000,),
+                                             name="find-seat-ledger", daemon=True)
+            if interval > 0:
+                self._flusher.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("seat ledger flush failed")
+            finally:
+                close_old_connections()
+
+    def metrics(self) -> dict:
+        return dict(self.stats, dirty=len(self._dirty()), known=len(self._known()))
+
+
+class RedisLedger(SeatLedger):
+    def __init__(self, client, using: str = DB_ALIAS):
+        super().__init__(using)
+        self.client = client
+        self._scripts = {name: client.register_script(src) for name, src in (
+            ("reserve", _RESERVE), ("release", _RELEASE), ("load", _LOAD),
+            ("rebase", _REBASE), ("clean", _CLEAN))}
+
+    def _call(self, name, driver_id, *args):
+        return int(self._scripts[name](keys=[f"{PREFIX}{driver_id}", DIRTY], args=[*args, driver_id]))
+
+    def _reserve(self, driver_id, n):
+        return self._call("reserve", driver_id, n)
+
+    def _release(self, driver_id, n):
+        return self._call("release", driver_id, n)
+
+    def _load(self, driver_id, total, filled):
+        self._scripts["load"](keys=[f"{PREFIX}{driver_id}"], args=[total, filled])
+
+    def _rebase(self, driver_id, total, db_filled):
+        return self._call("rebase", driver_id, total, db_filled)
+
+    def _clean(self, driver_id, ver, written):
+        self._call("clean", driver_id, ver, written)
+
+    def _read(self, driver_ids):
+        ids = list(driver_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for i in ids:
+            pipe.hmget(f"{PREFIX}{i}", "total", "filled", "ver")
+        return {i: (int(t), int(f), int(v)) for i, (t, f, v) in zip(ids, pipe.execute()) if t is not None}
+
+    def _base(self, driver_id):
+        base = self.client.hget(f"{PREFIX}{driver_id}", "base")
+        return None if base is None else int(base)
+
+    def _dirty(self):
+        return sorted(int(i) for i in self.client.smembers(DIRTY))
+
+    def _known(self):
+        return sorted(int(k[len(PREFIX):]) for k in map(bytes.decode, self.client.scan_iter(f"{PREFIX}*"))
+                      if k[len(PREFIX):].isdigit())
+
+    def _flush_lock(self):
+        return self.client.lock(FLUSH_LOCK, timeout=30, blocking_timeout=10)
+
+    def forget(self, driver_id):
+        self.client.delete(f"{PREFIX}{driver_id}")
+        self.client.srem(DIRTY, driver_id)
+
+
+class MemoryLedger(SeatLedger):
+    """程序內的帳本：跟 RedisLedger 同樣的語意，一把鎖代替 Redis 的單執行緒"""
+
+    def __init__(self, using: str = DB_ALIAS):
+        super().__init__(using)
+        self._lock = threading.Lock()
+        self._rows: dict = {}      # id → {"total", "filled", "base", "ver"}
+        self._dirty_ids: set = set()
+        self._flushing = threading.Lock()
+
+    def _reserve(self, driver_id, n):
+        with self._lock:
+            r = self._rows.get(driver_id)
+            if r is None:
+                return MISS
+            if r["filled"] + n > r["total"]:
+                return 0
+            r["filled"] += n
+            r["ver"] += 1
+            self._dirty_ids.add(driver_id)
+            return 1
+
+    def _release(self, driver_id, n):
+        with self._lock:
+            r = self._rows.get(driver_id)
+            if r is None:
+                return MISS
+            r["filled"] = max(0, r["filled"] - n)
+            r["ver"] += 1
+            self._dirty_ids.add(driver_id)
+            return 1
+
+    def _load(self, driver_id, total, filled):
+        with self._lock:
+            self._rows.setdefault(driver_id, {"total": total, "filled": filled, "base": filled, "ver": 0})
+
+    def _rebase(self, driver_id, total, db_filled):
+        with self._lock:
+            r = self._rows.get(driver_id)
+            if r is None:
+                return MISS
+            r.update(total=total, filled=max(0, r["filled"] + db_filled - r["base"]), base=db_filled)
+            r["ver"] += 1
+            self._dirty_ids.add(driver_id)
+            return r["filled"]
+
+    def _clean(self, driver_id, ver, written):
+        with self._lock:
+            r = self._rows.get(driver_id)
+            if r is None:
+                return
+            r["base"] = written
+            if r["ver"] == ver:
+                self._dirty_ids.discard(driver_id)
+
+    def _read(self, driver_ids):
+        with self._lock:
+            return {i: (r["total"], r["filled"], r["ver"])
+                    for i in driver_ids if (r := self._rows.get(i)) is not None}
+
+    def _base(self, driver_id):
+        with self._lock:
+            r = self._rows.get(driver_id)
+            return None if r is None else r["base"]
+
+    def _dirty(self):
+        with self._lock:
+            return sorted(self._dirty_ids)
+
+    def _known(self):
+        with self._lock:
+            return sorted(self._rows)
+
+    def _flush_lock(self):
+        return self._flushing
+
+    def forget(self, driver_id):
+        with self._lock:
+            self._rows.pop(driver_id, None)
+            self._dirty_ids.discard(driver_id)
+
+
+_ledgers: dict = {}     # (模式, db alias) → 帳本
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(using: str = DB_ALIAS):
+    """FIND_SEAT_LEDGER 對應的帳本；關閉（""）回傳 None，seats.py 就直接在 find_db 扣座位"""
+    mode = settings.FIND_SEAT_LEDGER
+    if not mode:
+        return None
+    key = (mode, using)
+    if key not in _ledgers:
+        with _ledgers_lock:
+            if key not in _ledgers:
+                if mode == "memory":
+                    _ledgers[key] = MemoryLedger(using)
+                elif mode == "redis":
+                    import redis     # channels_redis 已經裝了 redis-py
+                    _ledgers[key] = RedisLedger(redis.Redis.from_url(settings.FIND_SEAT_LEDGER_URL), using)
+                else:
+                    raise ValueError(f"FIND_SEAT_LEDGER 不支援 {mode!r}（可用 '', 'redis', 'memory'）")
+    return _ledgers[key]
+
+
+def reset_ledgers():
+    """測試 / 壓測用：丟掉程序內的帳本（不會動到 Redis 裡的資料）"""
+    with _ledgers_lock:
+        for ledger in _ledgers.values():
+            ledger.stop()
+        _ledgers.clear()
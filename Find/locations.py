@@ -0,0 +1,87 @@
+"""
+出發地 / 目的地正規化
+
+DriverTrip.departure / destination 是自由文字（下拉選單或「自填」），以前地理排序與地點篩選
+都在每次查詢時對文字跑 CASE WHEN ... ICONTAINS（_city_rank_case）。
+現在存檔時先對應到 Location：
+
+  1) 正規化文字（去頭尾空白、壓縮空白、臺 → 台）
+  2) LocationAlias 有這個字串 → 直接用（一次索引查詢）
+  3) 沒有 → 找「最接近的已知城市」：依 rank 順序第一個被包含的已知地點
+     （跟 _city_rank_case 的規則一樣；「花蓮縣光復鄉大進村」→ 花蓮縣光復鄉）
+  4) 連城市都對不到 → 自己建一個 Location（rank = UNKNOWN_RANK）
+  然後把這個字串記成 alias，下次直接命中。
+
+已知地點（CITY_N2S）由 0015 migration 建好；既有的司機 / 乘客由 0015 / 0018 migration 補（之後要重對應跑 backfill_locations）。
+"""
+import re
+
+from django.db import IntegrityError, transaction
+
+from .models import Location, LocationAlias
+
+DB_ALIAS = "find_db"
+UNKNOWN_RANK = 999
+
+_known: dict = {}     # db alias -> [(name, location_id)]，依 rank 排序（migration 建的，不會變）
+
+
+def normalize_location(text) -> str:
+    text = re.sub(r"\s+", " ", str(text or "")).strip()
+    return text.replace("臺", "台")[:100]
+
+
+def known_locations(using: str = DB_ALIAS) -> list:
+    if using not in _known:
+        _known[using] = list(
+            Location.objects.using(using).filter(rank__lt=UNKNOWN_RANK)
+            .order_by("rank", "id").values_list("name", "id")
+        )
+    return _known[using]
+
+
+def nearest_known(text: str, using: str = DB_ALIAS):
+    for name, loc_id in known_locations(using):
+        if name in text:
+            return loc_id
+    return None
+
+
+def resolve_location_id(text, using: str = DB_ALIAS):
+    """文字 → Location id（必要時建立 Location / LocationAlias）；空白回傳 None"""
+    key = normalize_location(text)
+    if not key:
+        return None
+    loc_id = (LocationAlias.objects.using(using)
+              .filter(alias=key).values_list("location_id", flat=True).first())
+    if loc_id is not None:
+        return loc_id
+    loc_id = nearest_known(key, using)
+    if loc_id is None:
+        loc_id = Location.objects.using(using).get_or_create(
+            name=key, defaults={"rank": UNKNOWN_RANK})[0].id
+    try:
+        with transaction.atomic(using=using):
+            LocationAlias.objects.using(using).create(alias=key, location_id=loc_id)
+    except IntegrityError:
+        # 同時有別的請求建了同一個 alias：以先寫入的為準
+        loc_id = LocationAlias.objects.using(using).get(alias=key).location_id
+    return loc_id
+
+
+def location_ids(names, using: str = DB_ALIAS) -> list[int]:
+    """篩選用：名稱（標準名稱或任何 alias）→ Location id；對不到的名稱直接略過"""
+    keys = {normalize_location(n) for n in names or ()} - {""}
+    if not keys:
+        return []
+    return sorted(set(
+        LocationAlias.objects.using(using).filter(alias__in=keys).values_list("location_id", flat=True)
+    ))
+
+
+def resolve_location_filters(filters: dict, using: str = DB_ALIAS) -> dict:
+    """dep_in / des_in（名稱）→ 加上 dep_loc_ids / des_loc_ids（給 subscriptions.card_matches 用）"""
+    f = dict(filters or {})
+    f["dep_loc_ids"] = location_ids(f.get("dep_in"), using) if f.get("dep_in") else None
+    f["des_loc_ids"] = location_ids(f.get("des_in"), using) if f.get("des_in") else None
+    return f
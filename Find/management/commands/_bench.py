@@ -0,0 +1,113 @@
+"""
+benchmark 指令共用的小工具（檔名底線開頭，Django 不會把它當成指令）
+
+所有 bench_* 指令都跑在「測試資料庫」上（跟 manage.py test 一樣會建立 test_<NAME>），
+不會動到正式的 find_db。
+"""
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from Find.facets import rebuild_facets
+from Find.locations import resolve_location_id
+from Find.models import DriverTrip, PassengerRequest, parse_fare_note
+from Find.search import reindex_drivers
+from Find.views import CITY_N2S
+
+DB_ALIAS = "find_db"
+
+
+IN_MEMORY_LAYER = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+@contextmanager
+def isolated_databases(verbosity: int = 0, channel_layers: dict | None = None):
+    """
+    建立 / 拆除測試資料庫（default + find_db）。
+    channel layer 預設換成 in-memory，避免 benchmark 的廣播跑到正式的 Redis。
+    """
+    from channels.layers import channel_layers as layers
+    from django.test.utils import (
+        override_settings, setup_databases, setup_test_environment,
+        teardown_databases, teardown_test_environment,
+    )
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity, interactive=False, aliases={"default", DB_ALIAS})
+    layers.backends = {}
+    try:
+        with override_settings(CHANNEL_LAYERS=channel_layers or IN_MEMORY_LAYER):
+            yield
+    finally:
+        layers.backends = {}
+        teardown_databases(old_config, verbosity)
+        teardown_test_environment()
+
+
+def seed_board(n_drivers: int, pax_per_driver: int = 2, unassigned: int = 0, seed: int = 42):
+    """以 bulk_create 灌假資料（不會觸發 signals）；回傳 driver id 清單"""
+    rnd = random.Random(seed)
+    today = date.today()
+    drivers = [
+        DriverTrip(
+            driver_name=f"司機{i}",
+            contact=f"09{rnd.randint(10000000, 99999999)}",
+            password="0000",
+            gender=rnd.choice("MFX"),
+            seats_total=rnd.randint(2, 6),
+            seats_filled=0,
+            departure=rnd.choice(CITY_N2S),
+            destination=rnd.choice(CITY_N2S),
+            fare_note=rnd.choice(["免費", "待定", "200", "NT$350", "500元", None]),
+            date=today + timedelta(days=rnd.randint(0, 14)),
+            note=f"備註 {i}，可放行李" if rnd.random() < 0.5 else None,
+        )
+        for i in range(n_drivers)
+    ]
+    locs = {name: resolve_location_id(name, DB_ALIAS) for name in CITY_N2S}
+    for d in drivers:   # bulk_create 不經過 save()
+        d.fare_amount, d.fare_is_free = parse_fare_note(d.fare_note)
+        d.departure_loc_id, d.destination_loc_id = locs[d.departure], locs[d.destination]
+    DriverTrip.objects.using(DB_ALIAS).bulk_create(drivers, batch_size=500)
+    driver_ids = list(DriverTrip.objects.using(DB_ALIAS).order_by("id").values_list("id", flat=True))
+
+    pax = []
+    for did, d in zip(driver_ids, drivers):
+        for j in range(pax_per_driver):
+            pax.append(PassengerRequest(
+                passenger_name=f"乘客{did}-{j}", contact="line:abc", password="0000",
+                seats_needed=1, departure=d.departure, destination=d.destination, date=d.date,
+                note="", driver_id=did, is_matched=(j % 2 == 1),
+            ))
+    for k in range(unassigned):
+        pax.append(PassengerRequest(
+            passenger_name=f"散客{k}", contact="", password="0000", seats_needed=rnd.randint(1, 3),
+            departure=rnd.choice(CITY_N2S), destination=rnd.choice(CITY_N2S),
+            date=today + timedelta(days=rnd.randint(0, 14)), note="",
+        ))
+    for p in pax:
+        p.departure_loc_id, p.destination_loc_id = locs[p.departure], locs[p.destination]
+    PassengerRequest.objects.using(DB_ALIAS).bulk_create(pax, batch_size=500)
+    reindex_drivers(driver_ids, using=DB_ALIAS)
+    rebuild_facets(DB_ALIAS)
+    return driver_ids
+
+
+class Timer:
+    """with Timer() as t: ...；t.ms = 經過毫秒"""
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self._t0) * 1000
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    k = max(0, min(len(vals) - 1, int(round(pct / 100.0 * (len(vals) - 1)))))
+    return vals[k]
@@ -0,0 +1,45 @@
+"""
+批次自動媒合（matching.py）：未指派的乘客 × 還有空位的司機
+
+    python manage.py auto_match              # 只列出提案（依路線、日期分組）
+    python manage.py auto_match --apply      # 寫入：乘客掛到司機的待確認，由司機在管理頁一次接受
+
+可以排程定期跑；寫入前會再確認乘客還沒被指派，跟手動報名同時發生也不會重複掛。
+"""
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from Find.matching import apply_plan, plan_matches
+from Find.models import Location
+
+DB_ALIAS = "find_db"
+
+
+class Command(BaseCommand):
+    help = "計算未指派乘客與有空位司機的媒合提案（--apply 寫入待確認）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--apply", action="store_true", help="把提案寫入司機的待確認")
+        parser.add_argument("--window", type=int, default=None, help="日期最多差幾天（預設 FIND_ROUTE_DATE_WINDOW）")
+
+    def handle(self, *args, **opts):
+        plan = plan_matches(DB_ALIAS, window=opts["window"])
+        names = dict(Location.objects.using(DB_ALIAS).values_list("id", "name"))
+
+        groups = defaultdict(list)
+        for prop in plan.proposals:
+            groups[(prop.route, prop.date)].append(prop)
+        for (route, day), props in sorted(groups.items(), key=lambda t: (t[0][1], t[0][0])):
+            dep, des = (names.get(i, "?") for i in route)
+            self.stdout.write(f"{day} {dep} → {des}")
+            for prop in props:
+                self.stdout.write(f"  司機 #{prop.driver_id}：{prop.seats} 位（乘客 {', '.join(map(str, prop.passenger_ids))}）")
+
+        self.stdout.write(
+            f"配到 {plan.seats_matched} / {plan.seats_requested} 位"
+            f"（上界 {plan.seats_bound}、局部改善 {plan.moves} 次），{len(plan.unmatched)} 筆乘客沒配到")
+        if opts["apply"]:
+            applied = apply_plan(plan, DB_ALIAS)
+            n = sum(len(ids) for ids in applied.values())
+            self.stdout.write(self.style.SUCCESS(f"已掛到 {len(applied)} 位司機的待確認，共 {n} 筆乘客"))
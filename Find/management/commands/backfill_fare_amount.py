@@ -0,0 +1,45 @@
+"""
+依 fare_note 重算既有司機的 fare_amount / fare_is_free（0014 migration 會算一次；改了 parse_fare_note 之後再跑）。
+
+    python manage.py backfill_fare_amount
+    python manage.py backfill_fare_amount --batch-size 500 --dry-run
+
+之後的新增 / 修改都會在 DriverTrip.save() 時自動算，不用再跑。
+分批依 id 往後讀、用 bulk_update 寫回（不觸發 signals，不會廣播）。
+"""
+from django.core.management.base import BaseCommand
+
+from Find.models import DriverTrip, parse_fare_note
+
+DB_ALIAS = "find_db"
+
+
+class Command(BaseCommand):
+    help = "依 fare_note 重算 DriverTrip.fare_amount / fare_is_free"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="只統計會改幾筆，不寫入")
+
+    def handle(self, *args, **opts):
+        batch_size = max(1, opts["batch_size"])
+        qs = DriverTrip.objects.using(DB_ALIAS).order_by("id")
+        last_id, scanned, changed = 0, 0, 0
+        while True:
+            rows = list(qs.filter(id__gt=last_id).only("id", "fare_note", "fare_amount", "fare_is_free")[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1].id
+            scanned += len(rows)
+            dirty = []
+            for d in rows:
+                amount, free = parse_fare_note(d.fare_note)
+                if (d.fare_amount, d.fare_is_free) != (amount, free):
+                    d.fare_amount, d.fare_is_free = amount, free
+                    dirty.append(d)
+            changed += len(dirty)
+            if dirty and not opts["dry_run"]:
+                DriverTrip.objects.using(DB_ALIAS).bulk_update(dirty, ["fare_amount", "fare_is_free"])
+
+        verb = "需要更新" if opts["dry_run"] else "已更新"
+        self.stdout.write(self.style.SUCCESS(f"掃描 {scanned} 筆，{verb} {changed} 筆"))
@@ -0,0 +1,61 @@
+"""
+把既有司機 / 乘客的 departure / destination 對應到 Location（0015、0018 migration 會各補一次；
+bulk 匯入 / update() 改了地點、或對應規則改了之後再跑）。
+
+    python manage.py backfill_locations
+    python manage.py backfill_locations --batch-size 500 --dry-run
+
+之後的新增 / 修改都會在 DriverTrip.save() / PassengerRequest.save() 時自動對應，不用再跑。
+分批依 id 往後讀、用 bulk_update 寫回（不觸發 signals，不會廣播），最後重算篩選選項的計數（facets.py）。
+--dry-run 仍會建立缺少的 Location / alias（對應規則需要它們），只是不改司機 / 乘客資料。
+"""
+from django.core.management.base import BaseCommand
+
+from Find.facets import rebuild_facets
+from Find.locations import resolve_location_id
+from Find.models import DriverTrip, PassengerRequest
+
+DB_ALIAS = "find_db"
+
+
+class Command(BaseCommand):
+    help = "把 DriverTrip / PassengerRequest 的 departure / destination 對應到 Location"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="只統計會改幾筆，不寫入司機 / 乘客資料")
+
+    def handle(self, *args, **opts):
+        resolved = {}     # 同一批常常是同樣幾個地名
+        verb = "需要更新" if opts["dry_run"] else "已更新"
+        for model, label in ((DriverTrip, "司機"), (PassengerRequest, "乘客")):
+            scanned, changed = self._backfill(model, resolved, opts)
+            if model is DriverTrip and changed and not opts["dry_run"]:
+                rebuild_facets(DB_ALIAS)
+            self.stdout.write(self.style.SUCCESS(f"{label}：掃描 {scanned} 筆，{verb} {changed} 筆"))
+        self.stdout.write(f"共 {len(resolved)} 個不同地名")
+
+    def _backfill(self, model, resolved, opts):
+        batch_size = max(1, opts["batch_size"])
+        qs = model.objects.using(DB_ALIAS).order_by("id").only(
+            "id", "departure", "destination", "departure_loc", "destination_loc")
+        last_id, scanned, changed = 0, 0, 0
+        while True:
+            rows = list(qs.filter(id__gt=last_id)[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1].id
+            scanned += len(rows)
+            dirty = []
+            for d in rows:
+                for text in (d.departure, d.destination):
+                    if text not in resolved:
+                        resolved[text] = resolve_location_id(text, DB_ALIAS)
+                dep, des = resolved[d.departure], resolved[d.destination]
+                if (d.departure_loc_id, d.destination_loc_id) != (dep, des):
+                    d.departure_loc_id, d.destination_loc_id = dep, des
+                    dirty.append(d)
+            changed += len(dirty)
+            if dirty and not opts["dry_run"]:
+                model.objects.using(DB_ALIAS).bulk_update(dirty, ["departure_loc", "destination_loc"])
+        return scanned, changed
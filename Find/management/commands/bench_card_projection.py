@@ -0,0 +1,85 @@
+"""
+首頁清單：整列讀取 vs 只讀卡片欄位（cards.py）
+
+    python manage.py bench_card_projection --drivers 2000 --pax-per-driver 3 --pad 300
+
+- 在測試資料庫灌 --drivers 位司機，備註 / 司機備忘 / email 補到 --pad 個字，模擬實際資料
+- 每種讀法各渲染一次「首頁第一頁」與「整份清單」（以前 index 的作法），
+  把跑過的 SELECT 再執行一次，統計讀回來的列數與位元組數（字串以 UTF-8 計）
+"""
+from datetime import date as _date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
+
+from Find.models import DriverTrip, PassengerRequest
+from Find.views import driver_cards_page
+
+from ._bench import DB_ALIAS, Timer, isolated_databases, seed_board
+
+
+def _nbytes(v) -> int:
+    if v is None:
+        return 0
+    if isinstance(v, str):
+        return len(v.encode("utf-8"))
+    if isinstance(v, (bytes, memoryview)):
+        return len(v)
+    if isinstance(v, (_date, Decimal)):
+        return len(str(v))
+    return 8
+
+
+def fetched(conn, captured) -> tuple[int, int]:
+    """重跑這些 SELECT，回傳 (列數, 位元組數)"""
+    rows = nbytes = 0
+    with conn.cursor() as cursor:
+        for q in captured:
+            if not q["sql"].lstrip().upper().startswith("SELECT"):
+                continue
+            cursor.execute(q["sql"])
+            for row in cursor.fetchall():
+                rows += 1
+                nbytes += sum(_nbytes(v) for v in row)
+    return rows, nbytes
+
+
+class Command(BaseCommand):
+    help = "首頁清單：整列讀取 vs 只讀卡片欄位的列數 / 位元組數 / 渲染時間"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", type=int, default=2000)
+        parser.add_argument("--pax-per-driver", type=int, default=3)
+        parser.add_argument("--pad", type=int, default=300, help="備註 / 司機備忘的字數")
+
+    def handle(self, *args, **opts):
+        with isolated_databases():
+            seed_board(opts["drivers"], opts["pax_per_driver"], unassigned=0)
+            pad = "備" * opts["pad"]
+            # update() 不觸發 signals：這裡只是把欄位塞大，索引 / 計數用不到
+            DriverTrip.objects.using(DB_ALIAS).update(note=pad, email="driver@example.com")
+            PassengerRequest.objects.using(DB_ALIAS).update(
+                note=pad, driver_memo=pad, email="passenger@example.com", contact="0912-345-678")
+            self._run(opts["drivers"])
+
+    def _run(self, n_drivers):
+        conn = connections[DB_ALIAS]
+        w = self.stdout.write
+        w(f"{'render':<12}{'fields':<8}{'queries':>8}{'rows':>10}{'bytes':>14}{'ms':>10}")
+        for label, limit in (("first page", settings.FIND_PAGE_SIZE), ("full list", n_drivers)):
+            base = None
+            for only_card_fields in (False, True):
+                with CaptureQueriesContext(conn) as ctx, Timer() as t:
+                    drivers, _ = driver_cards_page(sort="date_desc", limit=limit,
+                                                   only_card_fields=only_card_fields)
+                    for d in drivers:
+                        render_to_string("Find/_driver_card.html", {"d": d})
+                rows, nbytes = fetched(conn, ctx.captured_queries)
+                base = base or nbytes
+                w(f"{label:<12}{'card' if only_card_fields else 'all':<8}{len(ctx.captured_queries):>8}"
+                  f"{rows:>10,}{nbytes:>14,}{t.ms:>10.1f}"
+                  + (f"   ({nbytes / base:.0%} of all)" if only_card_fields else ""))
@@ -0,0 +1,93 @@
+"""
+量測每一種變更「整份清單廣播」與「差量廣播」各送出多少位元組。
+
+    python manage.py bench_delta_bytes --drivers 200 --pax-per-driver 4
+"""
+import json
+
+from django.core.management.base import BaseCommand
+
+from Find.broadcast import BoardDeltaBuilder, render_board_lists
+from Find.models import DriverTrip, PassengerRequest
+
+from ._bench import DB_ALIAS, isolated_databases, seed_board
+
+
+class Command(BaseCommand):
+    help = "比較 send.update（整份 HTML）與 board.delta（差量）每次變更的廣播大小"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", type=int, default=200)
+        parser.add_argument("--pax-per-driver", type=int, default=4)
+        parser.add_argument("--unassigned", type=int, default=50)
+
+    def handle(self, *args, **opts):
+        with isolated_databases():
+            driver_ids = seed_board(opts["drivers"], opts["pax_per_driver"], opts["unassigned"])
+            self._run(driver_ids)
+
+    def _run(self, driver_ids):
+        builder = BoardDeltaBuilder()
+        # 先讓 builder 記住目前所有卡片（等同於已經廣播過一次）
+        builder.build(driver_ids, [])
+        db = DriverTrip.objects.using(DB_ALIAS)
+        pdb = PassengerRequest.objects.using(DB_ALIAS)
+        target = driver_ids[len(driver_ids) // 2]
+
+        def seats_change():
+            db.filter(id=target).update(seats_total=9)
+            return [target], []
+
+        def pax_join():
+            d = db.get(id=target)
+            p = pdb.create(passenger_name="新乘客", seats_needed=1, departure=d.departure,
+                           destination=d.destination, date=d.date, driver=d)
+            return [target], [p.id]
+
+        def pax_accept():
+            p = pdb.filter(driver_id=target, is_matched=False).first()
+            pdb.filter(id=p.id).update(is_matched=True)
+            db.filter(id=target).update(seats_filled=1)
+            return [target], [p.id]
+
+        def driver_added():
+            d = db.create(driver_name="新司機", seats_total=4, departure="台北市",
+                          destination="花蓮縣光復鄉", date=db.get(id=target).date)
+            return [d.id], []
+
+        def driver_removed():
+            db.filter(id=target).update(is_active=False)
+            return [target], []
+
+        def passenger_added():
+            p = pdb.create(passenger_name="散客新", seats_needed=2, departure="台中市",
+                           destination="花蓮縣光復鄉", date=db.get(id=driver_ids[0]).date)
+            return [], [p.id]
+
+        scenarios = [
+            ("seats_changed", seats_change),
+            ("pax_join", pax_join),
+            ("pax_accept", pax_accept),
+            ("driver_added", driver_added),
+            ("driver_removed", driver_removed),
+            ("passenger_added", passenger_added),
+        ]
+
+        self.stdout.write(f"{'change':<18}{'full bytes':>14}{'delta bytes':>14}{'ratio':>10}  events")
+        total_full = total_delta = 0
+        for name, mutate in scenarios:
+            d_ids, p_ids = mutate()
+            drivers_html, passengers_html, _next = render_board_lists()
+            full = len(json.dumps({
+                "type": "send.update",
+                "drivers_html": drivers_html,
+                "passengers_html": passengers_html,
+                "sort": None,
+            }).encode("utf-8"))
+            events, _cards = builder.build(d_ids, p_ids)
+            delta = len(json.dumps({"type": "board.delta", "events": events}).encode("utf-8"))
+            total_full += full
+            total_delta += delta
+            kinds = ",".join(e["type"] for e in events)
+            self.stdout.write(f"{name:<18}{full:>14,}{delta:>14,}{full / max(delta, 1):>9.1f}x  {kinds}")
+        self.stdout.write(f"{'total':<18}{total_full:>14,}{total_delta:>14,}{total_full / max(total_delta, 1):>9.1f}x")
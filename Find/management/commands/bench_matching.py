@@ -0,0 +1,37 @@
+"""
+批次自動媒合（matching.py）的時間與配對率
+
+    python manage.py bench_matching --sizes 1000,5000,10000 --drivers-ratio 0.3
+
+- 在測試資料庫灌 N 位未指派乘客、N × ratio 位司機（seed_board：起訖隨機、日期在 14 天內）
+- 分別計時「讀取（load_board）」「求解（solve）」，印出配到的座位數與上界（plan.seats_bound）
+- solve 只算提案、不寫入；上界不一定達得到（乘客一組人不能拆開坐）
+"""
+from django.core.management.base import BaseCommand
+
+from Find.matching import load_board, solve
+
+from ._bench import DB_ALIAS, Timer, isolated_databases, seed_board
+
+
+class Command(BaseCommand):
+    help = "批次自動媒合：1k / 5k / 10k 位乘客的求解時間與配對率"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,5000,10000")
+        parser.add_argument("--drivers-ratio", type=float, default=0.3)
+
+    def handle(self, *args, **opts):
+        sizes = [int(s) for s in opts["sizes"].split(",") if s.strip()]
+        w = self.stdout.write
+        w(f"{'passengers':>10}{'drivers':>9}{'load ms':>10}{'solve ms':>10}"
+          f"{'seats':>8}{'matched':>9}{'bound':>8}{'moves':>7}")
+        for n in sizes:
+            with isolated_databases():
+                seed_board(max(1, int(n * opts["drivers_ratio"])), pax_per_driver=0, unassigned=n)
+                with Timer() as t_load:
+                    passengers, drivers = load_board(DB_ALIAS)
+                with Timer() as t_solve:
+                    plan = solve(passengers, drivers, using=DB_ALIAS)
+                w(f"{len(passengers):>10,}{len(drivers):>9,}{t_load.ms:>10.1f}{t_solve.ms:>10.1f}"
+                  f"{plan.seats_requested:>8,}{plan.seats_matched:>9,}{plan.seats_bound:>8,}{plan.moves:>7,}")
@@ -0,0 +1,75 @@
+"""
+首頁關鍵字搜尋：舊的 icontains 全表掃描 vs n-gram 索引（search.py）
+
+    python manage.py bench_search --drivers 20000 --pax-per-driver 3 --repeat 20
+
+- 在測試資料庫灌 --drivers 位司機（每位 --pax-per-driver 位乘客）並建索引
+- 每個查詢各跑 --repeat 次，比較 p50 / p95（毫秒），並確認兩邊回傳的司機 id 完全相同
+"""
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from Find.models import DriverTrip
+from Find.search import search_q
+
+from ._bench import DB_ALIAS, Timer, isolated_databases, percentile, seed_board
+
+QUERIES = ["行李", "司機123", "備註 99", "花蓮縣光復鄉", "台北", "免費", "乘客4", "line", "不存在的字", "光"]
+
+
+def legacy_filter(qs, qkw):
+    """舊版 driver_cards_qs 的 q（10 個欄位 icontains OR，join 乘客再 distinct）"""
+    for t in [t for t in re.split(r"\s+", qkw) if t]:
+        qs = qs.filter(
+            Q(driver_name__icontains=t) | Q(contact__icontains=t) | Q(email__icontains=t) |
+            Q(departure__icontains=t) | Q(destination__icontains=t) | Q(note__icontains=t) |
+            Q(fare_note__icontains=t) | Q(flexible_pickup__icontains=t) |
+            Q(passengers__passenger_name__icontains=t) | Q(passengers__note__icontains=t)
+        )
+    return qs.distinct()
+
+
+class Command(BaseCommand):
+    help = "首頁關鍵字搜尋：icontains vs n-gram 索引的延遲與結果一致性"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", type=int, default=20000)
+        parser.add_argument("--pax-per-driver", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--query", action="append", help="自訂查詢（可重複）；預設跑內建的一組")
+
+    def handle(self, *args, **opts):
+        with isolated_databases():
+            with Timer() as t:
+                seed_board(opts["drivers"], opts["pax_per_driver"], unassigned=0)
+            self.stdout.write(f"seed + 建索引 {opts['drivers']:,} 位司機：{t.ms / 1000:.1f}s")
+            self._run(opts["query"] or QUERIES, opts["repeat"])
+
+    def _time(self, fn, repeat):
+        ms = []
+        for _ in range(repeat):
+            with Timer() as t:
+                fn()
+            ms.append(t.ms)
+        return ms
+
+    def _run(self, queries, repeat):
+        base = DriverTrip.objects.using(DB_ALIAS).filter(is_active=True)
+        w = self.stdout.write
+        w(f"{'query':<16}{'hits':>8}{'icontains p50':>16}{'p95':>10}{'ngram p50':>12}{'p95':>10}{'speedup':>10}")
+        for qkw in queries:
+            def old():
+                return sorted(legacy_filter(base, qkw).values_list("id", flat=True))
+
+            def new():
+                return sorted(base.filter(search_q(qkw)).values_list("id", flat=True))
+
+            expected, got = old(), new()
+            if expected != got:
+                raise CommandError(f"{qkw!r}：結果不一致（icontains {len(expected)} 筆，索引 {len(got)} 筆）")
+            old_ms, new_ms = self._time(old, repeat), self._time(new, repeat)
+            w(f"{qkw:<16}{len(got):>8,}{percentile(old_ms, 50):>16.1f}{percentile(old_ms, 95):>10.1f}"
+              f"{percentile(new_ms, 50):>12.1f}{percentile(new_ms, 95):>10.1f}"
+              f"{percentile(old_ms, 50) / max(percentile(new_ms, 50), 1e-6):>9.1f}x")
@@ -0,0 +1,160 @@
+"""
+座位扣減的併發壓測：鎖司機列（舊作法） vs 條件式 UPDATE（seats.py） vs 座位帳本（ledger.py）
+
+    python manage.py bench_seat_allocation --workers 16 --passengers 400 --seats 50 --hold-ms 5
+    python manage.py bench_seat_allocation --ledger                                # 加跑帳本（程序內）
+    python manage.py bench_seat_allocation --ledger --redis-url redis://127.0.0.1:6379/15
+
+- 一位司機 --seats 個座位，底下 --passengers 位待確認乘客（各 1～2 人）
+- --workers 條執行緒同時接受乘客，直到每位乘客都試過一次
+- locked：select_for_update 讀 seats_filled → Python 判斷 → save()；
+  --hold-ms 模擬拿著鎖做別的事（以前接受後還在交易裡渲染、查詢）
+- conditional：seats.accept_passenger（一條 UPDATE ... WHERE seats_filled + n <= seats_total）
+- ledger：同一個 accept_passenger，座位改在帳本扣（--redis-url 指定就用那台 Redis，
+  沒指定就用程序內的 MemoryLedger 代替 Redis）；背景每 --flush-ms 寫回 find_db，
+  跑完再寫回一次才檢查 seats_filled
+- 印出耗時、每秒處理幾位乘客、接受的人數、超賣人數（接受的人數 - 座位），
+  以及 seats_filled 是否等於已接受乘客的人數合計；遇到資料庫鎖逾時 / 死結會重試並計數
+
+sqlite 不支援 SELECT ... FOR UPDATE（Django 直接略過）：locked 是「先讀後寫」的交易，
+同時有人寫入時升級寫鎖會直接失敗（database is locked）→ 重試；MySQL 上則是排隊等列鎖。
+"""
+import queue
+import random
+from contextlib import contextmanager
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import Sum
+from django.test.utils import override_settings
+
+from Find.ledger import get_ledger, reset_ledgers
+from Find.models import DriverTrip, PassengerRequest
+from Find.seats import ACCEPTED, accept_passenger
+
+from ._bench import DB_ALIAS, Timer, isolated_databases
+
+
+def accept_locked(driver_id, pax_id, hold_ms):
+    with transaction.atomic(using=DB_ALIAS):
+        d = DriverTrip.objects.using(DB_ALIAS).select_for_update().get(id=driver_id)
+        p = PassengerRequest.objects.using(DB_ALIAS).select_for_update().get(id=pax_id)
+        if p.is_matched or d.seats_filled + p.seats_needed > d.seats_total:
+            return False
+        d.seats_filled += p.seats_needed
+        p.is_matched = True
+        p.save(using=DB_ALIAS, update_fields=["is_matched"])
+        d.save(using=DB_ALIAS, update_fields=["seats_filled"])
+        if hold_ms:
+            time.sleep(hold_ms / 1000)
+        return True
+
+
+def accept_conditional(driver_id, pax_id, hold_ms):
+    return accept_passenger(driver_id, pax_id, DB_ALIAS) == ACCEPTED
+
+
+class Command(BaseCommand):
+    help = "座位扣減併發壓測：select_for_update vs 條件式 UPDATE"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=16)
+        parser.add_argument("--passengers", type=int, default=400)
+        parser.add_argument("--seats", type=int, default=50)
+        parser.add_argument("--hold-ms", type=float, default=5.0)
+        parser.add_argument("--retries", type=int, default=20)
+        parser.add_argument("--ledger", action="store_true", help="加跑座位帳本（ledger.py）")
+        parser.add_argument("--redis-url", default="", help="帳本用的 Redis（會清掉 find:seats:*）；不給就用程序內的帳本")
+        parser.add_argument("--flush-ms", type=int, default=200, help="帳本寫回 find_db 的間隔")
+
+    def handle(self, *args, **opts):
+        with isolated_databases():
+            d = DriverTrip.objects.using(DB_ALIAS).create(
+                driver_name="熱門行程", contact="", seats_total=opts["seats"], departure="台北市",
+                destination="花蓮縣光復鄉", date="2030-01-01")
+            rnd = random.Random(42)
+            PassengerRequest.objects.using(DB_ALIAS).bulk_create([
+                PassengerRequest(passenger_name=f"乘客{i}", contact="", seats_needed=rnd.randint(1, 2),
+                                 departure="台北市", destination="花蓮縣光復鄉", date="2030-01-01",
+                                 driver_id=d.id)
+                for i in range(opts["passengers"])
+            ])
+            w = self.stdout.write
+            w(f"{'mode':<13}{'ms':>9}{'pax/s':>9}{'accepted':>10}{'seats':>7}{'overbooked':>12}"
+              f"{'consistent':>12}{'retries':>9}{'failed':>8}")
+            modes = [("locked", accept_locked), ("conditional", accept_conditional)]
+            if opts["ledger"]:
+                modes.append(("ledger", accept_conditional))
+            for mode, fn in modes:
+                DriverTrip.objects.using(DB_ALIAS).filter(id=d.id).update(seats_filled=0)
+                PassengerRequest.objects.using(DB_ALIAS).update(is_matched=False)
+                if mode == "ledger":
+                    with self._ledger(opts):
+                        self._run(mode, fn, d.id, opts)
+                else:
+                    self._run(mode, fn, d.id, opts)
+
+    @contextmanager
+    def _ledger(self, opts):
+        backend = "redis" if opts["redis_url"] else "memory"
+        reset_ledgers()
+        with override_settings(FIND_SEAT_LEDGER=backend, FIND_SEAT_LEDGER_URL=opts["redis_url"],
+                               FIND_SEAT_LEDGER_FLUSH_MS=opts["flush_ms"]):
+            ledger = get_ledger(DB_ALIAS)
+            if backend == "redis":
+                for key in ledger.client.scan_iter("find:seats:*"):
+                    ledger.client.delete(key)
+            try:
+                yield
+            finally:
+                reset_ledgers()
+
+    def _run(self, mode, fn, driver_id, opts):
+        ids = queue.Queue()
+        for pid in PassengerRequest.objects.using(DB_ALIAS).order_by("id").values_list("id", flat=True):
+            ids.put(pid)
+        stats = {"retries": 0, "failed": 0}
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        pid = ids.get_nowait()
+                    except queue.Empty:
+                        return
+                    for _ in range(opts["retries"]):
+                        try:
+                            fn(driver_id, pid, opts["hold_ms"])
+                            break
+                        except OperationalError:     # 鎖逾時 / 死結 / sqlite database is locked
+                            with lock:
+                                stats["retries"] += 1
+                            time.sleep(0.002)
+                    else:
+                        with lock:
+                            stats["failed"] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(opts["workers"])]
+        with Timer() as t:
+            for th in threads:
+                th.start()
+            for th in threads:
+                th.join()
+            ledger = get_ledger(DB_ALIAS)
+            if ledger is not None:
+                ledger.flush()      # 帳本模式：寫回 find_db 也算在時間裡，下面才看得到 seats_filled
+
+        seats_total, filled = DriverTrip.objects.using(DB_ALIAS).filter(id=driver_id).values_list(
+            "seats_total", "seats_filled").get()
+        accepted = PassengerRequest.objects.using(DB_ALIAS).filter(
+            driver_id=driver_id, is_matched=True).aggregate(n=Sum("seats_needed"))["n"] or 0
+        n = opts["passengers"]
+        self.stdout.write(
+            f"{mode:<13}{t.ms:>9.1f}{n / (t.ms / 1000):>9.0f}{accepted:>10}{seats_total:>7}"
+            f"{max(0, accepted - seats_total):>12}{str(filled == accepted):>12}"
+            f"{stats['retries']:>9}{stats['failed']:>8}")
@@ -0,0 +1,113 @@
+"""
+比較 WebSocket 各種傳輸編碼的訊息大小與編碼時間（依事件種類）。
+
+    python manage.py bench_ws_encoding --drivers 200 --repeat 200
+
+- json(ascii)：舊作法 json.dumps（中文會變成 \\uXXXX）
+- json / msgpack：find.json / find.msgpack
+- deflate(cold)：連線上的第一則（沒有字典）
+- deflate(warm)：同一條連線依序送過前面的事件之後（字典裡已有相似的卡片 HTML）
+"""
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from Find.broadcast import BoardDeltaBuilder, render_manage_panels
+from Find.encoding import DeflateCodec, JsonCodec, MsgpackCodec, msgpack
+from Find.models import DriverTrip, PassengerRequest
+from Find.snapshot import get_board_snapshot
+
+from ._bench import DB_ALIAS, isolated_databases, seed_board
+
+
+class Command(BaseCommand):
+    help = "WebSocket 傳輸編碼（json / msgpack / deflate）每種事件的大小與編碼時間"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drivers", type=int, default=200)
+        parser.add_argument("--pax-per-driver", type=int, default=4)
+        parser.add_argument("--repeat", type=int, default=200, help="每種事件編碼幾次取平均")
+
+    def handle(self, *args, **opts):
+        with isolated_databases():
+            driver_ids = seed_board(opts["drivers"], opts["pax_per_driver"], unassigned=50)
+            self._run(driver_ids, opts["repeat"])
+
+    def _messages(self, driver_ids):
+        """依一條連線上實際會收到的順序：快照 → 一連串差量 → 管理頁"""
+        builder = BoardDeltaBuilder()
+        builder.build(driver_ids, [])
+        db = DriverTrip.objects.using(DB_ALIAS)
+        pdb = PassengerRequest.objects.using(DB_ALIAS)
+
+        def delta(d_ids, p_ids):
+            events, _cards = builder.build(d_ids, p_ids)
+            return {"type": "board.delta", "events": events}
+
+        snap = get_board_snapshot()
+        msgs = [("snapshot", snap.payload)]
+
+        d = db.get(id=driver_ids[0])
+        new_d = db.create(driver_name="新司機", seats_total=4, departure=d.departure,
+                          destination=d.destination, date=d.date, note="可放行李")
+        msgs.append(("driver_added", delta([new_d.id], [])))
+        for i, did in enumerate(driver_ids[1:6]):
+            db.filter(id=did).update(note=f"更新備註 {i}")
+            msgs.append((f"driver_updated#{i + 1}", delta([did], [])))
+        db.filter(id=driver_ids[1]).update(seats_total=6)
+        msgs.append(("seats_changed", delta([driver_ids[1]], [])))
+        p = pdb.create(passenger_name="散客新", seats_needed=1, departure=d.departure,
+                       destination=d.destination, date=d.date)
+        msgs.append(("passenger_added", delta([], [p.id])))
+        html = render_manage_panels([driver_ids[2]])[driver_ids[2]]
+        msgs.append(("manage.panels", {"type": "manage_panels", "html": html}))
+        return msgs
+
+    def _time_us(self, fn, repeat):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - t0) * 1e6 / repeat
+
+    def _run(self, driver_ids, repeat):
+        msgs = self._messages(driver_ids)
+        codecs = [("json(ascii)", None), ("json", JsonCodec())]
+        if msgpack is not None:
+            codecs.append(("msgpack", MsgpackCodec()))
+
+        self.stdout.write(f"{'event':<20}{'codec':<15}{'bytes':>12}{'encode us':>12}")
+        totals = {}
+        warm = DeflateCodec()   # 模擬同一條連線：依序送完所有訊息
+        for name, obj in msgs:
+            rows = []
+            for cname, codec in codecs:
+                if codec is None:
+                    size = len(json.dumps(obj).encode("utf-8"))
+                    us = self._time_us(lambda: json.dumps(obj), repeat)
+                else:
+                    data = codec.encode(obj)
+                    size = len(data.encode("utf-8") if isinstance(data, str) else data)
+                    us = self._time_us(lambda c=codec: c.encode(obj), repeat)
+                rows.append((cname, size, us))
+
+            cold = len(DeflateCodec().encode(obj))
+            rows.append(("deflate(cold)", cold,
+                          self._time_us(lambda: DeflateCodec().encode(obj), max(1, repeat // 4))))
+            # warm：時間量的是「帶著目前字典」壓縮這一則（複製狀態重複量測，不污染字典）
+            history = warm._history
+
+            def encode_warm():
+                c = DeflateCodec()
+                c._history = history
+                return c.encode(obj)
+            rows.append(("deflate(warm)", len(warm.encode(obj)), self._time_us(encode_warm, max(1, repeat // 4))))
+
+            for cname, size, us in rows:
+                totals[cname] = totals.get(cname, 0) + size
+                self.stdout.write(f"{name:<20}{cname:<15}{size:>12,}{us:>12.1f}")
+
+        self.stdout.write("")
+        base = totals["json(ascii)"]
+        for cname, size in totals.items():
+            self.stdout.write(f"{'total':<20}{cname:<15}{size:>12,}{base / max(size, 1):>11.1f}x")
@@ -0,0 +1,236 @@
+"""
+WebSocket 廣播壓力測試：N 條首頁連線 + M 條司機管理頁連線，同時跑一串寫入。
+
+    python manage.py bench_ws_fanout --clients 1000 --manage-clients 20 --writes 200
+    python manage.py bench_ws_fanout --clients 10000 --redis-url redis://127.0.0.1:6379/15
+
+- 直接跑 mysite.asgi.application（WebsocketCommunicator，不經過網路）
+- channel layer 預設 in-memory；--redis-url 改用 channels_redis（建議用本機的 Redis，db 開一個空的）
+- 寫入：依 --accept-ratio 混合 join_driver（新乘客 → 待確認）與 pax_accept（接受 → 佔位），
+  用 Django test Client 在背景執行緒依序送出，跟正式環境一樣走 view → signals → 排程器 → 背景佇列
+- 延遲：交易提交（find_db 的 on_commit）→ 每條連線收到包含該司機的訊息
+  首頁連線看 board.delta 裡的 driver_id；管理頁連線看 manage_panels（一條連線只屬於一位司機）
+- 記憶體：建立連線前後的 tracemalloc 差值 / 連線數（只算 Python 配置的記憶體）
+"""
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.urls import reverse
+
+from Find.models import DriverTrip, PassengerRequest
+
+from ._bench import DB_ALIAS, isolated_databases, percentile, seed_board
+
+
+class CommitLog:
+    """記錄每位司機每次相關寫入的提交時間（monotonic 秒）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.by_driver = defaultdict(list)
+
+    def receiver(self, sender, instance, **kwargs):
+        did = instance.pk if sender is DriverTrip else instance.driver_id
+        if not did:
+            return
+
+        def _record():
+            with self._lock:
+                self.by_driver[did].append(time.monotonic())
+        transaction.on_commit(_record, using=DB_ALIAS)
+
+    def since(self, did, after, until):
+        with self._lock:
+            return [t for t in self.by_driver.get(did, ()) if after < t <= until]
+
+
+class Client:
+    """一條模擬連線：持續收訊息，記錄每則訊息涵蓋的提交延遲"""
+
+    def __init__(self, comm, commits: CommitLog, driver_id=None):
+        self.comm = comm
+        self.commits = commits
+        self.driver_id = driver_id     # 管理頁連線才有
+        self.messages = 0
+        self.latencies_ms = []
+        self._seen = {}                # driver_id -> 已計算過的最後一次提交時間
+
+    def _driver_ids(self, msg):
+        if self.driver_id is not None:
+            return [self.driver_id] if msg.get("type") == "manage_panels" else []
+        if msg.get("type") != "board.delta":
+            return []
+        return {e["driver_id"] for e in msg.get("events", ()) if e.get("driver_id")}
+
+    async def run(self):
+        while True:
+            try:
+                out = await self.comm.receive_output(timeout=3600)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                return
+            if out.get("type") != "websocket.send":
+                return
+            now = time.monotonic()
+            self.messages += 1
+            msg = json.loads(out["text"]) if out.get("text") is not None else {}
+            for did in self._driver_ids(msg):
+                hits = self.commits.since(did, self._seen.get(did, 0.0), now)
+                if hits:
+                    self._seen[did] = hits[-1]
+                    self.latencies_ms.extend((now - t) * 1000 for t in hits)
+
+
+class Command(BaseCommand):
+    help = "WebSocket fan-out 壓力測試：提交到送達的延遲分位數、每秒訊息數、每條連線記憶體"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=1000, help="/ws/find/ 連線數")
+        parser.add_argument("--manage-clients", type=int, default=20, help="/ws/find/driver/<id>/ 連線數")
+        parser.add_argument("--drivers", type=int, default=200)
+        parser.add_argument("--writes", type=int, default=200)
+        parser.add_argument("--accept-ratio", type=float, default=0.5, help="寫入中 pax_accept 的比例")
+        parser.add_argument("--interval-ms", type=float, default=20, help="兩次寫入的間隔")
+        parser.add_argument("--connect-batch", type=int, default=200)
+        parser.add_argument("--drain-s", type=float, default=2.0, help="寫完後等訊息送完的秒數")
+        parser.add_argument("--redis-url", default=None, help="改用 channels_redis（例如 redis://127.0.0.1:6379/15）")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **opts):
+        layers = None
+        if opts["redis_url"]:
+            layers = {"default": {
+                "BACKEND": "channels_redis.core.RedisChannelLayer",
+                "CONFIG": {"hosts": [opts["redis_url"]], "capacity": 10000},
+            }}
+        commits = CommitLog()
+        with isolated_databases(channel_layers=layers):
+            driver_ids = seed_board(opts["drivers"], pax_per_driver=0, unassigned=0, seed=opts["seed"])
+            DriverTrip.objects.using(DB_ALIAS).update(seats_total=50)   # 寫入期間不要滿座下架
+            post_save.connect(commits.receiver, sender=DriverTrip, dispatch_uid="bench_ws_fanout_d")
+            post_save.connect(commits.receiver, sender=PassengerRequest, dispatch_uid="bench_ws_fanout_p")
+            try:
+                asyncio.run(self._run(driver_ids, commits, opts))
+            finally:
+                post_save.disconnect(sender=DriverTrip, dispatch_uid="bench_ws_fanout_d")
+                post_save.disconnect(sender=PassengerRequest, dispatch_uid="bench_ws_fanout_p")
+
+    # ---- 連線 ----
+    def _session_cookie(self, driver_ids):
+        from django.conf import settings
+        from django.contrib.sessions.backends.db import SessionStore
+        s = SessionStore()
+        for did in driver_ids:
+            s[f"driver_auth_{did}"] = True
+        s.create()
+        return f"{settings.SESSION_COOKIE_NAME}={s.session_key}".encode()
+
+    async def _connect(self, comms, batch):
+        for i in range(0, len(comms), batch):
+            results = await asyncio.gather(*(c.connect(timeout=30) for c in comms[i:i + batch]))
+            if not all(ok for ok, _ in results):
+                raise RuntimeError("有連線被拒絕")
+        # 丟掉連線時的快照
+        await asyncio.gather(*(c.receive_output(timeout=30) for c in comms if c.scope["path"] == "/ws/find/"))
+
+    # ---- 寫入 ----
+    def _writer(self, driver_ids, opts, done: threading.Event):
+        from django.test import Client as HttpClient
+        from Find.dispatch import dispatcher
+
+        rnd = random.Random(opts["seed"])
+        http = HttpClient()
+        session = http.session
+        for did in driver_ids:
+            session[f"driver_auth_{did}"] = True
+        session.save()
+
+        pending = defaultdict(list)     # driver_id -> 待確認乘客 id
+        cycle = itertools.cycle(driver_ids)
+        try:
+            for _ in range(opts["writes"]):
+                did = next(cycle)
+                if pending[did] and rnd.random() < opts["accept_ratio"]:
+                    http.post(reverse("pax_accept", args=[pending[did].pop()]))
+                else:
+                    http.post(reverse("join_driver", args=[did]), {
+                        "passenger_name": "壓測", "seats_needed": "1", "departure": "台北市",
+                        "destination": "花蓮縣光復鄉",
+                    }, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+                    pid = (PassengerRequest.objects.using(DB_ALIAS)
+                           .filter(driver_id=did).order_by("-id").values_list("id", flat=True).first())
+                    if pid:
+                        pending[did].append(pid)
+                time.sleep(opts["interval_ms"] / 1000)
+            dispatcher.join(timeout=30)
+        finally:
+            done.set()
+
+    async def _run(self, driver_ids, commits: CommitLog, opts):
+        from channels.testing import WebsocketCommunicator
+        from mysite.asgi import application
+        from asgiref.sync import sync_to_async
+
+        rnd = random.Random(opts["seed"])
+        manage_ids = [rnd.choice(driver_ids) for _ in range(opts["manage_clients"])]
+        cookie = await sync_to_async(self._session_cookie)(set(manage_ids))
+
+        tracemalloc.start()
+        mem0, _ = tracemalloc.get_traced_memory()
+        t0 = time.perf_counter()
+        comms = [WebsocketCommunicator(application, "/ws/find/") for _ in range(opts["clients"])]
+        manage = [WebsocketCommunicator(application, f"/ws/find/driver/{did}/", headers=[(b"cookie", cookie)])
+                  for did in manage_ids]
+        await self._connect(comms + manage, opts["connect_batch"])
+        connect_s = time.perf_counter() - t0
+        mem1, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        total_conns = len(comms) + len(manage)
+
+        clients = [Client(c, commits) for c in comms] + [Client(c, commits, did) for c, did in zip(manage, manage_ids)]
+        readers = [asyncio.create_task(c.run()) for c in clients]
+
+        done = threading.Event()
+        t1 = time.perf_counter()
+        writer = asyncio.get_running_loop().run_in_executor(None, self._writer, driver_ids, opts, done)
+        await writer
+        await asyncio.sleep(opts["drain_s"])
+        elapsed = time.perf_counter() - t1
+
+        for t in readers:
+            t.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        await asyncio.gather(*(c.disconnect() for c in comms + manage), return_exceptions=True)
+
+        self._report(clients, total_conns, connect_s, elapsed, (mem1 - mem0) / max(1, total_conns), opts)
+
+    def _report(self, clients, total_conns, connect_s, elapsed, mem_per_conn, opts):
+        from Find.backpressure import stats as bp_stats
+        from Find.broadcast import scheduler, stats as delta_stats
+        from Find.dispatch import dispatcher
+
+        board = [c for c in clients if c.driver_id is None]
+        manage = [c for c in clients if c.driver_id is not None]
+        w = self.stdout.write
+        w(f"connections        {total_conns:,}（首頁 {len(board):,} / 管理頁 {len(manage):,}），連線花 {connect_s:.2f}s")
+        w(f"memory/connection  {mem_per_conn / 1024:.1f} KiB（tracemalloc）")
+        w(f"writes             {opts['writes']:,}，寫入＋等待 {elapsed:.2f}s")
+        for name, group in (("board", board), ("manage", manage)):
+            lat = [x for c in group for x in c.latencies_ms]
+            msgs = sum(c.messages for c in group)
+            w(f"[{name}] messages {msgs:,}（{msgs / max(elapsed, 1e-9):,.0f} msg/s），"
+              f"deliveries {len(lat):,}，latency ms "
+              f"p50={percentile(lat, 50):.1f} p90={percentile(lat, 90):.1f} "
+              f"p99={percentile(lat, 99):.1f} max={max(lat, default=0):.1f}")
+        w(f"scheduler          {scheduler.stats}")
+        w(f"delta              {delta_stats}")
+        w(f"dispatch           {dispatcher.metrics()}")
+        w(f"backpressure       {bp_stats}")
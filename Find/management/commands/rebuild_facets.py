@@ -0,0 +1,34 @@
+"""
+重算首頁篩選選項的計數（0017 migration 會算一次；bulk 匯入 / update() 之後要再跑）。
+
+    python manage.py rebuild_facets
+    python manage.py rebuild_facets --check    # 只比對，不寫入
+
+平常的新增 / 修改 / 刪除由 signals 即時維護（facets.py）。
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from Find.facets import compute_facets, rebuild_facets
+from Find.models import FacetCount
+
+DB_ALIAS = "find_db"
+
+
+class Command(BaseCommand):
+    help = "重算首頁篩選選項（出發地 / 目的地 / 日期）的計數"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="只比對目前的計數是否正確，不寫入")
+
+    def handle(self, *args, **opts):
+        if opts["check"]:
+            expected = compute_facets(DB_ALIAS)
+            stored = {(d, v): n for d, v, n in FacetCount.objects.using(DB_ALIAS)
+                      .filter(count__gt=0).values_list("dimension", "value", "count")}
+            wrong = sorted(set(expected.items()) ^ set(stored.items()))
+            if wrong:
+                raise CommandError(f"{len(wrong)} 筆計數不一致，例如 {wrong[:5]}")
+            self.stdout.write(self.style.SUCCESS(f"{len(expected)} 筆計數都正確"))
+            return
+        n = rebuild_facets(DB_ALIAS)
+        self.stdout.write(self.style.SUCCESS(f"已重算 {n} 筆計數"))
@@ -0,0 +1,28 @@
+"""
+重建首頁關鍵字搜尋的 n-gram 索引（0016 migration 會建一次；bulk 匯入 / update()、或改了 DRIVER_FIELDS 之後要跑）。
+
+    python manage.py rebuild_search_index
+    python manage.py rebuild_search_index --batch-size 200
+
+只重寫全文有變的司機；平常的新增 / 修改由 signals 即時維護。
+"""
+from django.core.management.base import BaseCommand
+
+from Find.models import DriverTrip, SearchDocument
+from Find.search import reindex_drivers
+
+DB_ALIAS = "find_db"
+
+
+class Command(BaseCommand):
+    help = "重建首頁關鍵字搜尋的 n-gram 索引"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **opts):
+        ids = set(DriverTrip.objects.using(DB_ALIAS).values_list("id", flat=True))
+        # 司機已經不在、索引還留著的（理論上 CASCADE 會刪，保險起見一起清）
+        ids |= set(SearchDocument.objects.using(DB_ALIAS).values_list("driver_id", flat=True))
+        changed = reindex_drivers(ids, using=DB_ALIAS, batch_size=max(1, opts["batch_size"]))
+        self.stdout.write(self.style.SUCCESS(f"司機 {len(ids)} 位，重建 {changed} 位"))
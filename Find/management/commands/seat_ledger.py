@@ -0,0 +1,36 @@
+"""
+座位帳本（ledger.py）的維運指令
+
+    python manage.py seat_ledger --status       # 帳本裡有幾位司機、幾位還沒寫回
+    python manage.py seat_ledger --flush        # 立刻把 dirty 的司機寫回 find_db
+    python manage.py seat_ledger --reconcile    # 對帳後寫回（部署 / Redis 重啟後跑一次）
+
+FIND_SEAT_LEDGER 沒開的時候什麼都不做。
+"""
+from django.core.management.base import BaseCommand
+
+from Find.ledger import get_ledger
+
+DB_ALIAS = "find_db"
+
+
+class Command(BaseCommand):
+    help = "座位帳本：查看狀態、寫回 find_db、對帳"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--flush", action="store_true", help="把還沒寫回的座位寫進 find_db")
+        parser.add_argument("--reconcile", action="store_true", help="find_db 跟帳本對帳，再全部寫回")
+        parser.add_argument("--status", action="store_true", help="列出帳本狀態（預設）")
+
+    def handle(self, *args, **opts):
+        ledger = get_ledger(DB_ALIAS)
+        if ledger is None:
+            self.stdout.write("FIND_SEAT_LEDGER 沒有開啟，座位直接在 find_db 扣")
+            return
+        if opts["reconcile"]:
+            out = ledger.reconcile()
+            self.stdout.write(f"對帳：調整 {out['drift']} 位司機，寫回 {out['flushed']} 位")
+        elif opts["flush"]:
+            self.stdout.write(f"寫回 {ledger.flush()} 位司機")
+        m = ledger.metrics()
+        self.stdout.write(f"帳本：{m['known']} 位司機，{m['dirty']} 位還沒寫回")
@@ -0,0 +1,263 @@
+"""
+批次自動媒合：所有未指派的乘客 × 所有還有空位的上架司機
+
+以前只有兩條路：
+  - WebSocket 的 join：抓「第一位還有空位的司機」，不管路線、日期、座位夠不夠
+  - driver_manage：司機一位一位勾選接受
+這裡一次看全部，算出「每位乘客配哪位司機」，讓配到的座位數盡量多。
+
+問題是多個背包（每位司機一個背包、容量 = 空位；乘客一組人不能拆開坐），求最佳解是 NP-hard，
+所以用 Best-Fit Decreasing 再加一步局部改善：
+  1) 相容表：乘客的起訖站對、日期（± FIND_ROUTE_DATE_WINDOW）→ 經過這一段的司機
+     （routes.served_pairs 反查，不必兩兩比對）；不在路線圖上的地點只配完全同起訖的司機
+  2) 人數多的先排、同人數時候選司機少的先排；每位乘客挑路線最合（exact > along > detour、
+     日期差小）的司機，同樣合的挑「放進去剩最少空位」的（best fit）
+  3) 配不到的乘客 u：找一位候選司機 d，把 d 上某位乘客 v 挪到 v 的另一位候選司機，
+     騰出的空位夠 u 坐就換（配到的座位數只增不減）
+結果是「提案」：apply_plan 只把乘客掛到司機底下（driver = 司機、is_matched = False），
+出現在司機管理頁的「待確認」，由司機一次勾選接受；座位要等司機接受才會扣。
+所以司機的可用空位 = seats_total - seats_filled - 已在待確認的人數，不會提案超過座位。
+
+    python manage.py auto_match              # 只列出提案
+    python manage.py auto_match --apply      # 寫入（掛到司機的待確認）
+    python manage.py bench_matching          # 1k / 5k / 10k 位乘客的時間與配對率
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date as _date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .changes import touch
+from .locations import DB_ALIAS
+from .models import DriverTrip, PassengerRequest
+from .routes import KIND_ORDER, drivers_on_route, route_nodes, served_pairs
+from .search import reindex_drivers
+from .snapshot import bump_data_version
+
+
+@dataclass(frozen=True)
+class MatchProposal:
+    driver_id: int
+    passenger_ids: tuple
+    seats: int
+    route: tuple          # 司機的 (出發地 Location id, 目的地 Location id)
+    date: _date
+
+
+@dataclass
+class MatchPlan:
+    proposals: list = field(default_factory=list)
+    unmatched: list = field(default_factory=list)   # 配不到的乘客 id
+    seats_requested: int = 0                       # 所有乘客的人數
+    seats_matched: int = 0
+    seats_bound: int = 0     # 上界：min(有候選司機的乘客人數, 有候選乘客的司機空位)
+    moves: int = 0           # 局部改善挪了幾位乘客
+
+
+class _Pax:
+    __slots__ = ("id", "seats", "dep", "des", "date", "cands", "driver")
+
+    def __init__(self, pid, seats, dep, des, day):
+        self.id, self.seats, self.dep, self.des, self.date = pid, seats, dep, des, day
+        self.cands = []        # [(排序用的 key, _Drv)]，好的在前
+        self.driver = None
+
+
+class _Drv:
+    __slots__ = ("id", "free", "dep", "des", "date", "flexible", "riders")
+
+    def __init__(self, did, free, dep, des, day, flexible):
+        self.id, self.free, self.dep, self.des, self.date, self.flexible = did, free, dep, des, day, flexible
+        self.riders = []
+
+
+def pending_seats(using: str = DB_ALIAS, driver_ids=None) -> dict:
+    """司機 id → 待確認乘客的人數合計"""
+    qs = PassengerRequest.objects.using(using).filter(is_matched=False, driver__isnull=False)
+    if driver_ids is not None:
+        qs = qs.filter(driver_id__in=list(driver_ids))
+    return dict(qs.values("driver_id").annotate(n=Sum("seats_needed")).values_list("driver_id", "n"))
+
+
+def load_board(using: str = DB_ALIAS, today=None):
+    """今天以後的未指派乘客、還有空位的上架司機 → (乘客 tuples, 司機 tuples)"""
+    today = today or _date.today()
+    pending = pending_seats(using)
+    drivers = []
+    for did, total, filled, dep, des, day, flexible in (
+            DriverTrip.objects.using(using)
+            .filter(is_active=True, date__gte=today, seats_filled__lt=F("seats_total"))
+            .values_list("id", "seats_total", "seats_filled", "departure_loc_id", "destination_loc_id",
+                         "date", "flexible_pickup")):
+        free = total - filled - pending.get(did, 0)
+        if free > 0:
+            drivers.append((did, free, dep, des, day, flexible))
+    passengers = list(
+        PassengerRequest.objects.using(using)
+        .filter(date__gte=today, driver__isnull=True, is_matched=False, is_waitlisted=False, seats_needed__gt=0)
+        .values_list("id", "seats_needed", "departure_loc_id", "destination_loc_id", "date")
+    )
+    return passengers, drivers
+
+
+def _candidates(pax, drivers, window, using):
+    """相容表：每位乘客的候選司機（依路線合適程度排好）"""
+    served = defaultdict(list)   # (站對或 ("loc", 起, 迄), 日期) → [(種類, 繞路, -共乘站數, _Drv)]
+    for d in drivers:
+        nodes = route_nodes(d.dep, d.des, using)
+        if nodes is None:
+            served[(("loc", d.dep, d.des), d.date)].append((0, 0, 0, d))
+            continue
+        flexible = "NO" if d.flexible == "NO" else "YES"
+        for pair, m in served_pairs(*nodes, flexible).items():
+            served[(pair, d.date)].append((KIND_ORDER[m.kind], m.detour, -m.shared, d))
+
+    days = [(dt, abs(dt)) for dt in range(-window, window + 1)]
+    for p in pax:
+        # 在路線圖上的起訖一定也是站對（完全同地點 = 司機的起訖站對，kind = exact）
+        key = route_nodes(p.dep, p.des, using) or ("loc", p.dep, p.des)
+        best = {}
+        for dt, gap in days:
+            for kind, detour, shared, d in served.get((key, p.date + timedelta(days=dt)), ()):
+                if d.free < p.seats:
+                    continue
+                rank = (kind, detour, gap, shared)
+                old = best.get(d.id)
+                if old is None or rank < old[0]:
+                    best[d.id] = (rank, d.id, d)
+        p.cands = [(rank, d) for rank, _, d in sorted(best.values())]
+
+
+def _assign(p, d):
+    p.driver = d
+    d.free -= p.seats
+    d.riders.append(p)
+
+
+def _unassign(p):
+    d = p.driver
+    d.riders.remove(p)
+    d.free += p.seats
+    p.driver = None
+
+
+def _best_fit(p):
+    fits = [(rank, d.free - p.seats, d.id, d) for rank, d in p.cands if d.free >= p.seats]
+    return min(fits)[-1] if fits else None
+
+
+def _relocate_for(u, max_free, stuck: set) -> bool:
+    """
+    把某位候選司機上的一位乘客挪到別的司機，騰出 u 的位子；成功回傳 True。
+    max_free：所有司機目前最多還有幾個空位；stuck：挪不動的乘客（之後很少再空出位子，不再重試）
+    """
+    for _, d in u.cands:
+        short = u.seats - d.free
+        if short <= 0:      # 前面挪過乘客，這位司機空出位子了
+            _assign(u, d)
+            return True
+        movable = [v for v in d.riders if short <= v.seats <= max_free and v.id not in stuck]
+        for v in sorted(movable, key=lambda v: (v.seats, v.id)):
+            for _, d2 in v.cands:
+                if d2 is not d and d2.free >= v.seats:
+                    _unassign(v)
+                    _assign(v, d2)
+                    _assign(u, d)
+                    return True
+            stuck.add(v.id)
+    return False
+
+
+def solve(passengers, drivers, *, window=None, using: str = DB_ALIAS) -> MatchPlan:
+    """
+    passengers: [(id, 人數, 出發地 Location id, 目的地 Location id, 日期)]
+    drivers:    [(id, 可用空位, 出發地 Location id, 目的地 Location id, 日期, flexible_pickup)]
+    """
+    window = settings.FIND_ROUTE_DATE_WINDOW if window is None else window
+    pax = [_Pax(*row) for row in passengers]
+    drvs = [_Drv(*row) for row in drivers if row[1] > 0]
+    _candidates(pax, drvs, window, using)
+
+    plan = MatchPlan(seats_requested=sum(p.seats for p in pax))
+    reachable = [p for p in pax if p.cands]
+    wanted = {d.id: d.free for p in reachable for _, d in p.cands}
+    plan.seats_bound = min(sum(p.seats for p in reachable), sum(wanted.values()))
+
+    for p in sorted(reachable, key=lambda p: (-p.seats, len(p.cands), p.date, p.id)):
+        d = _best_fit(p)
+        if d is not None:
+            _assign(p, d)
+
+    max_free, stuck = max((d.free for d in drvs), default=0), set()
+    for u in sorted((p for p in reachable if p.driver is None), key=lambda p: (p.seats, p.id)):
+        if _relocate_for(u, max_free, stuck):
+            plan.moves += 1
+            max_free = max(max_free, u.driver.free)
+
+    for d in sorted(drvs, key=lambda d: d.id):
+        if d.riders:
+            ids = tuple(sorted(p.id for p in d.riders))
+            seats = sum(p.seats for p in d.riders)
+            plan.proposals.append(MatchProposal(d.id, ids, seats, (d.dep, d.des), d.date))
+            plan.seats_matched += seats
+    plan.unmatched = sorted(p.id for p in pax if p.driver is None)
+    return plan
+
+
+def plan_matches(using: str = DB_ALIAS, window=None) -> MatchPlan:
+    passengers, drivers = load_board(using)
+    return solve(passengers, drivers, window=window, using=using)
+
+
+def _propose(driver_id, passenger_ids, using) -> list:
+    """只掛還沒被指派的乘客（條件式 UPDATE，跟手動報名同時發生也不會蓋掉）；回傳實際掛上的 id"""
+    open_ids = list(PassengerRequest.objects.using(using).select_for_update().filter(
+        id__in=passenger_ids, driver__isnull=True, is_matched=False, is_waitlisted=False,
+    ).values_list("id", flat=True))
+    if open_ids:
+        PassengerRequest.objects.using(using).filter(id__in=open_ids).update(driver_id=driver_id)
+    return open_ids
+
+
+def _after_propose(driver_ids, passenger_ids, using):
+    # update() 不觸發 signals：全文索引、資料版本、廣播自己補
+    reindex_drivers(driver_ids, using=using)
+    transaction.on_commit(bump_data_version, using=using)
+    touch(drivers=driver_ids, passengers=passenger_ids, panels=driver_ids)
+
+
+def apply_plan(plan: MatchPlan, using: str = DB_ALIAS) -> dict:
+    """提案寫入：乘客掛到司機的待確認；回傳 {司機 id: 實際掛上的乘客 id}"""
+    applied = {}
+    with transaction.atomic(using=using):
+        for prop in plan.proposals:
+            ids = _propose(prop.driver_id, prop.passenger_ids, using)
+            if ids:
+                applied[prop.driver_id] = ids
+        if applied:
+            _after_propose(list(applied), [i for ids in applied.values() for i in ids], using)
+    return applied
+
+
+def propose_driver(passenger_id, using: str = DB_ALIAS):
+    """
+    單一乘客（WebSocket join）：順路、座位夠的司機裡挑第一位，掛到他的待確認；
+    回傳司機，沒有可用的司機（或乘客已經有司機）回傳 None
+    """
+    with transaction.atomic(using=using):
+        p = (PassengerRequest.objects.using(using).select_for_update()
+             .filter(id=passenger_id, driver__isnull=True, is_matched=False, is_waitlisted=False).first())
+        if p is None:
+            return None
+        drivers = drivers_on_route(p, using=using)
+        pending = pending_seats(using, [d.id for d in drivers])
+        for d in drivers:
+            if d.seats_left - pending.get(d.id, 0) >= p.seats_needed:
+                if _propose(d.id, [p.id], using):
+                    _after_propose([d.id], [p.id], using)
+                    return d
+                return None
+    return None
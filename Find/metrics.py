@@ -0,0 +1,245 @@
+"""
+即時層的監控指標（Prometheus text format）
+
+    GET /find/metrics/     （帶 Authorization: Bearer <FIND_METRICS_TOKEN> 或 ?token=；staff 登入也可以）
+
+沒設定 FIND_METRICS_TOKEN 時只有 staff（或 DEBUG）看得到：指標裡有連線數、各 group 的人數、
+有幾個司機管理頁開著，不能公開。
+
+- 兩個 consumer：連線 / 斷線、各 group 目前的連線數、收到的 action、送出的訊息數與 bytes（依 type）、
+  每個 handler 的處理時間（histogram）
+- 抓取時才讀的：排程器、差量、背景佇列、背壓、快照的計數
+
+不依賴 prometheus_client：每個指標只是 dict + 一把鎖，記一筆就是一次加法，正式環境可以一直開著。
+數字是「程序內」的（目前部署是單一 uvicorn 程序）。
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_registry: list = []
+_collectors: list = []
+
+
+def _fmt_labels(names, values) -> str:
+    if not names:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(names, values)
+    )
+    return "{" + body + "}"
+
+
+def _fmt_value(v) -> str:
+    if isinstance(v, float):
+        return repr(v) if v == v and v not in (float("inf"), float("-inf")) else ("+Inf" if v > 0 else "NaN")
+    return str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: dict = {}
+        _registry.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_fmt_labels(self.labels, k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *label_values, value):
+        with self._lock:
+            self._values[label_values] = value
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *label_values, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._values.get(label_values)
+            if h is None:
+                h = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        out = self._header()
+        names = self.labels + ("le",)
+        for key, (counts, total, n) in items:
+            running = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f"{self.name}_bucket{_fmt_labels(names, key + (le,))} {running}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(total)}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {n}")
+        return out
+
+
+def register_collector(fn):
+    """抓取時才呼叫：fn() -> [(name, kind, help, {label_tuple: value}, label_names)]"""
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    lines = []
+    for m in _registry:
+        lines += m.render()
+    for fn in _collectors:
+        for name, kind, help_text, samples, label_names in fn():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_fmt_labels(label_names, k)} {_fmt_value(v)}" for k, v in samples.items()]
+    return "\n".join(lines) + "\n"
+
+
+# ---- WebSocket 指標 ----
+ws_connects = Counter("find_ws_connects_total", "WebSocket 連線（accept 之前也算）", ["consumer"])
+ws_disconnects = Counter("find_ws_disconnects_total", "WebSocket 斷線", ["consumer"])
+ws_group_members = Gauge("find_ws_group_members", "目前在 group 內的連線數（driver_manage_<id> 合併計）", ["group"])
+ws_received = Counter("find_ws_received_total", "前端送來的訊息（依 action）", ["consumer", "action"])
+ws_sent = Counter("find_ws_sent_messages_total", "送給前端的訊息（依 type）", ["consumer", "type"])
+ws_sent_bytes = Counter("find_ws_sent_bytes_total", "送給前端的 bytes（編碼後）", ["consumer", "type"])
+ws_handler_seconds = Histogram("find_ws_handler_seconds", "consumer handler 處理時間", ["consumer", "handler"])
+
+_driver_groups: dict = {}    # driver_manage_<id> -> 連線數（只用來算有幾個 group）
+_driver_groups_lock = threading.Lock()
+
+
+def group_label(group: str) -> str:
+    if group.startswith("driver_manage_"):
+        return "driver_manage"
+    if group.startswith("find_waitlist_"):
+        return "find_waitlist"
+    return group
+
+
+def group_joined(group: str):
+    ws_group_members.inc(group_label(group))
+    if group.startswith("driver_manage_"):
+        with _driver_groups_lock:
+            _driver_groups[group] = _driver_groups.get(group, 0) + 1
+
+
+def group_left(group: str):
+    ws_group_members.dec(group_label(group))
+    if group.startswith("driver_manage_"):
+        with _driver_groups_lock:
+            n = _driver_groups.get(group, 0) - 1
+            if n > 0:
+                _driver_groups[group] = n
+            else:
+                _driver_groups.pop(group, None)
+
+
+class InstrumentedConsumerMixin:
+    """
+    放在 consumer 的 MRO 最前面：每則 channel 訊息（websocket.connect / receive / board.delta ...）
+    都會計時，依 handler 名稱記進 histogram。
+    """
+    metrics_label = "consumer"
+
+    async def dispatch(self, message):
+        kind = message.get("type", "")
+        if kind == "websocket.connect":
+            ws_connects.inc(self.metrics_label)
+        elif kind == "websocket.disconnect":
+            ws_disconnects.inc(self.metrics_label)
+        t0 = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            ws_handler_seconds.observe(self.metrics_label, kind, value=time.perf_counter() - t0)
+
+    def record_sent(self, kind, nbytes: int):
+        kind = kind or "unknown"
+        ws_sent.inc(self.metrics_label, kind)
+        ws_sent_bytes.inc(self.metrics_label, kind, amount=nbytes)
+
+    def record_received(self, action):
+        ws_received.inc(self.metrics_label, action or "unknown")
+
+
+# ---- 抓取時才讀的計數 ----
+def _flat(prefix, kind, help_text, data: dict):
+    return [(f"{prefix}_{k}", kind, help_text, {(): v}, ()) for k, v in data.items() if isinstance(v, (int, float))]
+
+
+@register_collector
+def _realtime_stats():
+    from . import backpressure, snapshot
+    from .broadcast import scheduler, stats as delta_stats
+    from .dispatch import dispatcher
+    from .pagecache import page_cache
+
+    with _driver_groups_lock:
+        manage_groups = len(_driver_groups)
+    out = [("find_ws_driver_manage_groups", "gauge", "有人連線中的 driver_manage_<id> group 數", {(): manage_groups}, ())]
+    out += _flat("find_broadcast", "gauge", "合併廣播排程器", scheduler.stats)
+    out += _flat("find_delta", "gauge", "board.delta 差量廣播", delta_stats)
+    out += _flat("find_dispatch", "gauge", "背景派送佇列", dispatcher.metrics())
+    out += _flat("find_backpressure", "gauge", "慢速連線背壓", backpressure.stats)
+    out += _flat("find_snapshot", "gauge", "首頁快照", snapshot.stats)
+    out += _flat("find_page_cache", "gauge", "首頁司機卡片頁快取", page_cache.stats)
+    return out
+
+
+def _metrics_allowed(request) -> bool:
+    user = getattr(request, "user", None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    token = getattr(settings, "FIND_METRICS_TOKEN", "")
+    if not token:
+        return settings.DEBUG
+    given = request.GET.get("token") or ""
+    auth = request.headers.get("Authorization") or ""
+    if auth.startswith("Bearer "):
+        given = auth[len("Bearer "):]
+    return constant_time_compare(given, token)
+
+
+def metrics_view(request):
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden("forbidden")
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
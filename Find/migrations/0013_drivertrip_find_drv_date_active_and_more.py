@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Find', '0012_remove_passengerrequest_hide_contact_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drivertrip',
+            index=models.Index(fields=['date', 'is_active'], name='find_drv_date_active'),
+        ),
+        migrations.AddIndex(
+            model_name='drivertrip',
+            index=models.Index(fields=['departure', 'destination', 'is_active'], name='find_drv_route'),
+        ),
+        migrations.AddIndex(
+            model_name='drivertrip',
+            index=models.Index(fields=['destination', 'is_active'], name='find_drv_des_active'),
+        ),
+        migrations.AddIndex(
+            model_name='passengerrequest',
+            index=models.Index(fields=['driver', 'is_matched'], name='find_pax_driver_matched'),
+        ),
+        migrations.AddIndex(
+            model_name='passengerrequest',
+            index=models.Index(fields=['departure', 'destination', 'date', 'is_matched', 'driver'], name='find_pax_route_candidates'),
+        ),
+    ]
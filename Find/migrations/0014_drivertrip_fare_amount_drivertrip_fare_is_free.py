@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:37
+
+from django.db import migrations, models
+
+from Find.models import parse_fare_note
+
+
+def backfill_fare(apps, schema_editor):
+    # 同 backfill_fare_amount（這裡用 migration 當下的 model）；fare_is_free 預設 True，不補的話既有行程都排成免費
+    db = schema_editor.connection.alias
+    DriverTrip = apps.get_model("Find", "DriverTrip")
+    qs = DriverTrip.objects.using(db).order_by("id").only("id", "fare_note")
+    last_id = 0
+    while rows := list(qs.filter(id__gt=last_id)[:1000]):
+        last_id = rows[-1].id
+        for d in rows:
+            d.fare_amount, d.fare_is_free = parse_fare_note(d.fare_note)
+        DriverTrip.objects.using(db).bulk_update(rows, ["fare_amount", "fare_is_free"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Find', '0013_drivertrip_find_drv_date_active_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drivertrip',
+            name='fare_amount',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='drivertrip',
+            name='fare_is_free',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.RunPython(backfill_fare, migrations.RunPython.noop),
+    ]
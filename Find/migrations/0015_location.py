@@ -0,0 +1,95 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:41
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# 建立當下的 views.CITY_N2S（地理順序，北 → 南 → 東 → 離島）；rank = 順位（1 起算）
+CITY_N2S = [
+    "需清淤地區", "光復鄉糖廠", "花蓮縣光復車站以外火車站", "花蓮縣光復鄉", "基隆市", "台北市", "新北市", "桃園市",
+    "新竹市", "新竹縣", "苗栗縣", "台中市", "彰化縣", "南投縣", "雲林縣", "嘉義市", "嘉義縣",
+    "台南市", "高雄市", "屏東縣", "宜蘭縣", "花蓮縣", "台東縣", "澎湖縣", "金門縣", "連江縣",
+]
+
+
+def seed_locations(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Location = apps.get_model("Find", "Location")
+    LocationAlias = apps.get_model("Find", "LocationAlias")
+    for idx, name in enumerate(CITY_N2S):
+        loc, _ = Location.objects.using(db).update_or_create(name=name, defaults={"rank": idx + 1})
+        LocationAlias.objects.using(db).get_or_create(alias=name, defaults={"location": loc})
+
+
+def location_resolver(apps, db):
+    """同 locations.resolve_location_id（這裡用 migration 當下的 model，不用模組裡的快取）"""
+    Location = apps.get_model("Find", "Location")
+    LocationAlias = apps.get_model("Find", "LocationAlias")
+    known = list(Location.objects.using(db).filter(rank__lt=999).order_by("rank", "id").values_list("name", "id"))
+    aliases = dict(LocationAlias.objects.using(db).values_list("alias", "location_id"))
+
+    def resolve(text):
+        key = re.sub(r"\s+", " ", str(text or "")).strip().replace("臺", "台")[:100]
+        if not key:
+            return None
+        if key not in aliases:
+            loc_id = next((loc_id for name, loc_id in known if name in key), None)
+            if loc_id is None:
+                loc_id = Location.objects.using(db).get_or_create(name=key, defaults={"rank": 999})[0].id
+            LocationAlias.objects.using(db).create(alias=key, location_id=loc_id)
+            aliases[key] = loc_id
+        return aliases[key]
+    return resolve
+
+
+def backfill_trip_locations(apps, schema_editor):
+    # 既有司機的 departure / destination 對應到 Location（同 backfill_locations，分批依 id 往後讀）
+    db = schema_editor.connection.alias
+    DriverTrip = apps.get_model("Find", "DriverTrip")
+    resolve = location_resolver(apps, db)
+    qs = DriverTrip.objects.using(db).order_by("id").only("id", "departure", "destination")
+    last_id = 0
+    while rows := list(qs.filter(id__gt=last_id)[:1000]):
+        last_id = rows[-1].id
+        for d in rows:
+            d.departure_loc_id, d.destination_loc_id = resolve(d.departure), resolve(d.destination)
+        DriverTrip.objects.using(db).bulk_update(rows, ["departure_loc", "destination_loc"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Find', '0014_drivertrip_fare_amount_drivertrip_fare_is_free'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('rank', models.IntegerField(db_index=True, default=999)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='drivertrip',
+            name='departure_loc',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Find.location'),
+        ),
+        migrations.AddField(
+            model_name='drivertrip',
+            name='destination_loc',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Find.location'),
+        ),
+        migrations.CreateModel(
+            name='LocationAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=100, unique=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='Find.location')),
+            ],
+        ),
+        migrations.RunPython(seed_locations, migrations.RunPython.noop),
+        migrations.RunPython(backfill_trip_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from Find.search import DRIVER_FIELDS, PASSENGER_FIELDS, document_grams, document_text
+
+
+def build_search_index(apps, schema_editor):
+    # 同 rebuild_search_index（這裡用 migration 當下的 model）；全文 / n-gram 的算法跟 search.py 共用
+    db = schema_editor.connection.alias
+    DriverTrip = apps.get_model("Find", "DriverTrip")
+    PassengerRequest = apps.get_model("Find", "PassengerRequest")
+    SearchDocument = apps.get_model("Find", "SearchDocument")
+    SearchToken = apps.get_model("Find", "SearchToken")
+    qs = DriverTrip.objects.using(db).order_by("id").only("id", *DRIVER_FIELDS)
+    last_id = 0
+    while drivers := list(qs.filter(id__gt=last_id)[:500]):
+        last_id = drivers[-1].id
+        pax = {}
+        for p in (PassengerRequest.objects.using(db).filter(driver_id__in=[d.id for d in drivers])
+                  .only("id", "driver_id", *PASSENGER_FIELDS).order_by("id")):
+            pax.setdefault(p.driver_id, []).append(p)
+        texts = {d.id: document_text(d, pax.get(d.id, ())) for d in drivers}
+        SearchDocument.objects.using(db).bulk_create(
+            [SearchDocument(driver_id=i, text=text) for i, text in texts.items()], batch_size=500)
+        SearchToken.objects.using(db).bulk_create(
+            [SearchToken(driver_id=i, token=g) for i, text in texts.items() for g in document_grams(text)],
+            batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Find', '0015_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_doc', serialize=False, to='Find.drivertrip')),
+                ('text', models.TextField(default='')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=2)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='Find.drivertrip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'driver'], name='find_search_token_driver')],
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
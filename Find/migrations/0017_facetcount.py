@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_facets(apps, schema_editor):
+    # 同 facets.rebuild_facets（這裡用 migration 當下的 model）。
+    # dep / des 看 departure_loc / destination_loc：既有司機在 0015 已經補好，這裡才算得到
+    db = schema_editor.connection.alias
+    DriverTrip = apps.get_model("Find", "DriverTrip")
+    FacetCount = apps.get_model("Find", "FacetCount")
+    active = DriverTrip.objects.using(db).filter(is_active=True)
+    rows = []
+    for dimension, field in (("dep", "departure_loc"), ("des", "destination_loc"),
+                             ("date", "date"), ("ret", "return_date")):
+        counts = (active.filter(**{f"{field}__isnull": False}).order_by()
+                  .values_list(field).annotate(n=Count("id")))
+        rows += [FacetCount(dimension=dimension, value=str(value), count=n) for value, n in counts]
+    FacetCount.objects.using(db).bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Find', '0016_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=8)),
+                ('value', models.CharField(max_length=32)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'value'), name='find_facet_dimension_value')],
+            },
+        ),
+        migrations.RunPython(build_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:01
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def location_resolver(apps, db):
+    """同 locations.resolve_location_id（這裡用 migration 當下的 model，不用模組裡的快取）"""
+    Location = apps.get_model("Find", "Location")
+    LocationAlias = apps.get_model("Find", "LocationAlias")
+    known = list(Location.objects.using(db).filter(rank__lt=999).order_by("rank", "id").values_list("name", "id"))
+    aliases = dict(LocationAlias.objects.using(db).values_list("alias", "location_id"))
+
+    def resolve(text):
+        key = re.sub(r"\s+", " ", str(text or "")).strip().replace("臺", "台")[:100]
+        if not key:
+            return None
+        if key not in aliases:
+            loc_id = next((loc_id for name, loc_id in known if name in key), None)
+            if loc_id is None:
+                loc_id = Location.objects.using(db).get_or_create(name=key, defaults={"rank": 999})[0].id
+            LocationAlias.objects.using(db).create(alias=key, location_id=loc_id)
+            aliases[key] = loc_id
+        return aliases[key]
+    return resolve
+
+
+def backfill_passenger_locations(apps, schema_editor):
+    # 既有乘客的 departure / destination 對應到 Location（同 backfill_locations，分批依 id 往後讀）
+    db = schema_editor.connection.alias
+    PassengerRequest = apps.get_model("Find", "PassengerRequest")
+    resolve = location_resolver(apps, db)
+    qs = PassengerRequest.objects.using(db).order_by("id").only("id", "departure", "destination")
+    last_id = 0
+    while rows := list(qs.filter(id__gt=last_id)[:1000]):
+        last_id = rows[-1].id
+        for p in rows:
+            p.departure_loc_id, p.destination_loc_id = resolve(p.departure), resolve(p.destination)
+        PassengerRequest.objects.using(db).bulk_update(rows, ["departure_loc", "destination_loc"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Find', '0017_facetcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='passengerrequest',
+            name='departure_loc',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Find.location'),
+        ),
+        migrations.AddField(
+            model_name='passengerrequest',
+            name='destination_loc',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Find.location'),
+        ),
+        migrations.AddIndex(
+            model_name='passengerrequest',
+            index=models.Index(fields=['date', 'driver', 'is_matched'], name='find_pax_date_open'),
+        ),
+        migrations.RunPython(backfill_passenger_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Find', '0018_passengerrequest_locations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('promoted_at', models.DateTimeField(blank=True, null=True)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='Find.drivertrip')),
+                ('passenger', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist_entry', to='Find.passengerrequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['driver', 'promoted_at', 'id'], name='find_waitlist_fifo')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+def mark_waitlisted(apps, schema_editor):
+    # 已經在排的候補（還沒遞補）標成 is_waitlisted，才不會出現在未指派的乘客裡
+    PassengerRequest = apps.get_model("Find", "PassengerRequest")
+    PassengerRequest.objects.using(schema_editor.connection.alias).filter(
+        waitlist_entry__promoted_at__isnull=True, waitlist_entry__isnull=False,
+        driver__isnull=True, is_matched=False,
+    ).update(is_waitlisted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Find', '0019_waitlistentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='passengerrequest',
+            name='is_waitlisted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_waitlisted, migrations.RunPython.noop),
+    ]
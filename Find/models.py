@@ -1,5 +1,47 @@
-from django.db import models
+import re
+
+from django.db import models, router
 from django.core.exceptions import ValidationError
+
+# fare_note 含這些字 → 免費 / 待定（比對不分大小寫，字要小寫）；金額是 0 也算
+# 跟以前 fare_mode=free 的 iregex（免費|待定|待議|AA|未定）一樣算 AA（分攤，沒有固定金額）
+FARE_FREE_WORDS = ("免費", "免", "待定", "待議", "未定", "面議", "不收", "aa", "free")
+FARE_AMOUNT_MAX = 2_147_483_647
+
+
+def parse_fare_note(note) -> tuple[int | None, bool]:
+    """
+    fare_note → (fare_amount, fare_is_free)
+      - 金額：第一個數字（千分位逗號會忽略）："NT$1,200" → 1200、"100~200" → 100；
+        沒有數字 / 超出 int 範圍 = None
+      - 免費：空白、含 FARE_FREE_WORDS、或金額為 0
+    """
+    note = (note or "").strip()
+    m = re.search(r"\d+", re.sub(r"(?<=\d),(?=\d{3})", "", note))
+    amount = int(m.group()) if m else None
+    if amount is not None and amount > FARE_AMOUNT_MAX:
+        amount = None
+    low = note.lower()
+    free = not note or amount == 0 or any(w in low for w in FARE_FREE_WORDS)
+    return amount, free
+
+
+# 📍 地點（出發地 / 目的地正規化；對應規則在 Find/locations.py）
+class Location(models.Model):
+    name = models.CharField(max_length=100, unique=True)       # 標準名稱
+    rank = models.IntegerField(default=999, db_index=True)     # 地理順序（CITY_N2S 的順位，1 起算）；對不到城市 = 999
+
+    def __str__(self):
+        return self.name
+
+
+class LocationAlias(models.Model):
+    alias = models.CharField(max_length=100, unique=True)      # 正規化後的原始文字（標準名稱本身也有一筆）
+    location = models.ForeignKey(Location, related_name="aliases", on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.alias} → {self.location_id}"
+
 # 🚗 出車人 (司機)
 class DriverTrip(models.Model):
     driver_name = models.CharField(max_length=50)
@@ -39,7 +81,15 @@ class DriverTrip(models.Model):
     seats_filled = models.IntegerField(default=0)
     departure = models.CharField(max_length=100)
     destination = models.CharField(max_length=100)
+    # ↓ 存檔時由 departure / destination 對應（locations.resolve_location_id），地理排序 / 地點篩選用整數 id
+    departure_loc = models.ForeignKey(Location, null=True, blank=True, editable=False,
+                                      related_name="+", on_delete=models.SET_NULL)
+    destination_loc = models.ForeignKey(Location, null=True, blank=True, editable=False,
+                                        related_name="+", on_delete=models.SET_NULL)
     fare_note = models.CharField("酌收費用", max_length=100, blank=True, null=True)
+    # ↓ 存檔時由 fare_note 算好（parse_fare_note），票價排序 / 篩選直接比較這兩欄
+    fare_amount = models.IntegerField(null=True, blank=True, editable=False, db_index=True)
+    fare_is_free = models.BooleanField(default=True, editable=False)
     date = models.DateField()
     return_date = models.DateField(blank=True, null=True)  # ✅ 回程日期，可空
     flexible_pickup = models.CharField(   # ✅ 改到 DriverTrip
@@ -53,13 +103,40 @@ class DriverTrip(models.Model):
     )
     note = models.TextField(blank=True,null=True)
     is_active = models.BooleanField(default=True)
-    pass
+
+    class Meta:
+        # 布林欄位放在後面：sqlite / PostgreSQL 的 WHERE "is_active" 沒辦法當索引前綴用
+        indexes = [
+            # 依日期排序 / date_in 篩選
+            models.Index(fields=["date", "is_active"], name="find_drv_date_active"),
+            # 起訖篩選（dep_in、dep_in + des_in、find_people 的同路線）與出發地計數
+            models.Index(fields=["departure", "destination", "is_active"], name="find_drv_route"),
+            # des_in 篩選與目的地計數
+            models.Index(fields=["destination", "is_active"], name="find_drv_des_active"),
+        ]
 
     def clean(self):
         super().clean()
         if self.return_date and self.date and self.return_date < self.date:
             raise ValidationError({'return_date': '回程日期不可早於出發日期'})
 
+    def save(self, *args, **kwargs):
+        from .locations import resolve_location_id
+
+        update_fields = kwargs.get("update_fields")
+        derived = set()
+        if update_fields is None or "fare_note" in update_fields:
+            self.fare_amount, self.fare_is_free = parse_fare_note(self.fare_note)
+            derived |= {"fare_amount", "fare_is_free"}
+        if update_fields is None or {"departure", "destination"} & set(update_fields):
+            using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+            self.departure_loc_id = resolve_location_id(self.departure, using)
+            self.destination_loc_id = resolve_location_id(self.destination, using)
+            derived |= {"departure_loc", "destination_loc"}
+        if update_fields is not None and derived:
+            kwargs["update_fields"] = {*update_fields, *derived}
+        super().save(*args, **kwargs)
+
     @property
     def seats_left(self):
         return self.seats_total - self.seats_filled
@@ -109,10 +186,18 @@ class PassengerRequest(models.Model):
     willing_to_pay = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     departure = models.CharField(max_length=100)
     destination = models.CharField(max_length=100)
+    # ↓ 同 DriverTrip：存檔時對應到 Location，順路媒合（routes.py）用
+    departure_loc = models.ForeignKey(Location, null=True, blank=True, editable=False,
+                                      related_name="+", on_delete=models.SET_NULL)
+    destination_loc = models.ForeignKey(Location, null=True, blank=True, editable=False,
+                                        related_name="+", on_delete=models.SET_NULL)
     date = models.DateField()
     return_date = models.DateField(blank=True, null=True)  # ✅ 回程日期，可空
     note = models.TextField(blank=True)
     is_matched = models.BooleanField(default=False)
+    # 排候補中（waitlist.py）：一樣是 driver = None、is_matched = False，
+    # 但不算未指派的乘客（首頁乘客列表、候選乘客、自動媒合都不列），遞補上去才改回 False
+    is_waitlisted = models.BooleanField(default=False)
     driver = models.ForeignKey(
         DriverTrip,
         related_name="passengers",
@@ -126,5 +211,74 @@ class PassengerRequest(models.Model):
     # 可選：如果你之後要真的存「是否一起回程」
     together_return = models.BooleanField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # pending_list / accepted_list 的 Prefetch（driver_id IN (...) AND is_matched=?），
+            # 也涵蓋首頁「未指派司機」的乘客（driver_id IS NULL AND is_matched=False）
+            models.Index(fields=["driver", "is_matched"], name="find_pax_driver_matched"),
+            # 司機管理頁的候選乘客：同起訖、同日期、未媒合、未指派
+            models.Index(fields=["departure", "destination", "date", "is_matched", "driver"],
+                         name="find_pax_route_candidates"),
+            # 順路候選乘客：日期區間內、未指派（routes.passengers_on_route）
+            models.Index(fields=["date", "driver", "is_matched"], name="find_pax_date_open"),
+        ]
+
+    def save(self, *args, **kwargs):
+        from .locations import resolve_location_id
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"departure", "destination"} & set(update_fields):
+            using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+            self.departure_loc_id = resolve_location_id(self.departure, using)
+            self.destination_loc_id = resolve_location_id(self.destination, using)
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "departure_loc", "destination_loc"}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.passenger_name} - {self.departure} → {self.destination}"
+
+
+# 🔎 首頁關鍵字搜尋的 n-gram 索引（維護方式見 Find/search.py）
+class SearchDocument(models.Model):
+    driver = models.OneToOneField(DriverTrip, primary_key=True, related_name="search_doc",
+                                  on_delete=models.CASCADE)
+    text = models.TextField(default="")   # 司機 + 乘客的可搜尋欄位，一個欄位一行、小寫
+
+
+class SearchToken(models.Model):
+    token = models.CharField(max_length=2)   # 1-gram / 2-gram
+    driver = models.ForeignKey(DriverTrip, related_name="+", on_delete=models.CASCADE)
+
+    class Meta:
+        # 不設 unique：MySQL 的 *_ci 定序會把 "e" / "é" 這類 token 視為相同
+        indexes = [models.Index(fields=["token", "driver"], name="find_search_token_driver")]
+
+
+# 📊 首頁篩選選項的計數（維護方式見 Find/facets.py）
+class FacetCount(models.Model):
+    dimension = models.CharField(max_length=8)   # dep / des / date / ret
+    value = models.CharField(max_length=32)      # Location id 或 YYYY-MM-DD
+    count = models.IntegerField(default=0)       # 上架中的司機有幾位
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["dimension", "value"], name="find_facet_dimension_value"),
+        ]
+
+
+# ⏳ 行程候補（維護方式見 Find/waitlist.py）
+class WaitlistEntry(models.Model):
+    driver = models.ForeignKey(DriverTrip, related_name="waitlist", on_delete=models.CASCADE)
+    # 候補中的乘客先不掛司機（driver = None、is_waitlisted = True）；輪到了才掛到這位司機的待確認
+    passenger = models.OneToOneField(PassengerRequest, related_name="waitlist_entry",
+                                     on_delete=models.CASCADE)
+    token = models.CharField(max_length=32)               # WebSocket watch_waitlist 用
+    created_at = models.DateTimeField(auto_now_add=True)
+    promoted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # 依報名順序（id）找還在排的候補
+            models.Index(fields=["driver", "promoted_at", "id"], name="find_waitlist_fifo"),
+        ]
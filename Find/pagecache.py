@@ -0,0 +1,92 @@
+"""
+首頁司機卡片的結果快取（依資料版本）
+
+大部分訪客看的都是同一頁：預設排序（date_desc）、沒有篩選的第一頁。以前每個 index 請求
+都重跑一次篩選 / annotate / prefetch，再把每張卡片渲染一遍。
+
+這裡把「一頁的結果」存起來：
+  key   = (排序, 正規化後的篩選, cursor, 每頁張數, 資料版本)
+  value = CardPage（這一頁的司機 id、渲染好的卡片 HTML、下一頁的 cursor）
+
+資料版本就是 snapshot.data_version()：DriverTrip / PassengerRequest 有寫入（交易提交後）就 +1，
+版本一變，舊的 key 再也不會被查到；發現版本變了就整個清掉，不必等 LRU 慢慢擠出去。
+卡片 HTML 不依賴 request（廣播也是這樣渲染的），所以可以跨使用者共用。
+
+注意：跟快照一樣是「程序內」的快取；bulk 匯入 / update() 不會 +1 版本，要等下一次正常寫入。
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .snapshot import data_version
+from .subscriptions import normalize_filters
+
+
+@dataclass(frozen=True)
+class CardPage:
+    ids: tuple            # 這一頁的司機 id（依排序）
+    html: str             # 這一頁每張 _driver_card.html 串起來
+    next: str | None      # 下一頁的 cursor（pagination.py）；None = 最後一頁
+
+
+def filters_key(filters: dict | None) -> tuple:
+    """篩選 dict → 可以當 dict key 的 tuple（多選值排序過，空值一律 None）"""
+    out = []
+    for k, v in sorted(normalize_filters(filters).items()):
+        out.append((k, tuple(v) if isinstance(v, list) else v))
+    return tuple(out)
+
+
+class PageCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._version = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "size": 0}
+
+    def _check_version(self, version):
+        # 呼叫端持有 _lock
+        if version != self._version:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self._version = version
+
+    def get_or_build(self, key: tuple, build):
+        """有就拿快取；沒有就 build()，存起來（只存在目前的資料版本下）"""
+        if self.maxsize <= 0:
+            return build()
+        version = data_version()   # 在查詢「之前」取：查詢途中有寫入的話，這份結果只會存在舊版本下
+        full_key = (*key, version)
+        with self._lock:
+            self._check_version(version)
+            hit = self._entries.get(full_key)
+            if hit is not None:
+                self._entries.move_to_end(full_key)
+                self.stats["hits"] += 1
+                return hit
+            self.stats["misses"] += 1
+
+        value = build()
+
+        with self._lock:
+            self._check_version(data_version())
+            if self._version == version:
+                self._entries[full_key] = value
+                self._entries.move_to_end(full_key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+            self.stats["size"] = len(self._entries)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.stats["size"] = 0
+
+
+page_cache = PageCache(settings.FIND_PAGE_CACHE_SIZE)
@@ -0,0 +1,136 @@
+"""
+首頁司機清單的 keyset（cursor）分頁
+
+以前 index / _partial=1 一次把所有上架司機（連同待確認、已接受乘客）渲染成一份 HTML。
+現在第一頁只渲染 FIND_PAGE_SIZE 張，往下捲再用 cursor 取下一頁（views.driver_cards_page）。
+
+cursor 是「上一頁最後一張卡片的排序欄位值」，不是 OFFSET：
+  - 中間有卡片新增 / 下架也不會重複或漏掉（OFFSET 會整批位移）
+  - 每種排序最後都用 id 收尾，同值的卡片順序固定
+  - 欄位值跟 subscriptions.sort_key 同一個順序；WebSocket 訂閱用 fields_key 判斷
+    卡片是不是落在前端已經載入的範圍（<= until）
+
+排序欄位（由左到右比較，desc = 大的在前）：
+  date_desc  date↓ id↓             date_asc   date↑ id↑
+  dep_n2s    dep_rank↑ date↑ id↑   dep_s2n    dep_rank↓ date↑ id↑
+  seats_asc  available↑ id↑        seats_desc available↓ id↑
+  fare_asc   免費↓ 沒金額↑ 金額↑ id↑
+  fare_desc  免費↑ 沒金額↑ 金額↓ id↑
+"""
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.db.models import Case, ExpressionWrapper, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce
+
+from .locations import UNKNOWN_RANK
+from .search import DATE_RE
+
+KEYSET = {
+    "date_desc": (("date", True), ("id", True)),
+    "date_asc": (("date", False), ("id", False)),
+    "dep_n2s": (("dep_rank", False), ("date", False), ("id", False)),
+    "dep_s2n": (("dep_rank", True), ("date", False), ("id", False)),
+    "seats_asc": (("available", False), ("id", False)),
+    "seats_desc": (("available", True), ("id", False)),
+    "fare_asc": (("fare_is_free", True), ("fare_missing", False), ("fare_value", False), ("id", False)),
+    "fare_desc": (("fare_is_free", False), ("fare_missing", False), ("fare_value", True), ("id", False)),
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _annotation(name):
+    if name == "dep_rank":
+        return Coalesce(F("departure_loc__rank"), Value(UNKNOWN_RANK))
+    if name == "available":
+        return ExpressionWrapper(F("seats_total") - F("seats_filled"), output_field=IntegerField())
+    if name == "fare_missing":
+        return Case(When(fare_amount__isnull=True, then=Value(1)), default=Value(0), output_field=IntegerField())
+    if name == "fare_value":
+        return Coalesce(F("fare_amount"), Value(0))
+    return None     # 本來就是欄位
+
+
+def keyset_queryset(qs, sort: str):
+    """補上排序需要的 annotation，並依 KEYSET 排序（跟 driver_cards_qs 原本的 order_by 等價）"""
+    cols = KEYSET[sort]
+    extra = {name: _annotation(name) for name, _ in cols
+             if _annotation(name) is not None and name not in qs.query.annotations}
+    if extra:
+        qs = qs.annotate(**extra)
+    return qs.order_by(*[F(name).desc() if desc else F(name).asc() for name, desc in cols])
+
+
+def after_q(sort: str, values) -> Q:
+    """排在 values（某張卡片的 key）之後的卡片：(a > x) OR (a = x AND b > y) OR ..."""
+    parts, same = [], Q()
+    for (name, desc), v in zip(KEYSET[sort], values):
+        parts.append(same & Q(**{f"{name}__{'lt' if desc else 'gt'}": v}))
+        same &= Q(**{name: v})
+    return reduce(or_, parts)
+
+
+# ---- key：JSON 可以直接表示的值（日期用 ISO 字串） ----
+def row_key(d, sort: str) -> list:
+    """keyset_queryset 查出來的 DriverTrip → key"""
+    out = []
+    for name, _ in KEYSET[sort]:
+        v = getattr(d, name)
+        out.append(v.isoformat() if name == "date" else v)
+    return out
+
+
+def fields_key(fields: dict, driver_id: int, sort: str) -> list:
+    """subscriptions.driver_match_fields → key（與 row_key 相同）"""
+    amount = fields["fare_amount"]
+    values = {
+        "id": driver_id,
+        "date": fields["date"],
+        "dep_rank": fields["departure_rank"],
+        "available": fields["seats_total"] - fields["seats_filled"],
+        "fare_is_free": bool(fields["fare_is_free"]),
+        "fare_missing": 1 if amount is None else 0,
+        "fare_value": amount or 0,
+    }
+    return [values[name] for name, _ in KEYSET[sort]]
+
+
+def key_after(key, cursor, sort: str) -> bool:
+    """key 是否排在 cursor 之後（同 after_q，Python 版）"""
+    for (_, desc), a, b in zip(KEYSET[sort], key, cursor):
+        if a != b:
+            return a < b if desc else a > b
+    return False
+
+
+# ---- cursor：base64url(JSON [sort, key]) ----
+def encode_cursor(sort: str, key) -> str:
+    raw = json.dumps([sort, list(key)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> list:
+    """cursor → key；不是這個排序的 cursor、或格式不對 → InvalidCursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cur_sort, key = json.loads(raw)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("cursor 格式錯誤") from e
+    cols = KEYSET.get(sort)
+    if cur_sort != sort or not isinstance(key, list) or len(key) != len(cols):
+        raise InvalidCursor("cursor 與目前的排序不符")
+    for (name, _), v in zip(cols, key):
+        if name == "date":
+            ok = isinstance(v, str) and DATE_RE.fullmatch(v)
+        elif name == "fare_is_free":
+            ok = isinstance(v, bool)
+        else:
+            ok = isinstance(v, int) and not isinstance(v, bool)
+        if not ok:
+            raise InvalidCursor("cursor 欄位值錯誤")
+    return key
@@ -0,0 +1,231 @@
+"""
+順路媒合（"順路可載"）
+
+以前 find_people / driver_manage 的候選名單只認「出發地、目的地、日期完全一樣」。
+司機勾了 flexible_pickup = YES（順路可載），路上會經過的乘客卻一個都配不到。
+
+路線模型：把 CITY_N2S 裡「依序相鄰 = 路上會經過」的幾段當成走廊（CORRIDORS），
+相鄰的兩站連一條邊，兩地之間的路線就是這張圖上站數最少的路徑。
+  台北市 → 花蓮縣光復鄉：台北市、新北市、宜蘭縣、花蓮縣、花蓮縣光復鄉
+  高雄市 → 台東縣：      高雄市、屏東縣、台東縣（南迴）
+離島、對不到城市的自填地點（rank = UNKNOWN_RANK）不在圖上，只能完全同地點才配得到。
+
+圖很小（二十幾站），所有站對的路線 / 距離在 import 時就算好（ROUTES / DIST），
+每條司機路線載得到哪些乘客站對也只算一次（served_pairs），每次媒合只是查表，不再碰字串。
+
+司機路線上的乘客分三種（排序依序）：
+  exact   起訖地點跟司機一樣
+  along   起點、終點都在司機路線上，而且方向相同（起點在前）
+  detour  起點或終點離路線不超過 FIND_ROUTE_MAX_DETOUR 站；只給 flexible_pickup = NO（不順路也OK）
+日期差在 FIND_ROUTE_DATE_WINDOW 天以內；同類再依繞路站數、日期差、共乘的路段長短排序。
+"""
+from collections import deque
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+
+from .locations import DB_ALIAS, known_locations
+from .models import DriverTrip, PassengerRequest
+
+# 依 CITY_N2S 的順序；同一段裡相鄰的兩站之間有路
+CORRIDORS = (
+    # 西部：基隆 → 屏東
+    ("基隆市", "台北市", "新北市", "桃園市", "新竹市", "新竹縣", "苗栗縣",
+     "台中市", "彰化縣", "南投縣", "雲林縣", "嘉義市", "嘉義縣", "台南市", "高雄市", "屏東縣"),
+    # 東部：北宜 → 花東 → 南迴接回屏東
+    ("新北市", "宜蘭縣", "花蓮縣", "花蓮縣光復鄉", "台東縣", "屏東縣"),
+)
+# 光復一帶的細分地點：路線上當成同一站
+STOPS = {
+    "需清淤地區": "花蓮縣光復鄉",
+    "光復鄉糖廠": "花蓮縣光復鄉",
+    "花蓮縣光復車站以外火車站": "花蓮縣",
+}
+
+KIND_ORDER = {"exact": 0, "along": 1, "detour": 2}
+
+
+def _graph() -> dict:
+    adj = {}
+    for corridor in CORRIDORS:
+        for a, b in zip(corridor, corridor[1:]):
+            adj.setdefault(a, []).append(b)
+            adj.setdefault(b, []).append(a)
+    return adj
+
+
+def _bfs(adj, start):
+    """start → {站: 上一站}（鄰站依 CORRIDORS 的順序走，同樣站數時路線固定）"""
+    prev, queue = {start: None}, deque([start])
+    while queue:
+        node = queue.popleft()
+        for nxt in adj[node]:
+            if nxt not in prev:
+                prev[nxt] = node
+                queue.append(nxt)
+    return prev
+
+
+def _build():
+    adj = _graph()
+    routes, dist = {}, {}
+    for a in adj:
+        prev = _bfs(adj, a)
+        for b in adj:
+            path, node = [], b
+            while node is not None:
+                path.append(node)
+                node = prev[node]
+            path.reverse()
+            routes[(a, b)] = {n: i for i, n in enumerate(path)}
+            dist[(a, b)] = len(path) - 1
+    return routes, dist
+
+
+# (起站, 迄站) → {路線上的站: 第幾站（0 起算）}；(站, 站) → 站數
+ROUTES, DIST = _build()
+NODES = frozenset(n for n, _ in ROUTES)
+
+
+@dataclass(frozen=True)
+class RouteMatch:
+    kind: str        # exact / along / detour
+    detour: int      # 乘客起訖離司機路線幾站
+    date_gap: int    # 日期差幾天
+    shared: int      # 共乘幾站
+
+    @property
+    def rank(self) -> tuple:
+        return (KIND_ORDER[self.kind], self.detour, self.date_gap, -self.shared)
+
+
+_nodes: dict = {}     # db alias -> {Location id: 站名}
+
+
+def location_nodes(using: str = DB_ALIAS) -> dict:
+    if using not in _nodes:
+        _nodes[using] = {loc_id: STOPS.get(name, name) for name, loc_id in known_locations(using)
+                         if STOPS.get(name, name) in NODES}
+    return _nodes[using]
+
+
+def node_locations(nodes, using: str = DB_ALIAS) -> set:
+    """站名 → 所有對應的 Location id（含 STOPS 的細分地點）"""
+    nodes = set(nodes)
+    return {loc_id for loc_id, node in location_nodes(using).items() if node in nodes}
+
+
+def _nearest(route: dict, node):
+    """離路線最近的站 → (路線上第幾站, 距離)"""
+    return min(((pos, DIST[(node, n)]) for n, pos in route.items()), key=lambda t: (t[1], t[0]))
+
+
+@lru_cache(maxsize=None)
+def served_pairs(a, b, flexible: str = "YES") -> dict:
+    """
+    司機路線 a → b 載得到的乘客起訖站對 → RouteMatch（date_gap = 0）。
+    route_match 查的就是這張表；批次媒合（matching.py）拿它反查「哪些司機經過這一段」。
+    """
+    route = ROUTES[(a, b)]
+    if flexible == "NO":
+        near = {n: _nearest(route, n) for n in NODES}
+        near = {n: t for n, t in near.items() if t[1] <= settings.FIND_ROUTE_MAX_DETOUR}
+    else:
+        near = {n: (pos, 0) for n, pos in route.items()}
+    out = {}
+    for p, (pi, pd) in near.items():
+        for q, (qi, qd) in near.items():
+            if pi < qi and pd + qd <= settings.FIND_ROUTE_MAX_DETOUR:
+                out[(p, q)] = RouteMatch("along" if pd + qd == 0 else "detour", pd + qd, 0, qi - pi)
+    out[(a, b)] = RouteMatch("exact", 0, 0, len(route) - 1)
+    return out
+
+
+def route_nodes(dep_loc, des_loc, using: str = DB_ALIAS):
+    """起訖（Location id）→ (起站, 迄站)；不在路線圖上、或起訖同一站 → None"""
+    nodes = location_nodes(using)
+    a, b = nodes.get(dep_loc), nodes.get(des_loc)
+    if a is None or b is None or a == b:
+        return None
+    return a, b
+
+
+def route_match(drv_dep, drv_des, pax_dep, pax_des, *, flexible="YES", using: str = DB_ALIAS):
+    """
+    司機 / 乘客的起訖（Location id）→ RouteMatch；配不上回傳 None（date_gap 由呼叫端補）
+    """
+    if drv_dep is not None and (drv_dep, drv_des) == (pax_dep, pax_des):
+        return RouteMatch("exact", 0, 0, 0)
+    drv, pax = route_nodes(drv_dep, drv_des, using), route_nodes(pax_dep, pax_des, using)
+    if drv is None or pax is None:
+        return None
+    return served_pairs(*drv, "NO" if flexible == "NO" else "YES").get(pax)
+
+
+def _reach(node, hops: int) -> set:
+    return {n for n in NODES if DIST[(node, n)] <= hops}
+
+
+def _ranked(pairs, limit):
+    pairs.sort(key=lambda t: (t[1].rank, t[0].id))
+    out = []
+    for obj, m in pairs[:limit]:
+        obj.route_match = m
+        out.append(obj)
+    return out
+
+
+def passengers_on_route(driver, *, using: str = DB_ALIAS, window=None, limit=None) -> list:
+    """
+    司機路線上（日期區間內、未指派、座位夠）的乘客，依 RouteMatch.rank 排序；
+    每位乘客帶 .route_match
+    """
+    window = settings.FIND_ROUTE_DATE_WINDOW if window is None else window
+    qs = PassengerRequest.objects.using(using).filter(
+        date__range=(driver.date - timedelta(days=window), driver.date + timedelta(days=window)),
+        driver__isnull=True, is_matched=False, is_waitlisted=False, seats_needed__lte=driver.seats_left,
+    )
+    drv = route_nodes(driver.departure_loc_id, driver.destination_loc_id, using)
+    if drv is None:
+        # 不在路線圖上：只剩完全同地點
+        qs = qs.filter(departure_loc_id=driver.departure_loc_id,
+                       destination_loc_id=driver.destination_loc_id)
+    else:
+        on = set(ROUTES[drv])
+        if driver.flexible_pickup == "NO":
+            on = set().union(*(_reach(n, settings.FIND_ROUTE_MAX_DETOUR) for n in on))
+        locs = node_locations(on, using)
+        qs = qs.filter(departure_loc_id__in=locs, destination_loc_id__in=locs)
+
+    pairs = []
+    for p in qs:
+        m = route_match(driver.departure_loc_id, driver.destination_loc_id,
+                        p.departure_loc_id, p.destination_loc_id,
+                        flexible=driver.flexible_pickup, using=using)
+        if m is not None:
+            pairs.append((p, RouteMatch(m.kind, m.detour, abs((p.date - driver.date).days), m.shared)))
+    return _ranked(pairs, limit)
+
+
+def drivers_on_route(passenger, *, using: str = DB_ALIAS, window=None, limit=None) -> list:
+    """
+    會經過這位乘客起訖的上架司機（日期區間內、座位夠），依 RouteMatch.rank 排序；
+    每位司機帶 .route_match
+    """
+    window = settings.FIND_ROUTE_DATE_WINDOW if window is None else window
+    qs = DriverTrip.objects.using(using).filter(
+        date__range=(passenger.date - timedelta(days=window), passenger.date + timedelta(days=window)),
+        is_active=True,
+    )
+    pairs = []
+    for d in qs:
+        if d.seats_left < passenger.seats_needed:
+            continue
+        m = route_match(d.departure_loc_id, d.destination_loc_id,
+                        passenger.departure_loc_id, passenger.destination_loc_id,
+                        flexible=d.flexible_pickup, using=using)
+        if m is not None:
+            pairs.append((d, RouteMatch(m.kind, m.detour, abs((d.date - passenger.date).days), m.shared)))
+    return _ranked(pairs, limit)
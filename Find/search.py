@@ -0,0 +1,107 @@
+"""
+首頁關鍵字（q）的 n-gram 倒排索引
+
+以前每個詞都是 10 個欄位的 icontains OR，還要 join 乘客表再 distinct，每打一個字就掃兩張表。
+中文沒有空白斷詞，這裡用「字元 n-gram」：
+
+  - SearchDocument：每位司機一份全文（司機欄位 + 所有乘客的姓名 / 備註，一個欄位一行、轉小寫），
+    跟 subscriptions.driver_match_fields 的 "text" 是同一份（document_text）
+  - SearchToken：全文裡出現過的每個 1-gram / 2-gram（不跨行、不含空白）→ 司機
+
+查詢一個詞：
+  1) 詞的所有 2-gram（一個字的詞就用 1-gram）都出現過的司機 → 候選（走 (token, driver) 索引）
+  2) 候選的全文確實包含整個詞（2-gram 都在不代表相連；MySQL 定序也可能多配）→ 結果
+所以結果跟以前的 icontains 完全一樣，只是不用再掃全表。多個詞照舊 AND。
+
+既有司機由 0016 migration 建索引；之後在存檔時維護（signals.py → reindex_drivers），
+bulk_create / update() 不會觸發，那種情況跑 python manage.py rebuild_search_index。
+"""
+import re
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import DriverTrip, PassengerRequest, SearchDocument, SearchToken
+
+DB_ALIAS = "find_db"
+DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# 會被搜尋到的欄位（改了這裡要跑 rebuild_search_index）
+DRIVER_FIELDS = ("driver_name", "contact", "email", "departure", "destination",
+                 "note", "fare_note", "flexible_pickup")
+PASSENGER_FIELDS = ("passenger_name", "note")
+
+
+def document_text(driver, passengers) -> str:
+    text = [getattr(driver, f) for f in DRIVER_FIELDS]
+    text += [p.passenger_name for p in passengers] + [p.note for p in passengers]
+    return "\n".join(str(t) for t in text if t).lower()
+
+
+def document_grams(text: str) -> set:
+    grams = set()
+    for line in text.split("\n"):
+        for part in line.split():
+            grams.update(part)
+            grams.update(part[i:i + 2] for i in range(len(part) - 1))
+    return grams
+
+
+def term_grams(term: str) -> set:
+    if len(term) == 1:
+        return {term}
+    return {term[i:i + 2] for i in range(len(term) - 1)}
+
+
+def search_terms(qkw: str) -> list[str]:
+    return [t.lower() for t in re.split(r"\s+", qkw or "") if t]
+
+
+def search_q(qkw: str) -> Q:
+    """driver_cards_qs 的 q：每個詞都要命中（AND）；整串是 YYYY-MM-DD 時也比對出發 / 回程日期"""
+    q = Q()
+    for term in search_terms(qkw):
+        grams = term_grams(term)
+        candidates = (
+            SearchToken.objects.filter(token__in=grams)
+            .values("driver_id").annotate(n=Count("token")).filter(n__gte=len(grams))
+            .values("driver_id")
+        )
+        q &= Q(id__in=candidates, search_doc__text__contains=term)
+    qkw = (qkw or "").strip()
+    if DATE_RE.fullmatch(qkw):
+        q |= Q(date=qkw) | Q(return_date=qkw)
+    return q
+
+
+def reindex_drivers(driver_ids, using: str = DB_ALIAS, batch_size: int = 500) -> int:
+    """
+    重建這些司機的全文與 token（只寫有變的部分）；回傳實際改了幾位。
+    不存在的 id（已刪除）會順便清掉殘留的索引。
+    """
+    ids = sorted({i for i in driver_ids if i})
+    changed = 0
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        drivers = DriverTrip.objects.using(using).filter(id__in=chunk).only("id", *DRIVER_FIELDS)
+        pax = {}
+        for p in (PassengerRequest.objects.using(using).filter(driver_id__in=chunk)
+                  .only("id", "driver_id", *PASSENGER_FIELDS).order_by("id")):
+            pax.setdefault(p.driver_id, []).append(p)
+        texts = {d.id: document_text(d, pax.get(d.id, ())) for d in drivers}
+        old = dict(SearchDocument.objects.using(using).filter(driver_id__in=chunk).values_list("driver_id", "text"))
+        stale = [i for i in chunk if i in old and old[i] != texts.get(i)]
+        new = [i for i in texts if old.get(i) != texts[i]]
+        if not stale and not new:
+            continue
+        with transaction.atomic(using=using):
+            if stale:
+                SearchToken.objects.using(using).filter(driver_id__in=stale).delete()
+                SearchDocument.objects.using(using).filter(driver_id__in=stale).delete()
+            SearchDocument.objects.using(using).bulk_create(
+                [SearchDocument(driver_id=i, text=texts[i]) for i in new], batch_size=batch_size)
+            SearchToken.objects.using(using).bulk_create(
+                [SearchToken(driver_id=i, token=g) for i in new for g in document_grams(texts[i])],
+                batch_size=2000)
+        changed += len(set(stale) | set(new))
+    return changed
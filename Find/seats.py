@@ -0,0 +1,307 @@
+"""
+座位扣減 / 歸還：單一條件式 UPDATE，不再 SELECT ... FOR UPDATE
+
+以前 join_driver、pax_accept、driver_manage 的批次接受都是：
+  鎖住司機列（select_for_update）→ 讀 seats_filled → Python 算 → save()
+熱門行程一貼出來，同時報名 / 接受的請求全部排隊等同一列的鎖，鎖還一路拿到交易結束。
+
+現在座位只在資料庫裡加減，條件寫在 WHERE：
+  UPDATE ... SET seats_filled = seats_filled + n WHERE id = ? AND seats_filled + n <= seats_total
+影響 1 列 = 成功；0 列 = 座位不夠（或司機不存在）。資料庫只在這一條 UPDATE 期間鎖住那一列，
+同時進來的請求不會超賣，也不必先讀再寫。乘客狀態（is_matched）也用同樣的條件式 UPDATE 搶，
+同一位乘客被接受兩次只會成功一次。
+
+update() 不觸發 signals：資料版本（snapshot / 頁面快取）在這裡補，篩選計數（facets.py）
+只在 is_active 有變時補；廣播仍由呼叫端 touch()。
+
+一次處理很多位乘客（司機管理頁的批次接受 / 拒絕）用 decide_passengers：乘客一次查詢鎖住、
+座位在記憶體裡算，最後 bulk_update 加一條座位 UPDATE，不再每位乘客各查、各存一次。
+批次要先看剩幾位才決定收誰，這裡（沒開帳本時）還是會鎖司機列，只鎖這一個批次的交易。
+
+FIND_SEAT_LEDGER 有開（ledger.py）：座位改在 Redis 扣，find_db.seats_filled 由帳本晚一點寫回；
+要看目前座位用 seats_of / seats_left，不要直接讀 find_db。帳本不在資料庫交易裡，
+會動到座位的交易一律用 seat_transaction 包（不要直接 transaction.atomic）：回滾時帳本一起倒回。
+
+    python manage.py bench_seat_allocation     # 併發壓測：吞吐量、有沒有超賣
+"""
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+
+from .facets import apply_facet_delta, stored_facets
+from .ledger import get_ledger
+from .locations import DB_ALIAS
+from .models import DriverTrip, PassengerRequest
+from .search import reindex_drivers
+from .snapshot import bump_data_version
+
+# accept_passenger 的結果
+ACCEPTED = "accepted"
+ALREADY = "already"      # 已經是已接受（重複送出 / 別的請求先接受了）
+FULL = "full"            # 座位不夠
+GONE = "gone"            # 乘客不存在，或不是這位司機的
+REJECTED = "rejected"    # decide_passengers：退回未指派
+
+logger = logging.getLogger(__name__)
+
+# decide_passengers 讀到座位後、寫入前被別的請求扣走的話，重算幾次
+DECIDE_ATTEMPTS = 5
+
+
+_guards = threading.local()
+
+
+def _changed(using):
+    transaction.on_commit(bump_data_version, using=using)
+
+
+@contextmanager
+def seat_transaction(using: str = DB_ALIAS):
+    """
+    transaction.atomic，外加帳本的回滾：區塊內在帳本扣 / 還的座位，交易回滾（例外或 set_rollback）
+    時反向做一次。可以巢狀：內層成功的變動併到外層，外層回滾時一起倒回。
+    沒開帳本就只是 transaction.atomic。
+    """
+    stack = _guards.__dict__.setdefault("stack", [])
+    ops = []
+    stack.append(ops)
+    try:
+        with transaction.atomic(using=using):
+            yield
+            kept = not transaction.get_rollback(using=using)
+    except BaseException:
+        stack.pop()
+        _revert(ops, using)
+        raise
+    stack.pop()
+    if not kept:
+        _revert(ops, using)
+    elif stack:
+        stack[-1].extend(ops)
+
+
+def _revert(ops, using):
+    if not ops:
+        return
+    ledger = get_ledger(using)
+    for driver_id, n in reversed(ops):
+        ok = ledger.release(driver_id, n) if n > 0 else ledger.reserve(driver_id, -n)
+        if not ok:
+            # 倒回時座位已經被別人用掉了（或司機刪了）：沒辦法補，記下來
+            logger.warning("seat ledger rollback failed: driver=%s seats=%+d", driver_id, -n)
+
+
+def _record(driver_id, n):
+    stack = getattr(_guards, "stack", None)
+    if stack:
+        stack[-1].append((driver_id, n))
+
+
+def reserve_seats(driver_id, n: int, using: str = DB_ALIAS) -> bool:
+    """seats_filled += n（座位夠才加）；成功回傳 True"""
+    if n <= 0:
+        return True
+    ledger = get_ledger(using)
+    if ledger is not None:
+        ok = ledger.reserve(driver_id, n)
+        if ok:
+            _record(driver_id, n)
+        return ok
+    ok = DriverTrip.objects.using(using).filter(
+        id=driver_id, seats_filled__lte=F("seats_total") - n,
+    ).update(seats_filled=F("seats_filled") + n) == 1
+    if ok:
+        _changed(using)
+    return ok
+
+
+def release_seats(driver_id, n: int, using: str = DB_ALIAS) -> bool:
+    """seats_filled -= n（不會小於 0）"""
+    if not driver_id or n <= 0:
+        return False
+    ledger = get_ledger(using)
+    if ledger is not None:
+        ok = ledger.release(driver_id, n)
+        if ok:
+            _record(driver_id, -n)
+        return ok
+    ok = DriverTrip.objects.using(using).filter(id=driver_id).update(
+        seats_filled=Greatest(F("seats_filled") - n, Value(0))) == 1
+    if ok:
+        _changed(using)
+    return ok
+
+
+def seats_of(driver_id, using: str = DB_ALIAS):
+    """(seats_total, seats_filled)；有帳本就看帳本。司機不存在回傳 None"""
+    ledger = get_ledger(using)
+    if ledger is not None:
+        return ledger.seats(driver_id)
+    return (DriverTrip.objects.using(using).filter(id=driver_id)
+            .values_list("seats_total", "seats_filled").first())
+
+
+def seats_left(driver_id, using: str = DB_ALIAS) -> int:
+    row = seats_of(driver_id, using)
+    return max(0, row[0] - row[1]) if row else 0
+
+
+def _set_active(driver_id, active: bool, cond: Q, using) -> bool:
+    ledger = get_ledger(using)
+    if ledger is not None:
+        ledger.flush([driver_id])     # 上下架看 find_db 的 seats_filled：先把帳本寫回
+    old = stored_facets(driver_id, using)
+    ok = DriverTrip.objects.using(using).filter(
+        cond, id=driver_id, is_active=not active).update(is_active=active) == 1
+    if ok:
+        apply_facet_delta(old, stored_facets(driver_id, using), using)
+        _changed(using)
+    return ok
+
+
+def clamp_seats(driver_id, seats_total: int, using: str = DB_ALIAS) -> bool:
+    """
+    司機把座位改少：已佔座位超過新的 seats_total 才截斷（條件式 UPDATE，不覆寫別的請求剛扣的座位）。
+    有帳本就先寫回，截斷看的是最新的座位數；截斷了回傳 True（下架交給 deactivate_if_full）
+    """
+    ledger = get_ledger(using)
+    if ledger is not None:
+        ledger.flush([driver_id])
+    ok = DriverTrip.objects.using(using).filter(
+        id=driver_id, seats_filled__gt=seats_total).update(seats_filled=seats_total) == 1
+    if ok:
+        _changed(using)
+    return ok
+
+
+def deactivate_if_full(driver_id, using: str = DB_ALIAS) -> bool:
+    """座位滿了就下架；這次真的下架才回傳 True"""
+    return _set_active(driver_id, False, Q(seats_filled__gte=F("seats_total")), using)
+
+
+def reactivate_if_open(driver_id, using: str = DB_ALIAS) -> bool:
+    """有空位了就重新上架；這次真的上架才回傳 True"""
+    return _set_active(driver_id, True, Q(seats_filled__lt=F("seats_total")), using)
+
+
+def accept_passenger(driver_id, pax_id, using: str = DB_ALIAS, claim_unassigned: bool = False) -> str:
+    """
+    司機接受乘客：乘客 is_matched False → True、司機 seats_filled += 人數，兩者同一個交易。
+    claim_unassigned：還沒掛司機的乘客（候選乘客）也可以直接接受，順便掛到這位司機。
+    回傳 ACCEPTED / ALREADY / FULL / GONE。
+    """
+    owner = (Q(driver_id=driver_id) | Q(driver__isnull=True, is_waitlisted=False) if claim_unassigned
+             else Q(driver_id=driver_id))
+    row = (PassengerRequest.objects.using(using).filter(owner, id=pax_id)
+           .values_list("seats_needed", "is_matched", "driver_id").first())
+    if row is None:
+        return GONE
+    seats, matched, current = row
+    if matched:
+        return ALREADY
+    with seat_transaction(using):
+        claimed = PassengerRequest.objects.using(using).filter(
+            owner, id=pax_id, is_matched=False,
+        ).update(is_matched=True, driver_id=driver_id)
+        if not claimed:
+            return ALREADY
+        if not reserve_seats(driver_id, seats, using):
+            transaction.set_rollback(True, using=using)
+            return FULL
+        if current is None:
+            # 乘客換了司機：全文索引要把他算進這位司機
+            reindex_drivers([driver_id], using=using)
+    return ACCEPTED
+
+
+def _decide(rows, accept, reject, driver_id, free):
+    """記憶體裡算：先拒絕（釋放座位），再依序接受放得下的；回傳 (結果, 要寫回的乘客, 座位增減)"""
+    results, changed, delta = {}, [], 0
+    for pid in reject:
+        p = rows.get(pid)
+        if p is None or p.driver_id != driver_id:
+            results[pid] = GONE
+            continue
+        if p.is_matched:
+            delta -= p.seats_needed
+        changed.append((p, None, False))
+        results[pid] = REJECTED
+    free -= delta
+    for pid in accept:
+        p = rows.get(pid)
+        if p is None:
+            results[pid] = GONE
+        elif p.is_matched:
+            results[pid] = ALREADY
+        elif p.seats_needed > free:
+            results[pid] = FULL
+        else:
+            free -= p.seats_needed
+            delta += p.seats_needed
+            changed.append((p, driver_id, True))
+            results[pid] = ACCEPTED
+    return results, changed, delta
+
+
+def decide_passengers(driver_id, accept=(), reject=(), using: str = DB_ALIAS,
+                      claim_unassigned: bool = True) -> dict:
+    """
+    司機一次接受 / 拒絕多位乘客；回傳 {乘客 id: ACCEPTED / ALREADY / FULL / GONE / REJECTED}。
+
+    - 接受：依 accept 的順序，座位放得下的才接受（跟以前一位一位勾選一樣）；
+      claim_unassigned 時還沒掛司機的候選乘客也可以接受
+    - 拒絕：退回未指派（driver = None），已接受的歸還座位。跟單筆 pax_reject 不同，不刪除乘客：
+      自動媒合（matching.py）的提案被拒絕後，乘客還要能配給別的司機
+    - 乘客一次查詢鎖住（select_for_update），座位在記憶體裡算；寫回是一次 bulk_update
+      加一條條件式座位 UPDATE。沒開帳本時司機列也鎖住（REPEATABLE READ 下不鎖的話重讀
+      還是同一份快照）；帳本模式座位在讀取後被別的請求扣走（reserve 失敗）就重讀帳本重算
+    """
+    accept = [int(i) for i in dict.fromkeys(accept)]
+    reject = [int(i) for i in dict.fromkeys(reject) if int(i) not in set(accept)]
+    if not accept and not reject:
+        return {}
+    owner = Q(driver_id=driver_id)
+    if claim_unassigned and accept:
+        owner |= Q(driver__isnull=True, is_waitlisted=False, id__in=accept)
+    return _decide_locked(driver_id, accept, reject, owner, using)
+
+
+def _seats_for_decide(driver_id, using):
+    # 帳本：每次都是最新的值；find_db：鎖住司機列讀，算完到寫入之間不會被別的請求扣走
+    if get_ledger(using) is not None:
+        return seats_of(driver_id, using)
+    return (DriverTrip.objects.using(using).select_for_update().filter(id=driver_id)
+            .values_list("seats_total", "seats_filled").first())
+
+
+def _decide_locked(driver_id, accept, reject, owner, using) -> dict:
+    with seat_transaction(using):
+        rows = {p.id: p for p in PassengerRequest.objects.using(using).select_for_update()
+                .filter(owner, id__in=accept + reject).only("id", "seats_needed", "is_matched", "driver")}
+        for _ in range(DECIDE_ATTEMPTS):
+            seats = _seats_for_decide(driver_id, using)
+            if seats is None:
+                return {pid: GONE for pid in accept + reject}
+            results, changed, delta = _decide(rows, accept, reject, driver_id, seats[0] - seats[1])
+            if delta <= 0 or reserve_seats(driver_id, delta, using):
+                break
+        else:
+            # 一直被搶：這次只做拒絕
+            results, changed, delta = _decide(rows, [], reject, driver_id, 0)
+            results.update({pid: FULL for pid in accept})
+        if delta < 0:
+            release_seats(driver_id, -delta, using)
+
+        for p, new_driver, matched in changed:
+            p.driver_id, p.is_matched = new_driver, matched
+        if changed:
+            PassengerRequest.objects.using(using).bulk_update([p for p, _, _ in changed],
+                                                              ["driver", "is_matched"])
+            # bulk_update 不觸發 signals：乘客進出這位司機，全文索引重算一次
+            reindex_drivers([driver_id], using=using)
+            _changed(using)
+    return results
@@ -1,36 +1,90 @@
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete, pre_save, pre_delete
 from django.dispatch import receiver
-from asgiref.sync import async_to_sync, sync_to_async
-from channels.layers import get_channel_layer
-from django.template.loader import render_to_string
 from .models import PassengerRequest, DriverTrip
+from .broadcast import mark_dirty
+from .ledger import get_ledger
+from .facets import apply_facet_delta, stored_facets, touches_facets
+from .search import DRIVER_FIELDS, PASSENGER_FIELDS, reindex_drivers
+from .snapshot import bump_data_version
 
 
 @receiver([post_save, post_delete], sender=PassengerRequest)
 @receiver([post_save, post_delete], sender=DriverTrip)
 def broadcast_update(sender, instance, **kwargs):
-    """當乘客或司機資料有變動時，廣播給所有連線的 WebSocket"""
-
-    async def _broadcast():
-        # ORM 查詢要用 sync_to_async 包裝
-        passengers = await sync_to_async(
-            lambda: list(PassengerRequest.objects.using("find_db").filter(is_matched=False))
-        )()
-        drivers = await sync_to_async(
-            lambda: list(DriverTrip.objects.using("find_db").filter(is_active=True))
-        )()
-
-        passengers_html = render_to_string("Find/_passenger_list.html", {"passengers": passengers})
-        drivers_html = render_to_string("Find/_driver_list.html", {"drivers": drivers})
-
-        channel_layer = get_channel_layer()
-        await channel_layer.group_send(
-            "find_group",
-            {
-                "type": "send_update",
-                "passengers_html": passengers_html,
-                "drivers_html": drivers_html,
-            }
-        )
-
-    async_to_sync(_broadcast)()
+    """當乘客或司機資料有變動時，標記為 dirty，交給排程器合併後再廣播給所有 WebSocket"""
+    if sender is DriverTrip:
+        drivers, passengers = [instance.pk], []
+    else:
+        # 乘客會出現在所屬司機卡片的待確認/已接受清單，司機卡片也要一起更新
+        drivers, passengers = [instance.driver_id], [instance.pk]
+
+    def _after_commit():
+        bump_data_version()   # 先讓快照失效，再排廣播
+        mark_dirty(drivers=drivers, passengers=passengers)
+
+    # 交易提交後才標記（post_delete 之後 pk 會被清成 None，所以先取值）
+    transaction.on_commit(_after_commit, using="find_db")
+
+
+# ---- 關鍵字搜尋索引（search.py）：跟著同一個交易寫入 ----
+@receiver(post_init, sender=PassengerRequest)
+def remember_search_driver(sender, instance, **kwargs):
+    # 乘客換司機時，舊司機的全文也要拿掉這位乘客（用 __dict__：被 .only() 延遲載入時不要多查一次）
+    instance._search_driver_id = instance.__dict__.get("driver_id")
+
+
+@receiver(post_save, sender=DriverTrip)
+def reindex_driver(sender, instance, update_fields=None, using=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(DRIVER_FIELDS):
+        return
+    reindex_drivers([instance.pk], using=using)
+
+
+@receiver([post_save, post_delete], sender=PassengerRequest)
+def reindex_passenger_driver(sender, instance, using=None, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {*PASSENGER_FIELDS, "driver"}:
+        return
+    reindex_drivers({instance.driver_id, getattr(instance, "_search_driver_id", None)}, using=using)
+    instance._search_driver_id = instance.driver_id
+
+
+# ---- 篩選選項計數（facets.py）：存檔前讀舊值，存檔後讀新值，差多少就加減多少 ----
+@receiver(pre_save, sender=DriverTrip)
+def remember_facets(sender, instance, update_fields=None, using=None, **kwargs):
+    if touches_facets(update_fields):
+        instance._facets_old = stored_facets(instance.pk, using)
+
+
+@receiver(post_save, sender=DriverTrip)
+def update_facets(sender, instance, update_fields=None, using=None, **kwargs):
+    if touches_facets(update_fields):
+        apply_facet_delta(getattr(instance, "_facets_old", ()), stored_facets(instance.pk, using), using)
+
+
+@receiver(pre_delete, sender=DriverTrip)
+def remember_deleted_facets(sender, instance, using=None, **kwargs):
+    instance._facets_old = stored_facets(instance.pk, using)
+
+
+@receiver(post_delete, sender=DriverTrip)
+def drop_facets(sender, instance, using=None, **kwargs):
+    apply_facet_delta(getattr(instance, "_facets_old", ()), (), using)
+
+
+# ---- 座位帳本（ledger.py）：司機存檔 / 刪除時帳本跟著對一次 ----
+@receiver(post_save, sender=DriverTrip)
+def sync_seat_ledger(sender, instance, update_fields=None, using=None, **kwargs):
+    if update_fields is not None and not {"seats_total", "seats_filled"} & set(update_fields):
+        return
+    ledger = get_ledger(using or "find_db")
+    if ledger is not None:
+        pk = instance.pk
+        transaction.on_commit(lambda: ledger.sync_driver(pk), using=using or "find_db")
+
+
+@receiver(post_delete, sender=DriverTrip)
+def forget_seat_ledger(sender, instance, using=None, **kwargs):
+    ledger = get_ledger(using or "find_db")
+    if ledger is not None:
+        ledger.forget(instance.pk)
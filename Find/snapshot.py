@@ -0,0 +1,79 @@
+"""
+首頁清單快照（render-once）
+
+每個新的 WebSocket 連線都會要一份目前的司機/乘客清單。以前是每條連線各自
+查 DB + 渲染模板；連結被分享出去時，幾秒內上百條連線就是上百次全量渲染。
+
+這裡維護一個「資料版本號」：DriverTrip / PassengerRequest 有寫入（交易提交後）就 +1。
+快照以版本號為 key，同一個版本只會渲染一次，之後的連線直接拿已序列化好的 payload。
+
+注意：版本號與快照都是「程序內」的（目前部署是單一 uvicorn 程序）。
+"""
+import threading
+from dataclasses import dataclass
+
+from .encoding import dumps
+
+_version = 0
+_version_lock = threading.Lock()
+
+_snapshot = None
+_build_lock = threading.Lock()
+
+stats = {"hits": 0, "builds": 0}
+
+
+def data_version() -> int:
+    return _version
+
+
+def bump_data_version() -> int:
+    """資料有寫入時呼叫（signals 在交易提交後呼叫）"""
+    global _version
+    with _version_lock:
+        _version += 1
+        return _version
+
+
+@dataclass(frozen=True)
+class BoardSnapshot:
+    version: int
+    drivers_html: str       # 司機清單第一頁
+    passengers_html: str
+    drivers_next: str | None    # 司機清單第二頁的 cursor（pagination.py）
+    payload: dict       # send.update 本體（msgpack / deflate 連線用）
+    payload_text: str   # 已 dumps 好的 send.update，JSON 連線直接送
+
+
+def get_board_snapshot() -> BoardSnapshot:
+    """取得目前版本的清單快照；同一版本最多重建一次"""
+    global _snapshot
+    snap = _snapshot
+    if snap is not None and snap.version == _version:
+        stats["hits"] += 1
+        return snap
+
+    with _build_lock:
+        # 排隊等鎖的期間可能別人已經建好了
+        version = _version
+        snap = _snapshot
+        if snap is not None and snap.version == version:
+            stats["hits"] += 1
+            return snap
+
+        from .broadcast import delta_builder, render_board_lists
+        # 版本號、seq 都在渲染「之前」取：渲染途中有新寫入的話，這份快照會標成舊版，下次自然重建；
+        # 前端則從這個 seq 之後開始套用 board.delta（重複套用同一張卡片是冪等的）
+        seq = delta_builder.current_seq()
+        drivers_html, passengers_html, drivers_next = render_board_lists()
+        payload = {
+            "type": "send.update",
+            "passengers_html": passengers_html,
+            "drivers_html": drivers_html,
+            "drivers_next": drivers_next,
+            "seq": seq,
+        }
+        snap = BoardSnapshot(version, drivers_html, passengers_html, drivers_next, payload, dumps(payload))
+        _snapshot = snap
+        stats["builds"] += 1
+        return snap
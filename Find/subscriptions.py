@@ -0,0 +1,230 @@
+"""
+首頁 WebSocket 的「伺服器端篩選訂閱」
+
+index 支援的篩選／排序（_extract_filters_from_request + driver_cards_qs）以前只在 HTTP 生效，
+/ws/find/ 一律推未篩選的清單，前端還得自己對齊。
+
+前端連上後送：
+    {"action": "subscribe", "filters": {...跟 driver_cards_qs 一樣的 dict...}, "sort": "date_desc"}
+伺服器：
+  1) 用 driver_cards_qs 算出目前這個 view 的卡片（只查一次）
+  2) 之後每次 board.delta，用這裡的純 Python 判斷（card_matches / sort_key）
+     決定卡片是進入（driver_entered）、離開（driver_left）還是在 view 內變動，
+     並附上排序位置（before = 應該插在哪張卡片前面；None = 放最後）。
+
+篩選判斷必須與 driver_cards_qs 一致；改了那邊記得一起改這裡。
+
+司機清單是分頁載入的（pagination.py）：subscribe / page 會帶 until（前端已載入的最後一頁的
+next cursor；None = 全部都載入了），排在 until 之後的卡片前端還沒載入，變動一律不送；
+卡片被排到 until 之後也當成離開（driver_left），之後捲到那一頁自然會載入。
+"""
+import bisect
+from datetime import date as _date
+
+from .locations import UNKNOWN_RANK
+from .pagination import fields_key, key_after
+from .search import DATE_RE, document_text, search_terms
+
+SORTS = ("date_desc", "date_asc", "dep_n2s", "dep_s2n", "seats_asc", "seats_desc", "fare_asc", "fare_desc")
+
+
+def _str_list(val) -> tuple:
+    if val in (None, ""):
+        return ()
+    if isinstance(val, (str, int)):
+        val = [val]
+    return tuple(sorted({str(v).strip() for v in val if str(v).strip()}))
+
+
+def _int_or_none(val):
+    try:
+        return int(str(val).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_filters(raw: dict | None) -> dict:
+    """把前端送來的 dict 整理成 driver_cards_qs 吃的格式（同 _extract_filters_from_request）"""
+    raw = raw or {}
+    fare_mode = (raw.get("fare_mode") or "").strip()
+    return {
+        "q": (raw.get("q") or "").strip() or None,
+        "dep_in": list(_str_list(raw.get("dep_in"))) or None,
+        "des_in": list(_str_list(raw.get("des_in"))) or None,
+        "date_in": list(_str_list(raw.get("date_in"))) or None,
+        "ret_in": list(_str_list(raw.get("ret_in"))) or None,
+        "gender_in": list(_str_list(raw.get("gender_in"))) or None,
+        "need_seats": _int_or_none(raw.get("need_seats")),
+        "fare_mode": fare_mode if fare_mode in ("lte", "gte") else None,
+        "fare_num": _int_or_none(raw.get("fare_num")),
+        "fare_q": (raw.get("fare_q") or "").strip() or None,
+    }
+
+
+def normalize_sort(sort) -> str:
+    return sort if sort in SORTS else "date_desc"
+
+
+# ---- 卡片的比對欄位（只在伺服器端使用：含未隱藏前的聯絡方式，不能送給前端） ----
+def driver_match_fields(d) -> dict:
+    pax = list(getattr(d, "pending_list", [])) + list(getattr(d, "accepted_list", []))
+    return {
+        "departure": d.departure or "",
+        "destination": d.destination or "",
+        "departure_loc": d.departure_loc_id,
+        "destination_loc": d.destination_loc_id,
+        "departure_rank": d.departure_loc.rank if d.departure_loc_id else UNKNOWN_RANK,
+        "date": d.date.isoformat() if d.date else None,
+        "return_date": d.return_date.isoformat() if d.return_date else None,
+        "gender": d.gender,
+        "seats_total": d.seats_total,
+        "seats_filled": d.seats_filled,
+        "fare_note": d.fare_note,
+        "fare_amount": d.fare_amount,
+        "fare_is_free": d.fare_is_free,
+        # 關鍵字比對用：跟搜尋索引同一份全文（每個欄位一行，詞內不含空白，不會跨欄位誤配）
+        "text": document_text(d, pax),
+    }
+
+
+def card_matches(fields: dict, filters: dict) -> bool:
+    f = filters
+    # 地點比的是 Location id（dep_loc_ids / des_loc_ids 由 locations.resolve_location_filters 補上）
+    if f.get("dep_in") and fields["departure_loc"] not in (f.get("dep_loc_ids") or ()):
+        return False
+    if f.get("des_in") and fields["destination_loc"] not in (f.get("des_loc_ids") or ()):
+        return False
+    if f.get("date_in") and fields["date"] not in f["date_in"]:
+        return False
+    if f.get("ret_in") and fields["return_date"] not in f["ret_in"]:
+        return False
+    if f.get("gender_in") and fields["gender"] not in f["gender_in"]:
+        return False
+    if f.get("need_seats") is not None and fields["seats_total"] - fields["seats_filled"] < f["need_seats"]:
+        return False
+    if f.get("fare_num") is not None and f.get("fare_mode") in ("lte", "gte"):
+        amount = fields["fare_amount"]
+        if f["fare_mode"] == "lte":
+            # <= 門檻時免費/待定也算
+            if not fields["fare_is_free"] and (amount is None or amount > f["fare_num"]):
+                return False
+        elif amount is None or amount < f["fare_num"]:
+            return False
+    if f.get("fare_q") and f["fare_q"].lower() not in (fields["fare_note"] or "").lower():
+        return False
+    if f.get("q") and not _q_matches(fields, f["q"]):
+        return False
+    return True
+
+
+def _q_matches(fields: dict, qkw: str) -> bool:
+    """同 search.search_q：每個詞都在全文裡；整串是 YYYY-MM-DD 時，出發 / 回程日期相同也算"""
+    if all(term in fields["text"] for term in search_terms(qkw)):
+        return True
+    qkw = qkw.strip()
+    return bool(DATE_RE.fullmatch(qkw)) and qkw in (fields["date"], fields["return_date"])
+
+
+def _date_ord(iso) -> int:
+    return _date.fromisoformat(iso).toordinal() if iso else 0
+
+
+def sort_key(fields: dict, driver_id: int, sort: str) -> tuple:
+    """與 driver_cards_qs 的 order_by 相同順序的 Python key（由小到大 = 畫面由上到下）"""
+    if sort == "date_asc":
+        return (_date_ord(fields["date"]), driver_id)
+    if sort in ("dep_n2s", "dep_s2n"):
+        rank = fields["departure_rank"]
+        return (rank if sort == "dep_n2s" else -rank, _date_ord(fields["date"]), driver_id)
+    if sort in ("seats_asc", "seats_desc"):
+        left = fields["seats_total"] - fields["seats_filled"]
+        return (left if sort == "seats_asc" else -left, driver_id)
+    if sort in ("fare_asc", "fare_desc"):
+        amount, free = fields["fare_amount"], fields["fare_is_free"]
+        if sort == "fare_asc":
+            return (0 if free else 1, (0, amount) if amount is not None else (1, 0), driver_id)
+        return (1 if free else 0, (0, -amount) if amount is not None else (1, 0), driver_id)
+    # date_desc（預設）
+    return (-_date_ord(fields["date"]), -driver_id)
+
+
+class BoardSubscription:
+    """單一連線的訂閱狀態：篩選條件 + 已載入的範圍（until）+ 目前 view 內卡片的排序 key"""
+
+    def __init__(self, filters: dict, sort: str, until: list | None = None):
+        self.filters = filters
+        self.sort = sort
+        self.until = until                    # pagination key；None = 沒有分頁邊界
+        self._keys: dict[int, tuple] = {}     # driver_id -> sort key
+        self._order: list[tuple] = []         # [(key, driver_id)]，已排序
+
+    @property
+    def ids(self) -> list[int]:
+        return [did for _, did in self._order]
+
+    def reset(self, cards):
+        """cards: [(driver_id, match_fields)]（通常來自 driver_cards_qs 的結果）"""
+        self._keys = {did: sort_key(fields, did, self.sort) for did, fields in cards}
+        self._order = sorted((k, did) for did, k in self._keys.items())
+
+    def extend(self, cards, until: list | None):
+        """前端載入了下一頁：把 (舊 until, 新 until] 這段的卡片加進 view"""
+        for did, fields in cards:
+            if did not in self._keys:
+                key = sort_key(fields, did, self.sort)
+                self._keys[did] = key
+                bisect.insort(self._order, (key, did))
+        self.until = until
+
+    def loaded(self, fields: dict, driver_id: int) -> bool:
+        """卡片是不是落在前端已載入的範圍內"""
+        return self.until is None or not key_after(fields_key(fields, driver_id, self.sort), self.until, self.sort)
+
+    def _remove(self, did):
+        key = self._keys.pop(did)
+        i = bisect.bisect_left(self._order, (key, did))
+        del self._order[i]
+
+    def _insert(self, did, key) -> int | None:
+        """放進 view，回傳排在它後面那張卡片的 id（None = 最後一張）"""
+        self._keys[did] = key
+        i = bisect.bisect_left(self._order, (key, did))
+        self._order.insert(i, (key, did))
+        return self._order[i + 1][1] if i + 1 < len(self._order) else None
+
+    def apply(self, events: list[dict], cards: dict) -> list[dict]:
+        """
+        把全域的 board.delta 事件轉成這個 view 的事件。
+        cards: {"<driver_id>": {"fields": match_fields, "html": 卡片 HTML}}（只有仍上架的司機；
+               key 用字串，channels_redis 的 msgpack 不收整數 key）
+        """
+        out = []
+        for ev in events:
+            did = ev.get("driver_id")
+            if did is None:
+                out.append(ev)       # 乘客清單不受篩選影響
+                continue
+
+            card = cards.get(str(did))
+            was_in = did in self._keys
+            now_in = (card is not None and card_matches(card["fields"], self.filters)
+                      and self.loaded(card["fields"], did))
+
+            if not now_in:
+                if was_in:
+                    self._remove(did)
+                    out.append({"type": "driver_left", "driver_id": did})
+                continue
+
+            key = sort_key(card["fields"], did, self.sort)
+            if not was_in:
+                before = self._insert(did, key)
+                out.append({"type": "driver_entered", "driver_id": did, "html": card["html"], "before": before})
+            elif key != self._keys[did]:
+                # 排序欄位變了 → 換位置（整張卡片一起送）
+                self._remove(did)
+                before = self._insert(did, key)
+                out.append({"type": "driver_moved", "driver_id": did, "html": card["html"], "before": before})
+            else:
+                out.append({k: v for k, v in ev.items() if k != "seq"})
+        return out
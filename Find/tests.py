@@ -1,3 +1,1025 @@
-from django.test import TestCase
+"""
+查詢計畫回歸測試：熱門查詢不可以退回全表掃描
 
-# Create your tests here.
+    python manage.py test Find
+
+做法：實際執行一次 queryset（含 Prefetch 的子查詢），把 find_db 上跑過的每一條 SELECT
+再丟給 EXPLAIN，找出「沒用索引、整張表掃過去」的 Find 資料表。
+  - sqlite：EXPLAIN QUERY PLAN 的 "SCAN <table>"（"SCAN ... USING INDEX" 不算）
+  - MySQL：EXPLAIN FORMAT=JSON 的 access_type = "ALL"
+  - PostgreSQL：Seq Scan on <table>
+"""
+import json
+import re
+import threading
+import zlib
+from unittest import mock, skipUnless
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.db.models import F
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from .backpressure import FlowControl, Outbox, stats as backpressure_stats
+from .broadcast import scheduler
+from .consumers import FindConsumer
+from .dispatch import DispatchQueue, dispatcher
+from .encoding import DEFLATE_WBITS, JSON, DeflateCodec, MsgpackCodec, dumps, msgpack, negotiate
+from .facets import SEATS_FACET_MAX, compute_facets, drilldown_counts, fare_bucket, rebuild_facets
+from .ledger import get_ledger, reset_ledgers
+from .locations import _known, resolve_location_filters
+from .matching import apply_plan, load_board, pending_seats, plan_matches, propose_driver
+from .management.commands._bench import seed_board
+from .metrics import metrics_view
+from .models import DriverTrip, FacetCount, Location, PassengerRequest, WaitlistEntry, parse_fare_note
+from .snapshot import bump_data_version
+from .pagecache import page_cache
+from .seats import (ACCEPTED, ALREADY, FULL, GONE, REJECTED, accept_passenger, deactivate_if_full,
+                    decide_passengers, release_seats, reserve_seats, seat_transaction, seats_left)
+from .pagination import decode_cursor, fields_key, row_key
+from .routes import ROUTES, drivers_on_route, passengers_on_route, route_match
+from .search import search_q
+from .subscriptions import SORTS, BoardSubscription, card_matches, driver_match_fields, sort_key
+from .waitlist import entry_status, promote
+from .views import driver_card_page, driver_cards_page, driver_cards_qs, get_active_location_choices
+
+DB_ALIAS = "find_db"
+FIND_TABLES = {DriverTrip._meta.db_table, PassengerRequest._meta.db_table}
+
+_background = {}
+
+
+def setUpModule():
+    # dispatcher / scheduler 是 import 時依 settings 建好的，override_settings 改不到：這裡直接改成
+    # 在測試執行緒裡同步跑完，不開背景 worker / 計時器（不會在測試交易外讀 sqlite、撞到 table is locked）
+    _background.update(mode=dispatcher.mode, window=scheduler.window)
+    dispatcher.mode, scheduler.window = "inline", 0
+
+
+def tearDownModule():
+    dispatcher.mode, scheduler.window = _background["mode"], _background["window"]
+
+# driver_cards_qs 的每一種篩選（各自搭配 SORTS 的每一種排序）
+FILTER_CASES = {
+    "none": {},
+    "dep_in": {"dep_in": ["台北市", "花蓮縣"]},
+    "des_in": {"des_in": ["台中市"]},
+    "dep_des": {"dep_in": ["台北市"], "des_in": ["花蓮縣"]},
+    "date_in": {"date_in": [(date.today() + timedelta(days=3)).isoformat()]},
+    "ret_in": {"ret_in": [(date.today() + timedelta(days=5)).isoformat()]},
+    "gender_in": {"gender_in": ["F"]},
+    "need_seats": {"need_seats": 2},
+    "fare_lte": {"fare_num": 300, "fare_mode": "lte"},
+    "fare_gte": {"fare_num": 300, "fare_mode": "gte"},
+    "fare_q": {"fare_q": "免費"},
+    "q": {"q": "行李"},
+}
+# 有索引可走的篩選：任何排序都不可以全表掃描
+INDEXED_FILTERS = {"dep_in", "des_in", "dep_des", "date_in", "fare_gte", "q"}
+# 排序值是算出來的（剩餘座位、地理順序）或跨兩欄加 NULLS LAST（票價）：
+# 沒有可走索引的篩選時，本來就得讀完所有上架司機
+COMPUTED_SORTS = {"dep_n2s", "dep_s2n", "seats_asc", "seats_desc", "fare_asc", "fare_desc"}
+
+
+def allowed_scans(filter_name, sort) -> set:
+    if filter_name not in INDEXED_FILTERS and sort in COMPUTED_SORTS:
+        return {DriverTrip._meta.db_table}
+    return set()
+
+
+def _full_scans_sqlite(cursor, sql):
+    cursor.execute("EXPLAIN QUERY PLAN " + sql)
+    out = set()
+    for row in cursor.fetchall():
+        m = re.fullmatch(r"SCAN (?:TABLE )?(\S+)(?: AS \S+)?", row[-1])
+        if m:
+            out.add(m.group(1).strip('"'))
+    return out
+
+
+def _full_scans_mysql(cursor, sql):
+    cursor.execute("EXPLAIN FORMAT=JSON " + sql)
+    out = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            if node.get("access_type") == "ALL" and node.get("table_name"):
+                out.add(node["table_name"])
+            for v in node.values():
+                walk(v)
+        elif isinstance(node, list):
+            for v in node:
+                walk(v)
+    walk(json.loads(cursor.fetchone()[0]))
+    return out
+
+
+def _full_scans_postgresql(cursor, sql):
+    cursor.execute("EXPLAIN " + sql)
+    return {m.group(1).strip('"') for (line,) in cursor.fetchall()
+            for m in [re.search(r"Seq Scan on (\S+)", line)] if m}
+
+
+class QueryPlanMixin:
+    databases = {"default", DB_ALIAS}
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_board(60, pax_per_driver=3, unassigned=20)
+        # 一部分下架，讓 is_active 不是全表同一個值
+        ids = list(DriverTrip.objects.using(DB_ALIAS).order_by("id").values_list("id", flat=True))
+        DriverTrip.objects.using(DB_ALIAS).filter(id__in=ids[::4]).update(is_active=False)
+        DriverTrip.objects.using(DB_ALIAS).filter(id__in=ids[1::3]).update(
+            return_date=date.today() + timedelta(days=5))
+
+    def full_scans(self, run, allowed=frozenset()) -> dict:
+        """執行 run()，回傳 {sql: {被全表掃描的 Find 資料表（扣掉 allowed）}}"""
+        conn = connections[DB_ALIAS]
+        explain = {
+            "sqlite": _full_scans_sqlite,
+            "mysql": _full_scans_mysql,
+            "postgresql": _full_scans_postgresql,
+        }.get(conn.vendor)
+        if explain is None:
+            self.skipTest(f"{conn.vendor} 沒有對應的 EXPLAIN 解析")
+        with CaptureQueriesContext(conn) as ctx:
+            run()
+        found = {}
+        with conn.cursor() as cursor:
+            for q in ctx.captured_queries:
+                sql = q["sql"]
+                if not sql.lstrip().upper().startswith("SELECT"):
+                    continue
+                tables = (explain(cursor, sql) & FIND_TABLES) - set(allowed)
+                if tables:
+                    found[sql] = tables
+        return found
+
+    def assertNoFullScan(self, run, msg="", allowed=frozenset()):
+        found = self.full_scans(run, allowed)
+        if found:
+            detail = "\n".join(f"  {sorted(t)} <- {sql[:300]}" for sql, t in found.items())
+            self.fail(f"{msg} 出現全表掃描：\n{detail}")
+
+
+class FindTestCase(TestCase):
+    """find_db 上的一般測試：不灌 seed_board，每個測試只建自己要用的行程 / 乘客"""
+    databases = {"default", DB_ALIAS}
+
+
+class TripTestCase(FindTestCase):
+    """一趟 台北市→宜蘭縣 的行程（self.driver，座位數看 seats_total）＋建乘客的 pax()"""
+    seats_total = 3
+
+    def setUp(self):
+        self.driver = DriverTrip.objects.using(DB_ALIAS).create(
+            driver_name="司機", contact="", seats_total=self.seats_total, departure="台北市",
+            destination="宜蘭縣", date=date.today() + timedelta(days=1))
+
+    def pax(self, seats, driver=True, **kwargs):
+        """同路線、同一天的乘客；driver=False 是還沒指派司機的"""
+        return PassengerRequest.objects.using(DB_ALIAS).create(**{
+            "passenger_name": "乘客", "contact": "", "seats_needed": seats, "departure": "台北市",
+            "destination": "宜蘭縣", "date": self.driver.date, "driver": self.driver if driver else None,
+            **kwargs})
+
+
+class DriverCardsQueryPlanTests(QueryPlanMixin, TestCase):
+    def test_filters_and_sorts_use_indexes(self):
+        for name, filters in FILTER_CASES.items():
+            for sort in SORTS:
+                with self.subTest(filters=name, sort=sort):
+                    self.assertNoFullScan(
+                        lambda: list(driver_cards_qs(only_active=True, sort=sort, filters=filters)),
+                        f"driver_cards_qs(filters={name}, sort={sort})",
+                        allowed=allowed_scans(name, sort),
+                    )
+
+
+class DriverPageTests(QueryPlanMixin, TestCase):
+    """keyset 分頁：一頁一頁接起來要跟不分頁的順序一模一樣，而且翻頁也要走索引"""
+
+    def walk_pages(self, sort, filters, limit=7):
+        ids, after = [], None
+        while True:
+            drivers, cursor = driver_cards_page(sort=sort, filters=filters, after=after, limit=limit)
+            ids += [d.id for d in drivers]
+            if cursor is None:
+                return ids
+            after = decode_cursor(cursor, sort)
+
+    def test_pages_match_full_order(self):
+        for name, filters in FILTER_CASES.items():
+            for sort in SORTS:
+                with self.subTest(filters=name, sort=sort):
+                    drivers = list(driver_cards_qs(only_active=True, sort=sort, filters=filters))
+                    self.assertEqual(self.walk_pages(sort, filters), [d.id for d in drivers])
+
+    def test_python_keys_match_sql(self):
+        # WebSocket 訂閱用 fields_key / sort_key 判斷範圍與位置，必須跟 SQL 的排序一致
+        for sort in SORTS:
+            with self.subTest(sort=sort):
+                drivers, _ = driver_cards_page(sort=sort, limit=1000)
+                fields = [(d.id, driver_match_fields(d)) for d in drivers]
+                self.assertEqual([row_key(d, sort) for d in drivers],
+                                 [fields_key(f, did, sort) for did, f in fields])
+                self.assertEqual([d.id for d in drivers],
+                                 [did for did, f in sorted(fields, key=lambda x: sort_key(x[1], x[0], sort))])
+
+    def test_subscription_range_matches_page(self):
+        for sort in SORTS:
+            with self.subTest(sort=sort):
+                first, cursor = driver_cards_page(sort=sort, limit=10)
+                until = decode_cursor(cursor, sort)
+                sub = BoardSubscription(resolve_location_filters({}), sort, until)
+                everyone = driver_cards_qs(only_active=True, sort=sort)
+                loaded = [d.id for d in everyone
+                          if card_matches(driver_match_fields(d), sub.filters)
+                          and sub.loaded(driver_match_fields(d), d.id)]
+                self.assertEqual(loaded, [d.id for d in first])
+
+    def test_next_page_uses_indexes(self):
+        for name, filters in FILTER_CASES.items():
+            for sort in SORTS:
+                first, cursor = driver_cards_page(sort=sort, filters=filters, limit=3)
+                if cursor is None:
+                    continue
+                after = decode_cursor(cursor, sort)
+                with self.subTest(filters=name, sort=sort):
+                    self.assertNoFullScan(
+                        lambda: driver_cards_page(sort=sort, filters=filters, after=after, limit=3),
+                        f"driver_cards_page(filters={name}, sort={sort}, after=...)",
+                        allowed=allowed_scans(name, sort),
+                    )
+
+
+class HotPathQueryPlanTests(QueryPlanMixin, TestCase):
+    def test_location_choices(self):
+        self.assertNoFullScan(get_active_location_choices, "get_active_location_choices")
+
+    def test_unassigned_passengers(self):
+        self.assertNoFullScan(
+            lambda: list(PassengerRequest.objects.using(DB_ALIAS)
+                         .filter(is_matched=False, driver__isnull=True).order_by("-id")),
+            "首頁未指派乘客",
+        )
+
+    def test_manage_candidates(self):
+        for d in DriverTrip.objects.using(DB_ALIAS).order_by("id")[:3]:
+            with self.subTest(driver=d.id):
+                self.assertNoFullScan(lambda: passengers_on_route(d, using=DB_ALIAS),
+                                      "driver_manage 順路乘客")
+
+    def test_manage_pending_and_accepted(self):
+        d = DriverTrip.objects.using(DB_ALIAS).order_by("id").first()
+        for matched in (False, True):
+            with self.subTest(is_matched=matched):
+                self.assertNoFullScan(
+                    lambda: list(PassengerRequest.objects.using(DB_ALIAS)
+                                 .filter(driver=d, is_matched=matched).order_by("id")),
+                    "driver_manage 乘客清單",
+                )
+
+    def test_find_people_matches(self):
+        p = PassengerRequest.objects.using(DB_ALIAS).filter(driver__isnull=True).order_by("id").first()
+        self.assertNoFullScan(lambda: drivers_on_route(p, using=DB_ALIAS), "find_people 順路司機")
+
+
+class FacetStoreTests(QueryPlanMixin, TestCase):
+    """篩選選項的計數：經過一連串存檔 / 刪除後要跟直接 GROUP BY 算出來的一樣，讀取時不碰司機表"""
+
+    def stored(self):
+        return {(d, v): n for d, v, n in FacetCount.objects.using(DB_ALIAS)
+                .filter(count__gt=0).values_list("dimension", "value", "count")}
+
+    def test_signals_keep_counts_in_sync(self):
+        rebuild_facets(DB_ALIAS)   # setUpTestData 用 update() 改過，不會觸發 signals
+        self.assertEqual(self.stored(), compute_facets(DB_ALIAS))
+
+        drivers = list(DriverTrip.objects.using(DB_ALIAS).order_by("id")[:6])
+        d = drivers[0]
+        d.departure, d.date = "台東縣太麻里", d.date + timedelta(days=30)
+        d.save()
+        drivers[1].is_active = not drivers[1].is_active
+        drivers[1].save(update_fields=["is_active"])
+        drivers[2].return_date = None
+        drivers[2].save()
+        drivers[3].note = "只改備註"
+        drivers[3].save(update_fields=["note"])
+        drivers[4].delete()
+        DriverTrip.objects.using(DB_ALIAS).create(
+            driver_name="新司機", contact="x", seats_total=3, departure="嘉義市", destination="台北市",
+            date=(date.today() + timedelta(days=2)).isoformat(), return_date=date.today() + timedelta(days=4),
+        )
+        self.assertEqual(self.stored(), compute_facets(DB_ALIAS))
+
+    def test_choices_do_not_touch_trips(self):
+        conn = connections[DB_ALIAS]
+        with CaptureQueriesContext(conn) as ctx:
+            get_active_location_choices()
+        self.assertFalse([q["sql"] for q in ctx.captured_queries if DriverTrip._meta.db_table in q["sql"]])
+
+
+class DrilldownFacetTests(QueryPlanMixin, TestCase):
+    """drill-down 計數：每個維度都要等於「拿掉這個維度的篩選」後 driver_cards_qs 的分組結果"""
+
+    OWN_KEYS = {
+        "dep": ("dep_in",), "des": ("des_in",), "date": ("date_in",), "ret": ("ret_in",),
+        "gender": ("gender_in",), "seats": ("need_seats",), "fare": ("fare_num", "fare_mode", "fare_q"),
+    }
+
+    def setUp(self):
+        bump_data_version()   # setUpTestData 用 update() 改過資料，快取要重讀
+
+    def expected(self, filters, dim):
+        rest = {k: v for k, v in filters.items() if k not in self.OWN_KEYS[dim]}
+        drivers = list(driver_cards_qs(only_active=True, filters=rest))
+        if dim in ("dep", "des"):
+            loc = "departure_loc" if dim == "dep" else "destination_loc"
+            out = {}
+            for d in drivers:
+                if getattr(d, f"{loc}_id"):
+                    name = getattr(d, loc).name
+                    out[name] = out.get(name, 0) + 1
+            return out
+        if dim in ("date", "ret"):
+            out = {}
+            for d in drivers:
+                v = d.date if dim == "date" else d.return_date
+                if v:
+                    out[v.isoformat()] = out.get(v.isoformat(), 0) + 1
+            return out
+        if dim == "seats":
+            return {str(n): c for n in range(1, SEATS_FACET_MAX + 1)
+                    if (c := sum(d.seats_total - d.seats_filled >= n for d in drivers))}
+        key = (lambda d: d.gender) if dim == "gender" else (lambda d: fare_bucket(d.fare_amount, d.fare_is_free))
+        out = {}
+        for d in drivers:
+            out[key(d)] = out.get(key(d), 0) + 1
+        return out
+
+    def test_counts_match_queryset(self):
+        cases = dict(FILTER_CASES, combined={
+            "dep_in": ["台北市", "花蓮縣"], "gender_in": ["F", "M"], "need_seats": 1,
+            "fare_num": 500, "fare_mode": "lte",
+        })
+        for name, filters in cases.items():
+            got = drilldown_counts(filters, DB_ALIAS)
+            with self.subTest(filters=name, dim="total"):
+                self.assertEqual(got["total"], driver_cards_qs(only_active=True, filters=filters).count())
+            for dim in self.OWN_KEYS:
+                with self.subTest(filters=name, dim=dim):
+                    self.assertEqual(dict(got[dim]), self.expected(filters, dim))
+
+
+class PageCacheTests(QueryPlanMixin, TestCase):
+    """卡片頁快取：同一資料版本不再查 DB；版本一變就重查"""
+
+    def setUp(self):
+        bump_data_version()
+        page_cache.clear()
+
+    def test_hit_until_version_changes(self):
+        conn = connections[DB_ALIAS]
+        first = driver_card_page(sort="date_desc", filters={"gender_in": ["F"]})
+        with CaptureQueriesContext(conn) as ctx:
+            again = driver_card_page(sort="date_desc", filters={"gender_in": ["F"], "q": ""})
+        self.assertIs(again, first)
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(list(first.ids), [d.id for d in driver_cards_page(
+            sort="date_desc", filters={"gender_in": ["F"]})[0]])
+
+        DriverTrip.objects.using(DB_ALIAS).filter(id=first.ids[0]).update(is_active=False)
+        bump_data_version()     # 正常寫入時由 signals 在交易提交後呼叫
+        fresh = driver_card_page(sort="date_desc", filters={"gender_in": ["F"]})
+        self.assertNotIn(first.ids[0], fresh.ids)
+
+    def test_lru_eviction(self):
+        old_size = page_cache.maxsize
+        page_cache.maxsize = 2
+        try:
+            for sort in ("date_desc", "date_asc", "fare_asc"):
+                driver_card_page(sort=sort)
+            self.assertEqual(page_cache.stats["size"], 2)
+            self.assertGreaterEqual(page_cache.stats["evictions"], 1)
+        finally:
+            page_cache.maxsize = old_size
+            page_cache.clear()
+
+
+class CardProjectionTests(QueryPlanMixin, TestCase):
+    """只讀卡片欄位（cards.py）：渲染結果要跟整列讀出來一樣，而且不可以每張卡片再補查"""
+
+    def render(self, drivers):
+        from django.template.loader import render_to_string
+        return "".join(render_to_string("Find/_driver_card.html", {"d": d}) for d in drivers)
+
+    def test_same_html_without_extra_queries(self):
+        conn = connections[DB_ALIAS]
+        for sort in SORTS:
+            with self.subTest(sort=sort):
+                full, full_next = driver_cards_page(sort=sort, limit=20)
+                with CaptureQueriesContext(conn) as ctx:
+                    narrow, narrow_next = driver_cards_page(sort=sort, limit=20, only_card_fields=True)
+                    html = self.render(narrow)
+                self.assertEqual(html, self.render(full))
+                self.assertEqual(narrow_next, full_next)
+                # 司機一次 + 待確認 / 已接受乘客各一次
+                self.assertEqual(len(ctx.captured_queries), 3, [q["sql"] for q in ctx.captured_queries])
+
+
+
+class RouteMatchTests(FindTestCase):
+    """順路媒合（routes.py）：路線上同方向的乘客要配得到，反方向 / 超出日期區間的不行"""
+
+    def setUp(self):
+        self.day = date.today() + timedelta(days=1)
+        self.driver = DriverTrip.objects.using(DB_ALIAS).create(
+            driver_name="順路司機", contact="", seats_total=3, departure="台北市",
+            destination="花蓮縣光復鄉", date=self.day, flexible_pickup="YES")
+
+    def pax(self, name, dep, des, days=0, seats=1):
+        return PassengerRequest.objects.using(DB_ALIAS).create(
+            passenger_name=name, contact="", seats_needed=seats, departure=dep, destination=des,
+            date=self.day + timedelta(days=days))
+
+    def names(self, found):
+        return [p.passenger_name for p in found]
+
+    def test_route_index(self):
+        self.assertEqual(list(ROUTES[("台北市", "花蓮縣光復鄉")]),
+                         ["台北市", "新北市", "宜蘭縣", "花蓮縣", "花蓮縣光復鄉"])
+        self.assertEqual(list(ROUTES[("高雄市", "台東縣")]), ["高雄市", "屏東縣", "台東縣"])
+
+    def test_passengers_on_route(self):
+        self.pax("順路", "新北市", "宜蘭縣")
+        self.pax("同路線", "台北市", "光復鄉糖廠", days=1)     # 糖廠 = 光復鄉這一站
+        self.pax("隔天順路", "宜蘭縣", "花蓮縣", days=-1)
+        self.pax("反方向", "宜蘭縣", "新北市")
+        self.pax("繞路", "基隆市", "宜蘭縣")
+        self.pax("太晚", "新北市", "花蓮縣", days=5)
+        self.pax("不順路", "台北市", "台中市")
+        self.pax("坐不下", "新北市", "宜蘭縣", seats=4)
+
+        found = passengers_on_route(self.driver, using=DB_ALIAS)
+        self.assertEqual(self.names(found), ["同路線", "順路", "隔天順路"])
+        self.assertEqual([p.route_match.kind for p in found], ["exact", "along", "along"])
+
+        self.driver.flexible_pickup = "NO"     # 不順路也OK：離路線一站以內也算
+        found = passengers_on_route(self.driver, using=DB_ALIAS)
+        self.assertEqual(self.names(found), ["同路線", "順路", "隔天順路", "繞路"])
+        self.assertEqual(found[-1].route_match.detour, 1)
+
+    def test_drivers_on_route(self):
+        p = self.pax("順路", "新北市", "宜蘭縣")
+        self.assertIn(self.driver.id, [d.id for d in drivers_on_route(p, using=DB_ALIAS)])
+        back = self.pax("反方向", "宜蘭縣", "新北市")
+        self.assertNotIn(self.driver.id, [d.id for d in drivers_on_route(back, using=DB_ALIAS)])
+
+    def test_off_map_locations_need_exact_match(self):
+        d, p = self.driver, self.pax("離島", "金門縣", "金門縣")
+        self.assertIsNone(route_match(d.departure_loc_id, d.destination_loc_id,
+                                      p.departure_loc_id, p.destination_loc_id, using=DB_ALIAS))
+        self.assertEqual(route_match(p.departure_loc_id, p.destination_loc_id,
+                                     p.departure_loc_id, p.destination_loc_id, using=DB_ALIAS).kind, "exact")
+
+
+class MatchingTests(FindTestCase):
+    """批次自動媒合（matching.py）：不超過空位、只配順路的司機、寫入後出現在待確認"""
+
+    def board(self):
+        day = date.today() + timedelta(days=1)
+        for name, dep, des, seats in (("東部司機", "台北市", "花蓮縣", 3), ("南部司機", "高雄市", "台東縣", 2)):
+            DriverTrip.objects.using(DB_ALIAS).create(
+                driver_name=name, contact="", seats_total=seats, departure=dep, destination=des,
+                date=day, flexible_pickup="YES")
+        # 東部兩位加起來 4 人坐不下 3 位；台中→台南沒有順路的司機
+        for name, dep, des, seats, days in (("順路", "新北市", "宜蘭縣", 2, 0), ("隔天順路", "宜蘭縣", "花蓮縣", 2, 1),
+                                            ("南部", "屏東縣", "台東縣", 1, 0), ("不順路", "台中市", "台南市", 1, 0)):
+            PassengerRequest.objects.using(DB_ALIAS).create(
+                passenger_name=name, contact="", seats_needed=seats, departure=dep, destination=des,
+                date=day + timedelta(days=days))
+
+    def test_plan_respects_seats_and_routes(self):
+        self.board()
+        passengers, drivers = load_board(DB_ALIAS)
+        plan = plan_matches(DB_ALIAS)
+        self.assertGreater(plan.seats_matched, 0)
+        self.assertLessEqual(plan.seats_matched, plan.seats_bound)
+        pax = {row[0]: row for row in passengers}
+        free = {row[0]: row for row in drivers}
+        seen = set()
+        for prop in plan.proposals:
+            did, cap, d_dep, d_des, d_day, flexible = free[prop.driver_id]
+            self.assertLessEqual(sum(pax[i][1] for i in prop.passenger_ids), cap)
+            for pid in prop.passenger_ids:
+                _, _, p_dep, p_des, p_day = pax[pid]
+                self.assertIsNotNone(route_match(d_dep, d_des, p_dep, p_des, flexible=flexible, using=DB_ALIAS))
+                self.assertLessEqual(abs((p_day - d_day).days), 1)
+            seen.update(prop.passenger_ids)
+        self.assertTrue(plan.unmatched)
+        self.assertFalse(seen & set(plan.unmatched))
+
+    def test_apply_plan_adds_pending(self):
+        self.board()
+        plan = plan_matches(DB_ALIAS)
+        applied = apply_plan(plan, DB_ALIAS)
+        self.assertEqual(applied, {p.driver_id: list(p.passenger_ids) for p in plan.proposals})
+        for did, ids in applied.items():
+            self.assertEqual(set(PassengerRequest.objects.using(DB_ALIAS)
+                                 .filter(id__in=ids).values_list("driver_id", "is_matched")), {(did, False)})
+        # 再算一次：待確認已經佔了座位，剛剛配好的乘客也不再是未指派
+        self.assertEqual(apply_plan(plan_matches(DB_ALIAS), DB_ALIAS), {})
+        for d in DriverTrip.objects.using(DB_ALIAS).filter(id__in=applied):
+            self.assertLessEqual(d.seats_filled + pending_seats(DB_ALIAS, [d.id]).get(d.id, 0), d.seats_total)
+
+    def test_propose_driver(self):
+        day = date.today() + timedelta(days=1)
+        d = DriverTrip.objects.using(DB_ALIAS).create(
+            driver_name="順路司機", contact="", seats_total=2, departure="台北市",
+            destination="花蓮縣", date=day)
+        first, second = (PassengerRequest.objects.using(DB_ALIAS).create(
+            passenger_name=f"乘客{i}", contact="", seats_needed=2, departure="新北市",
+            destination="宜蘭縣", date=day) for i in range(2))
+        self.assertEqual(propose_driver(first.id, DB_ALIAS), d)
+        self.assertIsNone(propose_driver(first.id, DB_ALIAS))    # 已經有司機
+        self.assertIsNone(propose_driver(second.id, DB_ALIAS))   # 待確認已經佔滿座位
+        first.refresh_from_db()
+        self.assertEqual((first.driver_id, first.is_matched), (d.id, False))
+
+
+class SeatAllocationTests(TripTestCase):
+    """座位扣減（seats.py）：條件式 UPDATE 不可以超賣，失敗時乘客狀態要一起回復"""
+
+    def filled(self):
+        self.driver.refresh_from_db()
+        return self.driver.seats_filled
+
+    def test_reserve_and_release(self):
+        self.assertTrue(reserve_seats(self.driver.id, 2, DB_ALIAS))
+        self.assertFalse(reserve_seats(self.driver.id, 2, DB_ALIAS))
+        self.assertTrue(reserve_seats(self.driver.id, 1, DB_ALIAS))
+        self.assertEqual(self.filled(), 3)
+        release_seats(self.driver.id, 5, DB_ALIAS)
+        self.assertEqual(self.filled(), 0)
+
+    def test_accept_passenger(self):
+        a, b, c = self.pax(2), self.pax(2), self.pax(1, driver=False)
+        self.assertEqual(accept_passenger(self.driver.id, a.id, DB_ALIAS), ACCEPTED)
+        self.assertEqual(accept_passenger(self.driver.id, a.id, DB_ALIAS), ALREADY)
+        self.assertEqual(accept_passenger(self.driver.id, b.id, DB_ALIAS), FULL)
+        b.refresh_from_db()
+        self.assertFalse(b.is_matched)          # 座位不夠：乘客狀態一起回復
+        self.assertEqual(accept_passenger(self.driver.id, c.id, DB_ALIAS), GONE)   # 不是這位司機的
+        self.assertEqual(accept_passenger(self.driver.id, c.id, DB_ALIAS, claim_unassigned=True), ACCEPTED)
+        c.refresh_from_db()
+        self.assertEqual((c.driver_id, c.is_matched), (self.driver.id, True))
+        self.assertEqual(self.filled(), 3)
+
+    def test_deactivate_if_full_keeps_facets(self):
+        rebuild_facets(DB_ALIAS)
+        self.assertFalse(deactivate_if_full(self.driver.id, DB_ALIAS))
+        reserve_seats(self.driver.id, 3, DB_ALIAS)
+        self.assertTrue(deactivate_if_full(self.driver.id, DB_ALIAS))
+        self.assertEqual({(d, v): n for d, v, n in FacetCount.objects.using(DB_ALIAS)
+                          .filter(count__gt=0).values_list("dimension", "value", "count")},
+                         compute_facets(DB_ALIAS))
+
+
+    def edit(self, seats_total, during=None):
+        """driver_manage 的「更新司機資訊」；during：view 讀完司機之後、存檔之前發生的事"""
+        session = self.client.session
+        session[f"driver_auth_{self.driver.id}"] = True
+        session.save()
+
+        def candidates(driver, **kwargs):
+            if during:
+                during()
+            return []
+        with mock.patch("Find.views.passengers_on_route", candidates):
+            self.client.post(f"/find/driver/{self.driver.id}/manage/", {
+                "form": "update_driver", "driver_name": self.driver.driver_name, "seats_total": seats_total,
+                "departure": "台北市", "destination": "宜蘭縣", "date": self.driver.date.isoformat(),
+                "is_active": "on",
+            })
+        self.driver.refresh_from_db()
+
+    def test_driver_edit_keeps_concurrent_seats(self):
+        # view 讀到 seats_filled = 0，存檔前別的請求扣了 2 位：存檔不可以把它蓋回 0
+        self.edit(3, during=lambda: reserve_seats(self.driver.id, 2, DB_ALIAS))
+        self.assertEqual((self.driver.seats_filled, self.driver.is_active), (2, True))
+        # 座位改少：截斷到新的座位數並下架
+        self.edit(1)
+        self.assertEqual((self.driver.seats_total, self.driver.seats_filled, self.driver.is_active), (1, 1, False))
+
+
+class BulkDecideTests(TripTestCase):
+    """批次接受 / 退回（seats.decide_passengers、driver_pax_bulk）：查詢次數不隨人數增加"""
+    seats_total = 4
+
+    def test_outcomes(self):
+        x = self.pax(1)
+        accept_passenger(self.driver.id, x.id, DB_ALIAS)
+        a, b, c = self.pax(2), self.pax(2), self.pax(1)
+        got = decide_passengers(self.driver.id, accept=[a.id, b.id, c.id, x.id, 999999], reject=[x.id])
+        # x 在 accept 也在 reject：以 accept 為準（已經是已接受）
+        self.assertEqual(got, {a.id: ACCEPTED, b.id: FULL, c.id: ACCEPTED, x.id: ALREADY, 999999: GONE})
+
+        got = decide_passengers(self.driver.id, accept=[b.id], reject=[x.id, c.id])
+        self.assertEqual(got, {x.id: REJECTED, c.id: REJECTED, b.id: ACCEPTED})
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.seats_filled, 4)
+        x.refresh_from_db()
+        self.assertEqual((x.driver_id, x.is_matched), (None, False))    # 退回未指派，不刪除
+
+    def test_queries_do_not_grow(self):
+        conn = connections[DB_ALIAS]
+        self.driver.seats_total = 100
+        self.driver.save()
+        counts = []
+        for n in (3, 20):
+            ids = [self.pax(1).id for _ in range(n)]
+            with CaptureQueriesContext(conn) as ctx:
+                decide_passengers(self.driver.id, accept=ids)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_endpoint(self):
+        a, b = self.pax(3), self.pax(3)
+        url = f"/find/driver/{self.driver.id}/manage/bulk/"
+        body = json.dumps({"accept_ids": [a.id, b.id]})
+        self.assertEqual(self.client.post(url, body, content_type="application/json").status_code, 403)
+
+        session = self.client.session
+        session[f"driver_auth_{self.driver.id}"] = True
+        session.save()
+        res = self.client.post(url, body, content_type="application/json").json()
+        self.assertEqual(res["results"], {str(a.id): ACCEPTED, str(b.id): FULL})
+        self.assertEqual(res["remaining"], 1)
+
+
+@override_settings(FIND_SEAT_LEDGER="memory", FIND_SEAT_LEDGER_FLUSH_MS=0)
+class SeatLedgerTests(TripTestCase):
+    """座位帳本（ledger.py，程序內版本）：不超賣、晚一點寫回 find_db、對帳保留兩邊的變動"""
+
+    def setUp(self):
+        reset_ledgers()
+        self.addCleanup(reset_ledgers)
+        super().setUp()
+        self.ledger = get_ledger(DB_ALIAS)
+
+    def db_filled(self):
+        self.driver.refresh_from_db()
+        return self.driver.seats_filled
+
+    def test_write_behind(self):
+        a, b = self.pax(2), self.pax(2)
+        self.assertEqual(accept_passenger(self.driver.id, a.id, DB_ALIAS), ACCEPTED)
+        self.assertEqual(accept_passenger(self.driver.id, b.id, DB_ALIAS), FULL)
+        b.refresh_from_db()
+        self.assertFalse(b.is_matched)
+        self.assertEqual(seats_left(self.driver.id, DB_ALIAS), 1)
+        self.assertEqual(self.db_filled(), 0)            # 還沒寫回
+
+        with self.captureOnCommitCallbacks(execute=True, using=DB_ALIAS):
+            self.assertEqual(self.ledger.flush(), 1)
+        self.assertEqual(self.db_filled(), 2)
+        self.assertEqual(self.ledger.metrics()["dirty"], 0)
+
+    def test_deactivate_sees_ledger(self):
+        self.assertTrue(reserve_seats(self.driver.id, 3, DB_ALIAS))
+        self.assertFalse(reserve_seats(self.driver.id, 1, DB_ALIAS))
+        self.assertTrue(deactivate_if_full(self.driver.id, DB_ALIAS))   # 先寫回再判斷
+        self.driver.refresh_from_db()
+        self.assertEqual((self.driver.seats_filled, self.driver.is_active), (3, False))
+
+    def test_reconcile_keeps_both_sides(self):
+        reserve_seats(self.driver.id, 1, DB_ALIAS)
+        with self.captureOnCommitCallbacks(execute=True, using=DB_ALIAS):
+            self.ledger.flush()
+        # 帳本外改了 find_db（例如 admin），帳本同時又扣了一位
+        DriverTrip.objects.using(DB_ALIAS).filter(id=self.driver.id).update(seats_filled=F("seats_filled") + 1)
+        reserve_seats(self.driver.id, 1, DB_ALIAS)
+        with self.captureOnCommitCallbacks(execute=True, using=DB_ALIAS):
+            self.assertEqual(self.ledger.reconcile(), {"drift": 1, "flushed": 1})
+        self.assertEqual(self.db_filled(), 3)
+        self.assertEqual(seats_left(self.driver.id, DB_ALIAS), 0)
+
+    def test_driver_save_syncs_total(self):
+        reserve_seats(self.driver.id, 2, DB_ALIAS)
+        with self.captureOnCommitCallbacks(execute=True, using=DB_ALIAS):
+            self.driver.seats_total = 5
+            self.driver.save(using=DB_ALIAS)
+        self.assertEqual(seats_left(self.driver.id, DB_ALIAS), 3)    # 帳本裡扣的 2 位還在
+
+    def test_outer_rollback_restores_ledger(self):
+        a, b = self.pax(2), self.pax(1)
+        accept_passenger(self.driver.id, b.id, DB_ALIAS)
+        with self.assertRaises(RuntimeError):
+            with seat_transaction(DB_ALIAS):
+                self.assertEqual(accept_passenger(self.driver.id, a.id, DB_ALIAS), ACCEPTED)
+                release_seats(self.driver.id, 1, DB_ALIAS)
+                raise RuntimeError
+        a.refresh_from_db()
+        self.assertFalse(a.is_matched)
+        self.assertEqual(seats_left(self.driver.id, DB_ALIAS), 2)   # 內層已提交的扣 / 還一起倒回
+
+
+class WaitlistTests(TripTestCase):
+    """行程候補（waitlist.py）：座位不夠排隊，釋放座位的同一個交易裡依 FIFO 遞補"""
+    seats_total = 2
+
+    def join(self, seats):
+        res = self.client.post(f"/find/driver/{self.driver.id}/join/", {
+            "passenger_name": "乘客", "seats_needed": seats, "departure": "台北市", "destination": "宜蘭縣",
+        }, headers={"x-requested-with": "XMLHttpRequest"})
+        self.assertEqual(res.status_code, 200)
+        return res.json()
+
+    def accepted(self, seats):
+        p = self.pax(seats, passenger_name="已接受")
+        self.assertEqual(accept_passenger(self.driver.id, p.id, DB_ALIAS), ACCEPTED)
+        return p
+
+    def test_join_when_full_waits_then_promotes_on_reject(self):
+        a = self.accepted(2)
+        first = self.join(2)
+        second = self.join(1)
+        self.assertEqual((first["waitlisted"], first["position"]), (True, 1))
+        self.assertEqual(second["position"], 2)            # 排在後面，不插隊
+        self.assertIsNone(PassengerRequest.objects.using(DB_ALIAS).get(
+            waitlist_entry__id=first["entry_id"]).driver_id)
+        self.assertIsNone(entry_status(first["entry_id"], "wrong-token"))
+
+        session = self.client.session
+        session[f"driver_auth_{self.driver.id}"] = True
+        session.save()
+        with self.captureOnCommitCallbacks(using=DB_ALIAS) as callbacks:
+            self.assertTrue(self.client.post(f"/find/pax/{a.id}/reject/").json()["ok"])
+        self.assertTrue(callbacks)                          # 遞補通知在交易提交後才送
+
+        # 空出 2 位：第一位（2 人）遞補；第二位還要等（待確認也算佔位）
+        self.assertEqual(entry_status(first["entry_id"], first["token"])["position"], 0)
+        self.assertEqual(entry_status(second["entry_id"], second["token"])["position"], 1)
+        promoted = PassengerRequest.objects.using(DB_ALIAS).get(waitlist_entry__id=first["entry_id"])
+        self.assertEqual((promoted.driver_id, promoted.is_matched), (self.driver.id, False))
+
+    def test_join_counts_pending_seats(self):
+        self.assertNotIn("waitlisted", self.join(2))     # 待確認不佔位，但遞補 / 報名都把它算進去
+        res = self.client.post(f"/find/driver/{self.driver.id}/join/", {
+            "passenger_name": "乘客", "seats_needed": 1, "departure": "台北市", "destination": "宜蘭縣"})
+        entry = WaitlistEntry.objects.using(DB_ALIAS).get(driver=self.driver)
+        self.assertIn(f"waitlist={entry.id}&token={entry.token}&position=1", res["Location"])
+
+    def test_join_inactive_trip(self):
+        DriverTrip.objects.using(DB_ALIAS).filter(id=self.driver.id).update(is_active=False)
+        res = self.client.post(f"/find/driver/{self.driver.id}/join/", {
+            "passenger_name": "乘客", "seats_needed": 1, "departure": "台北市", "destination": "宜蘭縣",
+        }, headers={"x-requested-with": "XMLHttpRequest"})
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(WaitlistEntry.objects.using(DB_ALIAS).filter(driver=self.driver).exists())
+        # 坐滿自動下架的還是可以排候補
+        self.accepted(2)
+        self.assertTrue(self.join(1)["waitlisted"])
+
+    def test_waitlisted_is_not_unassigned(self):
+        self.accepted(2)
+        other = DriverTrip.objects.using(DB_ALIAS).create(
+            driver_name="別的司機", contact="", seats_total=4, departure="台北市",
+            destination="宜蘭縣", date=self.driver.date)
+        entry = self.join(1)
+        p = PassengerRequest.objects.using(DB_ALIAS).get(waitlist_entry__id=entry["entry_id"])
+        self.assertEqual((p.driver_id, p.is_matched, p.is_waitlisted), (None, False, True))
+        # 首頁乘客列表、候選乘客、自動媒合、直接接受都看不到排候補的乘客
+        self.assertNotIn(p.id, [x.id for x in self.client.get("/find/").context["passengers"]])
+        self.assertNotIn(p.id, [x.id for x in passengers_on_route(other)])
+        self.assertNotIn(p.id, [row[0] for row in load_board()[0]])
+        self.assertIsNone(propose_driver(p.id))
+        self.assertEqual(accept_passenger(other.id, p.id, DB_ALIAS, claim_unassigned=True), GONE)
+
+        DriverTrip.objects.using(DB_ALIAS).filter(id=self.driver.id).update(seats_total=3)
+        promote(self.driver.id)
+        p.refresh_from_db()
+        self.assertEqual((p.driver_id, p.is_waitlisted), (self.driver.id, False))
+
+    def test_strict_fifo_and_stale_entries(self):
+        self.accepted(2)
+        big, small, gone = self.join(2), self.join(1), self.join(1)
+        # 第三位被別的司機配走了：遞補時直接刪掉
+        PassengerRequest.objects.using(DB_ALIAS).filter(waitlist_entry__id=gone["entry_id"]).update(
+            driver_id=self.driver.id, is_matched=True)
+
+        DriverTrip.objects.using(DB_ALIAS).filter(id=self.driver.id).update(seats_total=3)
+        self.assertEqual(promote(self.driver.id), [])      # 只空 1 位：排第一的 2 人坐不下，後面也等
+        DriverTrip.objects.using(DB_ALIAS).filter(id=self.driver.id).update(seats_total=5)
+        got = [e for e, _ in promote(self.driver.id)]
+        self.assertEqual(got, [big["entry_id"], small["entry_id"]])
+        self.assertFalse(WaitlistEntry.objects.using(DB_ALIAS).filter(id=gone["entry_id"]).exists())
+
+
+class FareNoteTests(SimpleTestCase):
+    """車資備註解析（models.parse_fare_note）：金額、免費 / 分攤的字眼"""
+
+    def test_parse_fare_note(self):
+        for note, expected in (("NT$1,200", (1200, False)), ("油錢AA", (None, True)), ("aa 每人 300", (300, True)),
+                               ("", (None, True)), ("0", (0, True)), ("待議", (None, True))):
+            with self.subTest(note=note):
+                self.assertEqual(parse_fare_note(note), expected)
+
+
+class DispatchQueueTests(SimpleTestCase):
+    """背景派送佇列滿了：一般工作丟棄並計數，inline_if_full 的改在呼叫端執行"""
+
+    def test_full_queue(self):
+        q = DispatchQueue(mode="thread", max_depth=1)
+        started, release, ran = threading.Event(), threading.Event(), []
+        q.submit(lambda: (started.set(), release.wait(5)), key="busy")
+        self.assertTrue(started.wait(5))             # worker 卡在第一個工作
+        q.submit(ran.append, "queued")                # 佇列滿了
+        with self.assertLogs("Find.dispatch", "WARNING"):
+            self.assertFalse(q.submit(ran.append, "dropped"))
+            self.assertTrue(q.submit(ran.append, "inline", inline_if_full=True))
+        self.assertEqual(ran, ["inline"])
+        release.set()
+        self.assertTrue(q.join(5))
+        self.assertEqual(ran, ["inline", "queued"])
+        self.assertEqual((q.stats["dropped"], q.stats["inlined"]), (1, 1))
+
+
+class BackpressureTests(SimpleTestCase):
+    """慢速連線（backpressure.py）：落後時同一張卡片只留最新狀態，塞太多就改送快照"""
+
+    def test_full_state_replaces_partial(self):
+        box = Outbox()
+        seats = {"type": "seats_changed", "driver_id": 1, "seq": 1}
+        updated = {"type": "driver_updated", "driver_id": 1, "seq": 2}
+        self.assertEqual(box.add([seats, updated]), 1)      # 完整狀態蓋掉之前的局部更新
+        self.assertEqual(box.drain(), [updated])
+        self.assertEqual(len(box), 0)
+
+    def test_seats_changed_coalesces(self):
+        box = Outbox()
+        updated = {"type": "driver_updated", "driver_id": 1, "seq": 1}
+        last = {"type": "seats_changed", "driver_id": 1, "seq": 4}
+        other = {"type": "seats_changed", "driver_id": 2, "seq": 3}
+        self.assertEqual(box.add([updated, {"type": "seats_changed", "driver_id": 1, "seq": 2}, other, last]), 1)
+        # 局部更新只留最新一則，排在同一張卡片的完整狀態後面；最近動過的卡片排最後
+        self.assertEqual(box.drain(), [other, updated, last])
+
+    @mock.patch("Find.backpressure.OUTBOX_MAX_KEYS", 2)
+    def test_discard_and_snapshot_after_max_keys(self):
+        fc = FlowControl()
+        before = backpressure_stats["dropped"]
+        fc.hold([{"type": "driver_updated", "driver_id": i, "seq": i} for i in (1, 2)])
+        self.assertFalse(fc.needs_snapshot)
+        fc.hold([{"type": "passenger_added", "passenger_id": 9, "seq": 3}])
+        self.assertTrue(fc.needs_snapshot)
+        self.assertEqual(len(fc.outbox), 0)
+        fc.hold([{"type": "driver_updated", "driver_id": 1, "seq": 4}])   # 等快照期間的事件直接丟
+        self.assertEqual((len(fc.outbox), backpressure_stats["dropped"] - before), (0, 4))
+        fc.reset()
+        self.assertFalse(fc.needs_snapshot)
+
+    @mock.patch("Find.backpressure.MAX_IN_FLIGHT", 2)
+    def test_ack_releases_in_flight(self):
+        fc = FlowControl()
+        fc.sent(1)
+        self.assertEqual(len(fc.in_flight), 0)              # 沒送過 ack 的舊前端：不追蹤
+        fc.ack(0)
+        for seq in (1, 2, 3):
+            fc.sent(seq)
+        self.assertTrue(fc.behind)
+        self.assertFalse(fc.has_room)
+        fc.ack(2)
+        self.assertEqual(list(fc.in_flight), [3])
+        self.assertTrue(fc.has_room)
+        self.assertFalse(fc.behind)
+
+
+class EncodingTests(SimpleTestCase):
+    """WebSocket 傳輸編碼（encoding.py）：各編碼解得回原本的事件、協商依伺服器偏好"""
+
+    EVENT = {"type": "driver_updated", "driver_id": 7, "seq": 3,
+             "html": '<li class="card" data-driver="7"><b>王小明</b> 台北市 → 宜蘭縣</li>'}
+
+    def inflater(self):
+        """前端的 pako.inflateRaw(..., {dictionary})：保留同樣的明文尾巴，依序每則解一次"""
+        history = b""
+
+        def inflate(data):
+            nonlocal history
+            d = zlib.decompressobj(-DEFLATE_WBITS, zdict=history) if history else zlib.decompressobj(-DEFLATE_WBITS)
+            raw = d.decompress(data) + d.flush()
+            history = (history + raw)[-(1 << DEFLATE_WBITS):]
+            return json.loads(raw.decode("utf-8"))
+        return inflate
+
+    def test_json(self):
+        text = JSON.encode(self.EVENT)
+        self.assertIn("王小明", text)                      # 中文不轉成 \uXXXX
+        self.assertEqual(json.loads(text), self.EVENT)
+        self.assertIs(JSON.encode_prepared(text, self.EVENT), text)
+
+    @skipUnless(msgpack, "沒有安裝 msgpack")
+    def test_msgpack(self):
+        codec = MsgpackCodec()
+        self.assertEqual(msgpack.unpackb(codec.encode(self.EVENT), raw=False), self.EVENT)
+        self.assertEqual(msgpack.unpackb(codec.encode_prepared(dumps(self.EVENT), self.EVENT), raw=False),
+                         self.EVENT)
+
+    def test_deflate_uses_connection_dictionary(self):
+        codec, inflate = DeflateCodec(), self.inflater()
+        first = codec.encode(self.EVENT)
+        again = codec.encode_prepared(dumps(self.EVENT), self.EVENT)
+        self.assertLess(len(again), len(first))           # 第二則只送字典裡的引用
+        self.assertEqual(inflate(first), self.EVENT)
+        self.assertEqual(inflate(again), self.EVENT)
+        other = dict(self.EVENT, seq=4)
+        self.assertEqual(inflate(codec.encode(other)), other)
+        # 新連線從空字典開始，不會用到別條連線送過的內容
+        self.assertEqual(self.inflater()(DeflateCodec().encode(self.EVENT)), self.EVENT)
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate(None), (JSON, None))
+        self.assertEqual(negotiate(["chat", "find.json"]), (JSON, "find.json"))
+        first, proto = negotiate(["find.json", "find.deflate"])
+        self.assertEqual((first.name, proto), ("deflate", "find.deflate"))
+        self.assertIsNot(negotiate(["find.deflate"])[0], first)      # 字典是每條連線各一份
+        with override_settings(FIND_WS_ENCODINGS="msgpack,json"):
+            self.assertEqual(negotiate(["find.deflate", "find.json"]), (JSON, "find.json"))
+            self.assertEqual(negotiate(["find.deflate"]), (JSON, None))
+
+    def test_binary_frame_is_ignored(self):
+        consumer = FindConsumer()
+        consumer.record_received = mock.Mock()
+        async_to_sync(consumer.receive)(bytes_data=b"\x93\x01")
+        consumer.record_received.assert_not_called()
+
+
+class MetricsViewTests(SimpleTestCase):
+    """/find/metrics/：沒設定權杖時不公開"""
+
+    def get(self, user=None, **params):
+        request = RequestFactory().get("/find/metrics/", params)
+        request.user = user or AnonymousUser()
+        return metrics_view(request).status_code
+
+    @override_settings(DEBUG=False, FIND_METRICS_TOKEN="")
+    def test_fails_closed_without_token(self):
+        self.assertEqual(self.get(), 403)
+        self.assertEqual(self.get(SimpleNamespace(is_active=True, is_staff=True)), 200)
+
+    @override_settings(DEBUG=False, FIND_METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.get(token="wrong"), 403)
+        self.assertEqual(self.get(token="secret"), 200)
+
+
+class DataMigrationTests(TransactionTestCase):
+    """0014 之後新增的欄位 / 表，migration 會把既有資料補齊（車資、地點、全文索引、篩選計數）"""
+    databases = {"default", DB_ALIAS}
+    serialized_rollback = True
+    before = ("Find", "0013_drivertrip_find_drv_date_active_and_more")
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connections[DB_ALIAS])
+        self.executor.migrate([self.before])
+        self.addCleanup(self.migrate_latest)
+        apps = self.executor.loader.project_state([self.before]).apps
+        driver_model = apps.get_model("Find", "DriverTrip")
+        pax_model = apps.get_model("Find", "PassengerRequest")
+        self.driver_id = driver_model.objects.using(DB_ALIAS).create(
+            driver_name="舊司機", contact="", seats_total=3, departure="臺北市 信義區", destination="宜蘭縣",
+            date=date.today() + timedelta(days=100), fare_note="NT$1,200 油錢").id
+        self.pax_id = pax_model.objects.using(DB_ALIAS).create(
+            passenger_name="舊乘客", contact="", seats_needed=1, departure="花蓮縣光復鄉大進村",
+            destination="台北市", date=date.today() + timedelta(days=100), driver_id=self.driver_id).id
+
+    def migrate_latest(self):
+        executor = MigrationExecutor(connections[DB_ALIAS])
+        executor.migrate(executor.loader.graph.leaf_nodes("Find"))
+        _known.clear()      # Location 表重建過：已知地點的快取要重讀
+
+    def loc(self, name):
+        return Location.objects.using(DB_ALIAS).get(name=name).id
+
+    def test_backfills_existing_rows(self):
+        self.migrate_latest()
+        d = DriverTrip.objects.using(DB_ALIAS).get(id=self.driver_id)
+        p = PassengerRequest.objects.using(DB_ALIAS).get(id=self.pax_id)
+        self.assertEqual((d.fare_amount, d.fare_is_free), (1200, False))
+        self.assertEqual((d.departure_loc_id, d.destination_loc_id), (self.loc("台北市"), self.loc("宜蘭縣")))
+        self.assertEqual((p.departure_loc_id, p.destination_loc_id), (self.loc("花蓮縣光復鄉"), self.loc("台北市")))
+        # 全文索引：司機欄位和乘客姓名都搜得到
+        for term in ("油錢", "舊乘客"):
+            self.assertEqual(list(DriverTrip.objects.using(DB_ALIAS).filter(search_q(term)).values_list(
+                "id", flat=True)), [self.driver_id])
+        # 篩選計數：既有的上架司機算進出發地 / 目的地 / 日期
+        stored = {(f.dimension, f.value): f.count for f in FacetCount.objects.using(DB_ALIAS).filter(count__gt=0)}
+        self.assertEqual(stored, {
+            ("dep", str(self.loc("台北市"))): 1, ("des", str(self.loc("宜蘭縣"))): 1, ("date", str(d.date)): 1})
@@ -1,10 +1,13 @@
 from django.urls import path
 from django.urls import re_path
 from . import views
+from .metrics import metrics_view
 from .consumers import DriverManageConsumer
 
 urlpatterns = [
     path("", views.index, name="find_index"),
+    path("drivers/page/", views.driver_page, name="find_driver_page"),
+    path("facets/", views.driver_facets, name="find_facets"),
     path("people/", views.find_people, name="find_people"),
     path("car/", views.find_car, name="find_car"),
 
@@ -24,8 +27,12 @@ urlpatterns = [
     path("pax/<int:pax_id>/memo/",   views.pax_memo,   name="pax_memo"),
     path('pax/<int:pax_id>/accept/', views.pax_accept, name='pax_accept'),
     path('pax/<int:pax_id>/reject/', views.pax_reject, name='pax_reject'),
+    path("driver/<int:driver_id>/manage/bulk/", views.driver_pax_bulk, name="driver_pax_bulk"),
     # 密碼驗證（AJAX）
     path("driver/<int:driver_id>/manage/auth/", views.driver_manage_auth, name="driver_manage_auth"),
+
+    # 即時層監控（Prometheus）
+    path("metrics/", metrics_view, name="find_metrics"),
 ]
 
 urlpatterns += [
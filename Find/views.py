@@ -7,27 +7,42 @@ from django.http import JsonResponse, HttpResponseForbidden, Http404
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
-from django.db import transaction, connection
+from django.utils.http import urlencode
+from django.db import transaction
 from django.views.decorators.http import require_POST
 from django.template.loader import render_to_string
 from django.utils.dateparse import parse_date
 from django.utils import timezone
 from django.utils.crypto import constant_time_compare
+from django.utils.safestring import mark_safe
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.csrf import csrf_protect
 import json
 
 from django.db.models import (
-    Prefetch, Q, F, Case, When, Value, IntegerField, ExpressionWrapper, Count, Func
+    Prefetch, Q, F, Value, IntegerField, ExpressionWrapper
 )
-from django.db.models.functions import Cast, Coalesce, NullIf, Replace, Trim
+from django.db.models.functions import Coalesce
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from .models import DriverTrip, PassengerRequest
+from .changes import collect_changes, touch
+from .cards import project_drivers, project_passengers
+from .facets import date_facets, drilldown_counts, location_facets
+from .locations import UNKNOWN_RANK, location_ids
+from .pagecache import CardPage, filters_key, page_cache
+from .pagination import InvalidCursor, after_q, decode_cursor, encode_cursor, keyset_queryset, row_key
+from .search import search_q
+from .routes import drivers_on_route, passengers_on_route
+from .seats import ACCEPTED as SEATS_ACCEPTED, FULL as SEATS_FULL, GONE as SEATS_GONE, REJECTED as SEATS_REJECTED
+from .seats import (accept_passenger, clamp_seats, decide_passengers, deactivate_if_full, reactivate_if_open,
+                    release_seats, seat_transaction, seats_left)
+from .subscriptions import normalize_sort
+from .waitlist import enqueue, free_seats, has_waitlist, position as waitlist_position, promote as promote_waitlist
+from django.conf import settings
 from django.core.exceptions import ValidationError
 
-import re
 from django.db.models import CharField
 
 try:
@@ -70,182 +85,11 @@ def _driver_authed(request, driver: DriverTrip) -> bool:
 
     return constant_time_compare((pw or "").strip(), (driver.password or "").strip())
 
-def _repaint_lists():
-    """
-    若你要像 join_driver 一樣同時刷新列表（drivers_html / passengers_html），
-    可以把那段重算 + render_to_string 搬過來呼叫。
-    這裡先做 NO-OP，保留 broadcast_driver_card 即時更新卡片即可。
-    """
-    pass
-
 def _manage_payload(driver, pax):
     status = "accepted" if pax.is_matched else "pending"
     html = render_to_string("Find/_driver_manage_pax_item.html", {"p": pax})
     return {"ok": True, "driver_id": driver.id, "pax_id": pax.id, "status": status, "html": html}
 
-def broadcast_full_lists():
-    pending_qs  = PassengerRequest.objects.using("find_db").filter(is_matched=False).order_by("-id")
-    accepted_qs = PassengerRequest.objects.using("find_db").filter(is_matched=True ).order_by("-id")
-
-    d = (
-        DriverTrip.objects.using("find_db")
-        .filter(is_active=True)
-        .prefetch_related(
-            Prefetch("passengers", queryset=pending_qs,  to_attr="pending_list"),
-            Prefetch("passengers", queryset=accepted_qs, to_attr="accepted_list"),
-        )
-    )
-
-    passengers = PassengerRequest.objects.using("find_db").filter(
-        is_matched=False, driver__isnull=True
-    ).order_by("-id")
-
-    drivers_html    = render_to_string("Find/_driver_list.html",    {"drivers": d})
-    passengers_html = render_to_string("Find/_passenger_list.html", {"passengers": passengers})
-
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        "find_group",
-        {
-            "type": "send.update",
-            "drivers_html": drivers_html,
-            "passengers_html": passengers_html,
-        },
-    )
-def broadcast_driver_card(driver_id: int):
-    channel_layer = get_channel_layer()
-    d = DriverTrip.objects.using("find_db").filter(id=driver_id).first()
-    driver = (driver_cards_qs(only_active=False)
-              .filter(id=driver_id)
-              .first())
-    if not driver:
-        # 可回傳移除卡片的訊息（如果被下架/刪除）
-        async_to_sync(channel_layer.group_send)("find_group", {
-            "payload": {
-                    "type": "driver_partial",
-                    "driver_id": driver_id,
-                    "driver_html": "",
-                    "active": False,
-                },
-        })
-        return
-    # 準備這張卡片需要的 pending / accepted
-    pending_qs  = PassengerRequest.objects.using("find_db").filter(driver_id=driver_id, is_matched=False).order_by("-id")
-    accepted_qs = PassengerRequest.objects.using("find_db").filter(driver_id=driver_id, is_matched=True ).order_by("-id")
-
-    # 兩種作法：要嘛 prefetch 到 driver，要嘛直接掛暫時屬性給模板用
-    driver.pending  = list(pending_qs)
-    driver.accepted = list(accepted_qs)
-
-    # 準備這張卡片需要的兩個清單（對應模板的 d.pending_list / d.accepted_list）
-    d.pending_list  = list(
-        PassengerRequest.objects.using("find_db")
-        .filter(driver_id=driver_id, is_matched=False)
-        .order_by("-id")
-    )
-    d.accepted_list = list(
-        PassengerRequest.objects.using("find_db")
-        .filter(driver_id=driver_id, is_matched=True)
-        .order_by("-id")
-    )
-
-    # 渲染「單一卡片模板」(下一節會給)
-    driver_html = render_to_string("Find/_driver_card.html", {"d": d})
-
-    # 廣播
-    async_to_sync(channel_layer.group_send)(
-        "find_group",
-        {
-            "type": "send.partial",
-            "payload": {
-                "type": "driver_partial",
-                "driver_id": d.id,
-                "driver_html": driver_html,
-                "active": bool(d.is_active),
-            },
-        },
-    )
-
-    html = render_to_string("Find/_driver_card.html", {"d": driver})
-    async_to_sync(channel_layer.group_send)("find_group", {
-        "type": "send.partial",
-        "driver_id": driver_id,
-        "html": html,
-    })
-
-
-def _broadcast_lists():
-    channel_layer = get_channel_layer()
-
-    pending_qs  = PassengerRequest.objects.using("find_db").filter(is_matched=False).order_by("-id")
-    accepted_qs = PassengerRequest.objects.using("find_db").filter(is_matched=True ).order_by("-id")
-
-    d = (
-        DriverTrip.objects.using("find_db")
-        .filter(is_active=True)
-        .prefetch_related(
-            Prefetch("passengers", queryset=pending_qs,  to_attr="pending_list"),
-            Prefetch("passengers", queryset=accepted_qs, to_attr="accepted_list"),
-        )
-    )
-
-    passengers = PassengerRequest.objects.using("find_db").filter(
-        is_matched=False, driver__isnull=True
-    ).order_by("-id")
-
-    drivers_html    = render_to_string("Find/_driver_list.html",    {"drivers": d})
-    passengers_html = render_to_string("Find/_passenger_list.html", {"passengers": passengers})
-
-    async_to_sync(channel_layer.group_send)(
-        "find_group",
-        {"type": "send.update", "drivers_html": drivers_html, "passengers_html": passengers_html},
-    )
-def broadcast_full_update():
-    """把 drivers / passengers 兩個片段一起廣播出去（所有使用者即時更新）"""
-    channel_layer = get_channel_layer()
-
-    # 乘客快取 queryset
-    pending_qs  = PassengerRequest.objects.using("find_db").filter(is_matched=False).order_by("-id")
-    accepted_qs = PassengerRequest.objects.using("find_db").filter(is_matched=True).order_by("-id")
-
-    # 只有上架中的司機要顯示
-    d = (
-        DriverTrip.objects.using("find_db")
-        .filter(is_active=True)
-        .prefetch_related(
-            Prefetch("passengers", queryset=pending_qs,  to_attr="pending_list"),
-            Prefetch("passengers", queryset=accepted_qs, to_attr="accepted_list"),
-        )
-        .order_by("-id")
-    )
-
-    # 尚未媒合、未指派司機的乘客
-    passengers = (
-        PassengerRequest.objects.using("find_db")
-        .filter(is_matched=False, driver__isnull=True)
-        .order_by("-id")
-    )
-
-    drivers_html = render_to_string("Find/_driver_list.html", {"drivers": d})
-    passengers_html = render_to_string("Find/_passenger_list.html", {"passengers": passengers})
-
-    # 傳給同一個 group（你的 consumer 會把它包成 {"type":"update", ...} 給前端）
-    async_to_sync(channel_layer.group_send)(
-        "find_group",
-        {
-            "type": "send.update",          # 對應 consumer 的 handler，例如 async def send_update(...)
-            "drivers_html": drivers_html,
-            "passengers_html": passengers_html,
-        },
-    )
-def broadcast_update(message):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        "find_updates",
-        {"type": "send_update", "message": message}
-    )
-
-
 def _broadcast_manage(driver, pax):
     channel_layer = get_channel_layer()
     payload = _manage_payload(driver, pax)
@@ -260,112 +104,117 @@ def broadcast_driver_manage(driver_id, payload):
         {"type": "driver.manage.update", "payload": payload}
     )
 
-def broadcast_manage_panels(driver_id: int):
-    """給司機管理頁用：推送待確認／已接受兩個 UL 的整段 HTML"""
-    from .models import DriverTrip, PassengerRequest
-    d = DriverTrip.objects.using(DB_ALIAS).get(pk=driver_id)
-    pending_qs = (PassengerRequest.objects.using(DB_ALIAS)
-                  .filter(driver=d, is_matched=False)
-                  .order_by("-id"))
-
-    accepted_qs = (PassengerRequest.objects.using(DB_ALIAS)
-                   .filter(driver=d, is_matched=True)
-                   .order_by("-id"))
-
-    html = render_to_string(
-        "Find/_manage_panels.html",
-        {"driver": d, "pending": pending_qs, "accepted": accepted_qs},
-    )
-
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"driver_{driver_id}",
-        {"type": "manage.panels", "html": html},
-    )
-
 @require_POST
-@transaction.atomic(using=DB_ALIAS)
+@collect_changes
 def pax_accept(request, pax_id: int):
-    """司機接受乘客：若已接受則視為 idempotent。"""
+    """司機接受乘客：若已接受則視為 idempotent。座位用條件式 UPDATE 扣（seats.py），不鎖司機列。"""
     p = get_object_or_404(PassengerRequest.objects.using(DB_ALIAS), id=pax_id)
 
     # 需有掛載司機
     if not p.driver_id:
         return JsonResponse({"ok": False, "error": "NO_DRIVER"}, status=400)
 
-    # 鎖定司機行程、驗證授權
-    d = DriverTrip.objects.using(DB_ALIAS).select_for_update().get(id=p.driver_id)
+    # 驗證授權
+    d = get_object_or_404(DriverTrip.objects.using(DB_ALIAS).only("id", "password"), id=p.driver_id)
     if not _driver_authed(request, d):
         return JsonResponse({"ok": False, "error": "FORBIDDEN"}, status=403)
 
-    
-
-    # 尚未接受 → 檢查座位、寫入
-    remaining = max(0, d.seats_total - d.seats_filled)
-    if remaining < p.seats_needed:
-        return JsonResponse({"ok": False, "error": "FULL", "remaining": remaining}, status=400)
-
-    if not p.is_matched:
-        d.seats_filled += p.seats_needed
-        p.is_matched = True
-        d.save(using=DB_ALIAS, update_fields=["seats_filled"])
-        p.save(using=DB_ALIAS, update_fields=["is_matched"])
+    outcome = accept_passenger(d.id, p.id, DB_ALIAS)
+    remaining = seats_left(d.id, DB_ALIAS)
+    if outcome == SEATS_FULL:
+        return JsonResponse({"ok": False, "error": "FULL", "remaining": max(0, remaining)}, status=400)
+    if outcome == SEATS_GONE:
+        return JsonResponse({"ok": False, "error": "NO_DRIVER"}, status=400)
 
-    transaction.on_commit(lambda: (
-        broadcast_driver_card(d.id),
-        broadcast_manage_panels(d.id),
-    ))
-    return JsonResponse({"ok": True, "remaining": max(0, d.seats_total - d.seats_filled)})
+    # 交易提交後交給背景佇列渲染、廣播，回應不必等
+    touch(drivers=[d.id], passengers=[p.id], panels=[d.id])
+    return JsonResponse({"ok": True, "remaining": max(0, remaining)})
 
 
 @require_POST
-@transaction.atomic(using=DB_ALIAS)
+@collect_changes
 def pax_reject(request, pax_id: int):
     """司機拒絕/取消乘客：若原本已接受需釋放座位，並從司機底下移除。"""
-    # 先鎖住乘客列，避免併發
     try:
-        p = (PassengerRequest.objects.using(DB_ALIAS)
-             .select_for_update()
-             .get(id=pax_id))
+        p = PassengerRequest.objects.using(DB_ALIAS).get(id=pax_id)
     except PassengerRequest.DoesNotExist:
         return JsonResponse({"ok": False, "error": "Passenger not found"}, status=404)
-    d = None
-    if p.driver_id:
-        # 讀取司機（若有綁）
-        d = (DriverTrip.objects.using(DB_ALIAS)
-             .select_for_update()
-             .filter(id=p.driver_id)
-             .first())
 
     # 授權檢查（若有司機才需要）
+    d = (DriverTrip.objects.using(DB_ALIAS).only("id", "password").filter(id=p.driver_id).first()
+         if p.driver_id else None)
     if d and not _driver_authed(request, d):
         return JsonResponse({"ok": False, "error": "FORBIDDEN"}, status=403)
 
-    # 若乘客已被接受，釋放座位
-    if p.is_matched and d:
-        d.seats_filled = max(0, d.seats_filled - p.seats_needed)
+    with seat_transaction(DB_ALIAS):
+        # ✅ 只刪除這位乘客；條件跟剛剛讀到的一樣，同時有兩個請求時只有一個刪得到、只歸還一次座位
+        deleted, _ = PassengerRequest.objects.using(DB_ALIAS).filter(
+            id=pax_id, driver_id=p.driver_id, is_matched=p.is_matched).delete()
+        # 若乘客已被接受，釋放座位
+        if deleted and p.is_matched and d:
+            release_seats(d.id, p.seats_needed, DB_ALIAS)
+        # 空出位子（或待確認少一位）：同一個交易裡遞補候補
+        if deleted and d:
+            promote_waitlist(d.id, DB_ALIAS)
+
+    # 交易提交後再廣播（背景佇列），避免 race 也不拖慢回應
+    # 有司機：首頁卡片 + 管理頁兩個 UL；沒有司機（散客）：乘客列表要更新才能消失
+    touch(drivers=[p.driver_id], passengers=[pax_id], panels=[p.driver_id])
 
-        #（可選）若座位釋放後不滿了、且你想自動重新上架：
-        if d.seats_filled < d.seats_total and d.is_active is False:
-            d.is_active = True
+    return JsonResponse({"ok": True})
 
-        d.save(using=DB_ALIAS, update_fields=["seats_filled"])  # 若上面有改 is_active 記得加進 update_fields
+BULK_DECIDE_MAX = 200
 
-    # ✅ 只刪除這位乘客
-    p.delete(using=DB_ALIAS)
-    
-    # 交易提交後再廣播，避免 race
-    def _after_commit():
-        if d:
-            broadcast_driver_card(d.id)        # 單卡（首頁）
-            broadcast_manage_panels(d.id)      # 管理頁兩個 UL
-        else:
-            # 沒有司機（散客）：乘客列表要更新才能消失
-            broadcast_full_update()
 
-    transaction.on_commit(_after_commit)
+def _id_list(request, body, key) -> list[int]:
+    raw = body.get(key) if body else (request.POST.getlist(key) or request.POST.getlist(f"{key}[]"))
+    if not isinstance(raw, list):
+        raw = [raw] if raw not in (None, "") else []
+    out = []
+    for v in raw:
+        try:
+            out.append(int(v))
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+@require_POST
+@collect_changes
+def driver_pax_bulk(request, driver_id: int):
+    """
+    司機一次接受 / 拒絕多位乘客（seats.decide_passengers）。
+    表單 accept_ids / reject_ids，或 JSON {"accept_ids": [...], "reject_ids": [...]}；
+    回傳每位乘客的結果，首頁卡片 + 管理頁只廣播一次。
+    """
+    d = get_object_or_404(DriverTrip.objects.using(DB_ALIAS).only("id", "password"), id=driver_id)
+    if not _driver_authed(request, d):
+        return JsonResponse({"ok": False, "error": "FORBIDDEN"}, status=403)
+
+    body = _json_body(request) if request.content_type.startswith("application/json") else None
+    accept_ids = _id_list(request, body, "accept_ids")
+    reject_ids = _id_list(request, body, "reject_ids")
+    if len(accept_ids) + len(reject_ids) > BULK_DECIDE_MAX:
+        return JsonResponse({"ok": False, "error": "TOO_MANY", "max": BULK_DECIDE_MAX}, status=400)
+
+    with seat_transaction(DB_ALIAS):
+        results = decide_passengers(d.id, accept=accept_ids, reject=reject_ids, using=DB_ALIAS)
+        if SEATS_REJECTED in results.values():
+            promote_waitlist(d.id, DB_ALIAS)
+    full = deactivate_if_full(d.id, DB_ALIAS)
+    remaining = seats_left(d.id, DB_ALIAS)
+
+    touch(drivers=[d.id], passengers=list(results), panels=[d.id])
+    return JsonResponse({
+        "ok": True,
+        "results": {str(pid): outcome for pid, outcome in results.items()},
+        "remaining": max(0, remaining),
+        "deactivated": full,
+    })
+
 
 @require_POST
+@collect_changes
 def pax_memo(request, pax_id: int):
     # 1) 取乘客 + 所屬 driver
     p = get_object_or_404(
@@ -400,28 +249,15 @@ def pax_memo(request, pax_id: int):
         "memo": p.driver_memo # 也回傳 memo 方便前端直接更新 data-current
     }
 
-    # 5) 廣播到管理頁（讓 driver_manage 即時替換該卡片）
-    try:
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"manage_driver_{d.id}",
-            {"type": "manage.pax", "payload": payload},
-        )
-    except Exception:
-        pass
-
-    # 6) 同步刷新公開列表的司機卡（你現有的）
-    try:
-        broadcast_driver_card(d.id)
-        broadcast_manage_panels(p.driver_id)
-    except Exception:
-        pass
+    # 5) 管理頁（其他分頁）+ 公開列表的司機卡：request 結束後合併送出
+    touch(drivers=[d.id], panels=[d.id])
 
     # 7) 回傳 payload，讓本頁直接就地替換
     return JsonResponse(payload)
 
 
 @require_POST
+@collect_changes
 def driver_toggle_privacy(request, driver_id:int):
     d = get_object_or_404(DriverTrip.objects.using("find_db"), id=driver_id)
     hide = (request.POST.get("hide") or "").lower() in ("1","true","yes","on")
@@ -438,10 +274,7 @@ def driver_toggle_privacy(request, driver_id:int):
     except ValidationError as e:
         return JsonResponse({"ok": False, "error": "; ".join(sum(e.message_dict.values(), []))}, status=400)
     d.save(using="find_db")
-    try:
-        broadcast_driver_card(driver_id)
-    except Exception:
-        pass
+    touch(drivers=[driver_id])
     return JsonResponse({
         "ok": True,
         "hide": d.hide_contact,
@@ -449,6 +282,7 @@ def driver_toggle_privacy(request, driver_id:int):
     })
 
 @require_POST
+@collect_changes
 def pax_toggle_privacy(request, pax_id:int):
     p = get_object_or_404(PassengerRequest.objects.using("find_db"), id=pax_id)
     hide = (request.POST.get("hide") or "").lower() in ("1","true","yes","on")
@@ -460,16 +294,13 @@ def pax_toggle_privacy(request, pax_id:int):
     except ValidationError as e:
         return JsonResponse({"ok": False, "error": "; ".join(sum(e.message_dict.values(), []))}, status=400)
     p.save(using="find_db")
-    # 你若有 WS 廣播可選擇通知
-    try:
-        if p.driver_id:
-            broadcast_driver_card(p.driver_id)
-    except Exception:
-        pass
+    # 所屬司機卡片 / 散客列表上的聯絡方式要跟著遮住
+    touch(drivers=[p.driver_id], passengers=[p.id], panels=[p.driver_id])
     return JsonResponse({"ok": True, "hide": p.hide_contact})
 
 
 @require_POST
+@collect_changes
 def driver_pax_memo(request, driver_id:int, pax_id:int):
     p = get_object_or_404(
         PassengerRequest.objects.using("find_db"),
@@ -480,11 +311,8 @@ def driver_pax_memo(request, driver_id:int, pax_id:int):
     p.full_clean()  # 保險
     p.save(using="find_db")
 
-    # 局部重繪該司機卡片（如果你已有）
-    try:
-        broadcast_driver_card(driver_id)
-    except Exception:
-        pass
+    # 局部重繪該司機卡片 + 管理頁
+    touch(drivers=[driver_id], panels=[driver_id])
 
     return JsonResponse({"ok": True})
 
@@ -579,6 +407,7 @@ def passenger_json(request, pid: int):
     return JsonResponse({"ok": True, "data": data})
 
 @require_POST
+@collect_changes
 @transaction.atomic(using=DB_ALIAS)
 def pax_update(request, pid: int):
     """更新乘客資料（需要先通過 pax_auth）。"""
@@ -660,23 +489,14 @@ def pax_update(request, pid: int):
     # 寫入
     p.save(using=DB_ALIAS)
 
-    # ---- 即時更新：在交易提交後廣播 ----
-    driver_id = p.driver_id
-
-    def _after_commit(d_id=driver_id):
-        if d_id:
-            # 更新：司機卡片（首頁/清單）＋ 司機管理頁（左右兩欄）
-            broadcast_driver_card(d_id)
-            broadcast_manage_panels(d_id)
-        else:
-            # 沒綁司機：更新乘客列表（你的既有函式）
-            _broadcast_lists()
-
-    transaction.on_commit(_after_commit)
+    # ---- 即時更新：在交易提交後交給背景佇列廣播 ----
+    # 有綁司機：司機卡片（首頁/清單）＋ 司機管理頁（左右兩欄）；沒綁司機：乘客列表
+    touch(drivers=[p.driver_id], passengers=[p.id], panels=[p.driver_id])
 
     return JsonResponse({"ok": True})
 
 @require_POST
+@collect_changes
 def pax_delete(request, pid: int):
     """
     刪除乘客紀錄（需先授權）：
@@ -686,27 +506,22 @@ def pax_delete(request, pid: int):
     if not _pax_authorized(request, pid):
         return JsonResponse({"ok": False, "error": "未授權"}, status=403)
 
-    # 若是已接受的乘客，回沖座位
-    if p.is_matched and p.driver_id:
-        try:
-            d = DriverTrip.objects.using("find_db").select_for_update().get(id=p.driver_id)
-            d.seats_filled = max(0, d.seats_filled - (p.seats_needed or 0))
-            # 回沖後座位未滿，可自動重新上架（看你需求；不想自動上架就註解掉）
-            if d.seats_filled < d.seats_total:
-                d.is_active = True
-            d.save(using="find_db")
-        except DriverTrip.DoesNotExist:
-            pass
-
-    p.delete(using="find_db")
     driver_id = p.driver_id  # 廣播用
-    transaction.on_commit(lambda: broadcast_driver_card(driver_id))
-    if driver_id:
-        broadcast_driver_card(driver_id)
-    
+    with seat_transaction("find_db"):
+        deleted, _ = PassengerRequest.objects.using("find_db").filter(
+            id=pid, driver_id=driver_id, is_matched=p.is_matched).delete()
+        # 若是已接受的乘客，回沖座位；回沖後座位未滿，可自動重新上架（看你需求；不想自動上架就拿掉）
+        if deleted and p.is_matched and driver_id:
+            release_seats(driver_id, p.seats_needed or 0, "find_db")
+            reactivate_if_open(driver_id, "find_db")
+        if deleted and driver_id:
+            promote_waitlist(driver_id, "find_db")
+    touch(drivers=[driver_id], passengers=[pid], panels=[driver_id])
+
     return JsonResponse({"ok": True})
 
 
+@collect_changes
 @transaction.atomic(using="find_db")
 def delete_driver(request, driver_id: int):
     if request.method != "POST":
@@ -727,6 +542,7 @@ def delete_driver(request, driver_id: int):
     PassengerRequest.objects.using("find_db").filter(driver_id=driver_id).delete()
     # 硬刪除
     d.delete(using="find_db")
+    touch(drivers=[driver_id])
 
     # ✅ 讓所有人同步到最新清單（這是「交易外」或「交易完成後」也 OK）
     if delete_event:
@@ -778,7 +594,16 @@ def driver_manage_auth(request, driver_id: int):
 
     
 
+# driver_manage「更新司機資訊」會改的欄位；seats_filled 只由 seats.py 的條件式 UPDATE / 帳本寫
+DRIVER_EDIT_FIELDS = (
+    "driver_name", "gender", "email", "contact", "note", "password", "hide_contact", "auto_email_contact",
+    "seats_total", "fare_note", "departure", "destination", "date", "return_date", "flexible_pickup",
+    "is_active",
+)
+
+
 @ensure_csrf_cookie
+@collect_changes
 def driver_manage(request, driver_id: int):
     # 1) 先抓 driver
     driver = get_object_or_404(DriverTrip.objects.using(DB_ALIAS), id=driver_id)
@@ -804,13 +629,7 @@ def driver_manage(request, driver_id: int):
     # 3) 初次進頁先準備列表
     pending_qs  = PassengerRequest.objects.using(DB_ALIAS).filter(driver=driver, is_matched=False).order_by("id")
     accepted_qs = PassengerRequest.objects.using(DB_ALIAS).filter(driver=driver, is_matched=True ).order_by("id")
-    candidates_qs = PassengerRequest.objects.using(DB_ALIAS).filter(
-        departure=driver.departure,
-        destination=driver.destination,
-        date=driver.date,
-        is_matched=False,
-        driver__isnull=True,
-    ).order_by("id")
+    candidates_qs = passengers_on_route(driver, using=DB_ALIAS)
 
     saved_msg = matched_msg = full_msg = ""
 
@@ -867,9 +686,8 @@ def driver_manage(request, driver_id: int):
                 seats_total = int(request.POST.get("seats_total") or driver.seats_total)
             except (TypeError, ValueError):
                 seats_total = driver.seats_total
+            old_total = driver.seats_total
             driver.seats_total = max(1, seats_total)
-            if driver.seats_filled > driver.seats_total:
-                driver.seats_filled = driver.seats_total
 
             # 酌收費用（選填）
             if hasattr(driver, "fare_note"):
@@ -936,57 +754,41 @@ def driver_manage(request, driver_id: int):
             # 其他旗標
             driver.flexible_pickup = (request.POST.get("flexible_pickup") or getattr(driver, "flexible_pickup", "MAYBE")).strip() or "MAYBE"
             driver.is_active       = (request.POST.get("is_active") == "on")
-            if driver.seats_filled >= driver.seats_total:
-                driver.is_active = False
 
-            driver.save(using=DB_ALIAS)
+            with seat_transaction(DB_ALIAS):
+                # 座位改少：條件式 UPDATE 截斷（要在 save 之前，帳本先寫回再截斷）
+                if driver.seats_total < old_total:
+                    clamp_seats(driver.id, driver.seats_total, DB_ALIAS)
+                # seats_filled 不寫回：driver 是這個 request 一開始讀的，這段期間別的請求可能扣過座位
+                driver.save(using=DB_ALIAS, update_fields=DRIVER_EDIT_FIELDS)
+                # 滿了就下架（看資料庫 / 帳本目前的座位，不看 driver 上的舊值）
+                deactivate_if_full(driver.id, DB_ALIAS)
+                # 加了座位：同一個交易裡遞補候補（waitlist.py）
+                if driver.seats_total > old_total:
+                    promote_waitlist(driver.id, DB_ALIAS)
             saved_msg = "✅ 已更新司機資料"
 
             # 廣播（卡片 + 管理頁）
-            transaction.on_commit(lambda: (
-                broadcast_driver_card(driver.id),
-                broadcast_manage_panels(driver.id)
-            ))
+            touch(drivers=[driver.id], panels=[driver.id])
 
         # === B) 批次接受乘客 ===
         elif form_type == "accept_passengers":
             if not authed:
                 return HttpResponseForbidden("FORBIDDEN")
 
-            ids = request.POST.getlist("accept_ids")
-            accepted_names = []
-
-            with transaction.atomic(using=DB_ALIAS):
-                d = DriverTrip.objects.using(DB_ALIAS).select_for_update().get(id=driver.id)
-
-                for pid in ids:
-                    try:
-                        p = PassengerRequest.objects.using(DB_ALIAS).select_for_update().get(id=pid, is_matched=False)
-                    except PassengerRequest.DoesNotExist:
-                        continue
-
-                    if p.driver_id is None:
-                        p.driver = d
-
-                    if d.seats_filled + p.seats_needed <= d.seats_total:
-                        d.seats_filled += p.seats_needed
-                        p.is_matched = True
-                        p.save(using=DB_ALIAS)
-                        accepted_names.append(p.passenger_name)
+            ids = _id_list(request, None, "accept_ids")
 
-                        if d.seats_filled >= d.seats_total:
-                            d.is_active = False
-                            d.save(using=DB_ALIAS)
-                            full_msg = f"🚗 {d.driver_name} 的行程已滿，已自動下架"
-                            break
-
-                d.save(using=DB_ALIAS)
+            # 一次鎖住、一次寫回（seats.decide_passengers）；座位不夠的略過
+            results = decide_passengers(driver.id, accept=ids, using=DB_ALIAS)
+            accepted_ids = [pid for pid in ids if results.get(pid) == SEATS_ACCEPTED]
+            if deactivate_if_full(driver.id, DB_ALIAS):
+                full_msg = f"🚗 {driver.driver_name} 的行程已滿，已自動下架"
 
+            names = dict(PassengerRequest.objects.using(DB_ALIAS)
+                         .filter(id__in=accepted_ids).values_list("id", "passenger_name"))
+            accepted_names = [names[pid] for pid in accepted_ids if pid in names]
             matched_msg = "✅ 已成功媒合：" + "、".join(accepted_names) if accepted_names else "⚠️ 沒有可媒合的乘客或座位不足"
-            transaction.on_commit(lambda: (
-                broadcast_driver_card(driver.id),
-                broadcast_manage_panels(driver.id)
-            ))
+            touch(drivers=[driver.id], passengers=accepted_ids, panels=[driver.id])
 
         # …(其他分支照你的需求)
 
@@ -994,13 +796,7 @@ def driver_manage(request, driver_id: int):
         driver.refresh_from_db(using=DB_ALIAS)
         pending_qs  = PassengerRequest.objects.using(DB_ALIAS).filter(driver=driver, is_matched=False).order_by("id")
         accepted_qs = PassengerRequest.objects.using(DB_ALIAS).filter(driver=driver, is_matched=True ).order_by("id")
-        candidates_qs = PassengerRequest.objects.using(DB_ALIAS).filter(
-            departure=driver.departure,
-            destination=driver.destination,
-            date=driver.date,
-            is_matched=False,
-            driver__isnull=True,
-        ).order_by("id")
+        candidates_qs = passengers_on_route(driver, using=DB_ALIAS)
 
     # 最後渲染
     return render(request, "Find/driver_manage.html", {
@@ -1017,13 +813,10 @@ def driver_manage(request, driver_id: int):
 # 首頁
 # -------------------
 # ---- imports）----
-import re
-from django.db import connection
 from django.db.models import (
-    Case, When, Value, IntegerField, ExpressionWrapper, F, Prefetch, Q, Count,
-    Func, Value as V, CharField
+    Value, IntegerField, ExpressionWrapper, F, Prefetch, Q,
+    Value as V, CharField
 )
-from django.db.models.functions import Cast, NullIf, Trim, Replace
 
 # 若有 Postgres，可用正規式替換；沒有就保持 None
 try:
@@ -1040,42 +833,9 @@ CITY_N2S = [
     "澎湖縣","金門縣","連江縣",
 ]
 
-def fare_text_to_int(field_name: str = "fare_note"):
-    vendor = connection.vendor  # 'postgresql' | 'mysql' | 'sqlite' | 'oracle'...
-
-    if vendor == "postgresql" and PGRegexpReplace is not None:
-        cleaned = PGRegexpReplace(F(field_name), r"[^0-9]+", Value(""))
-    elif vendor == "mysql":
-        cleaned = Func(F(field_name), Value(r"[^0-9]+"), Value(""), function="REGEXP_REPLACE")
-    else:
-        cleaned = Replace(
-            Replace(
-                Replace(
-                    Replace(
-                        Replace(
-                            Replace(
-                                Replace(Trim(F(field_name)), Value("NT$"), Value("")),
-                                Value("NTD"), Value(""),
-                            ),
-                            Value("NT"), Value(""),
-                        ),
-                        Value("$"), Value(""),
-                    ),
-                    Value("元"), Value(""),
-                ),
-                Value(","), Value(""),
-            ),
-            Value(" "), Value(""),
-        )
-    numeric_or_empty = NullIf(cleaned, Value(""))
-    as_int = Cast(numeric_or_empty, IntegerField())
-    return as_int
-
-def _city_rank_case(field: str = "departure") -> Case:
-    # 包含 icontains 規則，較彈性（地名是句子的一部分也吃得到）
-    whens = [When(**{f"{field}__icontains": name}, then=Value(idx+1))
-             for idx, name in enumerate(CITY_N2S)]
-    return Case(*whens, default=Value(999), output_field=IntegerField())
+def _location_rank(field: str = "departure_loc"):
+    # 地理順序在存檔時就對應好（Location.rank）；還沒對應到地點的當成最後（同 UNKNOWN_RANK）
+    return Coalesce(F(f"{field}__rank"), Value(UNKNOWN_RANK))
 
 def get_order_by(sort: str | None) -> list[str] | None:
     """
@@ -1098,10 +858,6 @@ def get_order_by(sort: str | None) -> list[str] | None:
 
 
 
-# 兼容舊名稱（如果其他地方有用到）
-def _dep_rank_case():
-    return _city_rank_case("departure")
-
 def _getlist_qs(request, key: str) -> list[str]:
     """GET 支援單值或多選（?key=a&key=b 或 ?key[]=a&key[]=b）。"""
     vals = request.GET.getlist(key) or request.GET.getlist(f"{key}[]")
@@ -1117,18 +873,9 @@ def _parse_int(val, default=None):
 def create_driver(request):
     # ... validate & save
     driver = DriverTrip.objects.using("find_db").create(...)
-    broadcast_driver_card(driver.id)  # or broadcast_full_lists()
+    touch(drivers=[driver.id])
     return redirect("find_index")
 
-FREE_WORDS = ["免費", "免", "待定", "未定", "面議", "不收", "不收費", "free", "Free", "FREE", "0"]
-def _free_note_q(field="fare_note"):
-    """fare_note 為空/NULL 或包含免費/待定等關鍵字"""
-    q = Q(**{f"{field}__isnull": True}) | Q(**{f"{field}": ""})
-    for w in FREE_WORDS:
-        q |= Q(**{f"{field}__icontains": w})
-    return q
-
-
 
 def driver_cards_qs(
     *,
@@ -1136,12 +883,20 @@ def driver_cards_qs(
     order_by: list[str] | None = None,
     sort: str | None = None,
     filters: dict | None = None,
+    after: list | None = None,
+    until: list | None = None,
+    only_card_fields: bool = False,
 ):
     """
     回傳已帶好 passengers 的 DriverTrip QuerySet：
       - d.pending_list：未媒合乘客
       - d.accepted_list：已媒合乘客
 
+    after / until：keyset 分頁的 key（pagination.decode_cursor 解出來的）
+      只取排在 after 之後、until 之前（含）的卡片，並改用 pagination.KEYSET 排序
+    only_card_fields：只讀 _driver_card.html 用得到的欄位（cards.py），給清單渲染用；
+      要算訂閱比對欄位（subscriptions.driver_match_fields）的地方不能用
+
     filters 支援：
       dep_in, des_in, date_in, ret_in, gender_in (list)
       need_seats (int)
@@ -1168,8 +923,9 @@ def driver_cards_qs(
     fare_q     = (f.get("fare_q") or "").strip()
     qkw        = (f.get("q") or "").strip()
 
-    if dep_in:    qs = qs.filter(departure__in=dep_in)
-    if des_in:    qs = qs.filter(destination__in=des_in)
+    # 地點：名稱（標準名稱或 alias）先換成 Location id，再走 FK 索引
+    if dep_in:    qs = qs.filter(departure_loc__in=location_ids(dep_in, DB_ALIAS))
+    if des_in:    qs = qs.filter(destination_loc__in=location_ids(des_in, DB_ALIAS))
     if date_in:   qs = qs.filter(date__in=date_in)
     if ret_in:    qs = qs.filter(return_date__in=ret_in)
     if gender_in: qs = qs.filter(gender__in=gender_in)
@@ -1192,41 +948,13 @@ def driver_cards_qs(
         qs = qs.annotate(
             available=ExpressionWrapper(F("seats_total") - F("seats_filled"), output_field=IntegerField())
         )
-    # 酌收費用（若你有 fare_amount 直接用；否則退回文字排序）
-    has_fare_amount = hasattr(DriverTrip, "fare_amount")
-    has_fare_amount_field = hasattr(DriverTrip, "fare_amount")
-    need_fare_sort = sort in ("fare_desc", "fare_asc")
-    if need_fare_sort:
-        if has_fare_amount_field:
-            fare_value_field = F("fare_amount")
-        else:
-            # 你已有的輔助：把文字金額轉 int，沒有就 None
-            qs = qs.annotate(fare_num_annot=fare_text_to_int("fare_note"))
-            fare_value_field = F("fare_num_annot")
-
-        # 定義「免費/待定/待議/AA/未定」的判斷
-        free_q = (
-            Q(fare_note__iregex=r"(免費|待定|待議|AA|未定)")
-            | Q(fare_note__isnull=True)
-            | Q(fare_note__exact="")
-            | Q(fare_amount__isnull=True) if has_fare_amount_field else Q(fare_num_annot__isnull=True)
-        )
-
-        # 依方向給 rank：asc 要把免費放最前；desc 放最後
-        if sort == "fare_asc":
-            # 免費=0，數字=1
-            qs = qs.annotate(
-                fare_rank=Case(When(free_q, then=Value(0)), default=Value(1), output_field=IntegerField())
-            )
-            # 免費群排最前，再依數字由低到高
-            qs = qs.order_by("fare_rank", fare_value_field.asc(nulls_last=True), "id")
-        else:
-            # 數字=0，免費=1（排最後）
-            qs = qs.annotate(
-                fare_rank=Case(When(free_q, then=Value(1)), default=Value(0), output_field=IntegerField())
-            )
-            # 先數字群由高到低，再免費群
-            qs = qs.order_by("fare_rank", fare_value_field.desc(nulls_last=True), "id")
+    # 酌收費用：fare_amount / fare_is_free 在存檔時就算好了（models.parse_fare_note），直接比較欄位
+    if sort == "fare_asc":
+        # 免費群排最前，再依金額由低到高（沒有金額的排最後）
+        qs = qs.order_by("-fare_is_free", F("fare_amount").asc(nulls_last=True), "id")
+    elif sort == "fare_desc":
+        # 先數字群由高到低，免費群排最後
+        qs = qs.order_by("fare_is_free", F("fare_amount").desc(nulls_last=True), "id")
     # ------------ 決定排序（其餘項目）------------
     elif order_by:
         qs = qs.order_by(*order_by)
@@ -1238,9 +966,9 @@ def driver_cards_qs(
             qs = qs.order_by("-date", "-id")
 
         elif sort == "dep_n2s":
-            qs = qs.annotate(dep_rank=_city_rank_case("departure")).order_by("dep_rank", "date", "id")
+            qs = qs.annotate(dep_rank=_location_rank("departure_loc")).order_by("dep_rank", "date", "id")
         elif sort == "dep_s2n":
-            qs = qs.annotate(dep_rank=_city_rank_case("departure")).order_by("-dep_rank", "date", "id")
+            qs = qs.annotate(dep_rank=_location_rank("departure_loc")).order_by("-dep_rank", "date", "id")
 
         elif sort == "seats_asc":
             # 少→多：available 由小到大
@@ -1252,78 +980,89 @@ def driver_cards_qs(
         else:
             qs = qs.order_by("-date", "-id")
 
-
-    # 有數字欄位：直接用數字，同時做一個「是否免費/待定」旗標，排序/篩選會用到
-    if has_fare_amount:
-        qs = qs.annotate(
-            fare_num  = Coalesce(F("fare_amount"), Value(0)),
-            fare_free = Case(
-                When(_free_note_q("fare_note"), then=Value(1)),  # 1=免費/待定
-                default=Value(0),
-                output_field=IntegerField(),
-            ),
-        )
-    else:
-        # 沒數字欄位：用文字排序備援，另外一樣標 free 旗標
-        qs = qs.annotate(
-            fare_text = Coalesce(F("fare_note"), Value("")),
-            fare_free = Case(
-                When(_free_note_q("fare_note"), then=Value(1)),
-                default=Value(0),
-                output_field=IntegerField(),
-            ),
-        )
-
     # ---------- 金額門檻過濾 ----------
     # 要求：當 mode == 'lte' (小於等於) 時，免費/待定也要被包含
     if fare_num is not None and (fare_mode in ("lte", "gte")):
-        if has_fare_amount:
-            # 數字比較
-            base = Q(**{f"fare_num__{fare_mode}": int(fare_num)})
-            # <= 門檻時把免費/待定也算進來
-            if fare_mode == "lte":
-                base |= Q(fare_free=1)
-            qs = qs.filter(base)
-        else:
-            # 沒有 fare_amount 無法做數字比較：
-            # 只在 <= 時把免費/待定納入（>= 對純文字沒意義，忽略）
-            if fare_mode == "lte":
-                qs = qs.filter(_free_note_q("fare_note"))
+        base = Q(**{f"fare_amount__{fare_mode}": int(fare_num)})
+        if fare_mode == "lte":
+            base |= Q(fare_is_free=True)
+        qs = qs.filter(base)
 
     # 關鍵字（例如「免費」「AA」）
     if fare_q and hasattr(DriverTrip, "fare_note"):
         qs = qs.filter(fare_note__icontains=fare_q)
 
-    # 整卡片關鍵字搜尋（多詞 AND）
+    # 整卡片關鍵字搜尋（多詞 AND；走 n-gram 索引，見 search.py）
     if qkw:
-        terms = [t for t in re.split(r"\s+", qkw) if t]
-        for t in terms:
-            qs = qs.filter(
-                Q(driver_name__icontains=t) |
-                Q(contact__icontains=t) |
-                Q(email__icontains=t) |
-                Q(departure__icontains=t) |
-                Q(destination__icontains=t) |
-                Q(note__icontains=t) |
-                Q(fare_note__icontains=t) |
-                Q(flexible_pickup__icontains=t) |
-                Q(passengers__passenger_name__icontains=t) |
-                Q(passengers__note__icontains=t)
-            )
-        # 若是 YYYY-MM-DD 也比對日期等於
-        if len(qkw) <= 10 and re.fullmatch(r"\d{4}-\d{2}-\d{2}", qkw):
-            qs = qs.filter(Q(date=qkw) | Q(return_date=qkw)) | qs
-        qs = qs.distinct()
+        qs = qs.filter(search_q(qkw))
+
+    # 3) keyset 分頁（cursor 之後 / 前端已載入的範圍之內）
+    if after is not None or until is not None:
+        sort = normalize_sort(sort)
+        qs = keyset_queryset(qs, sort)
+        if after is not None:
+            qs = qs.filter(after_q(sort, after))
+        if until is not None:
+            qs = qs.exclude(after_q(sort, until))
 
     # 4) 預抓乘客：pending_list / accepted_list
     pending_qs  = PassengerRequest.objects.using(DB_ALIAS).filter(is_matched=False).order_by("-id")
     accepted_qs = PassengerRequest.objects.using(DB_ALIAS).filter(is_matched=True ).order_by("-id")
+    if only_card_fields:
+        qs = project_drivers(qs)
+        pending_qs, accepted_qs = project_passengers(pending_qs), project_passengers(accepted_qs)
+    else:
+        qs = qs.select_related("departure_loc")   # driver_match_fields 的 departure_rank
 
     return qs.prefetch_related(
         Prefetch("passengers", queryset=pending_qs,  to_attr="pending_list"),
         Prefetch("passengers", queryset=accepted_qs, to_attr="accepted_list"),
     )
 
+def driver_cards_page(*, sort: str | None = None, filters: dict | None = None,
+                      after: list | None = None, limit: int | None = None, only_card_fields: bool = False):
+    """
+    一頁司機卡片：回傳 (drivers, next_cursor)；next_cursor 為 None 表示已經是最後一頁。
+    多查一筆來判斷後面還有沒有。
+    """
+    sort = normalize_sort(sort)
+    limit = limit or settings.FIND_PAGE_SIZE
+    qs = keyset_queryset(driver_cards_qs(only_active=True, sort=sort, filters=filters, after=after,
+                                         only_card_fields=only_card_fields), sort)
+    drivers = list(qs[:limit + 1])
+    if len(drivers) <= limit:
+        return drivers, None
+    drivers = drivers[:limit]
+    return drivers, encode_cursor(sort, row_key(drivers[-1], sort))
+
+
+def driver_card_page(*, sort: str | None = None, filters: dict | None = None,
+                     after: list | None = None, limit: int | None = None) -> CardPage:
+    """driver_cards_page + 渲染好的卡片 HTML，結果依資料版本快取（pagecache.py）"""
+    sort = normalize_sort(sort)
+    limit = limit or settings.FIND_PAGE_SIZE
+
+    def build():
+        drivers, next_cursor = driver_cards_page(sort=sort, filters=filters, after=after, limit=limit,
+                                                 only_card_fields=True)
+        html = "".join(render_to_string("Find/_driver_card.html", {"d": d}) for d in drivers)
+        return CardPage(tuple(d.id for d in drivers), mark_safe(html), next_cursor)
+
+    key = (sort, filters_key(filters), tuple(after) if after is not None else None, limit)
+    return page_cache.get_or_build(key, build)
+
+
+def get_date_choices(filters: dict | None = None):
+    """日期多選的選項（目前篩選結果的所有出發 / 回程日期，不受分頁影響）"""
+    if not any(v not in (None, "", []) for v in (filters or {}).values()):
+        # 沒有篩選：直接用 facet 計數
+        return date_facets("date", DB_ALIAS), date_facets("ret", DB_ALIAS)
+    base = driver_cards_qs(only_active=True, filters=filters).order_by()
+    dates = base.values_list("date", flat=True).distinct()
+    rets = base.filter(return_date__isnull=False).values_list("return_date", flat=True).distinct()
+    return sorted(d.isoformat() for d in dates), sorted(d.isoformat() for d in rets)
+
+
 def _extract_filters_from_request(request):
     # 你現成的那支即可；這裡保留常見 keys
     q = request.GET.get("q", "").strip()
@@ -1352,31 +1091,12 @@ def _extract_filters_from_request(request):
 
 def get_active_location_choices():
     """
-    只統計「上架中的司機」的出發地/目的地清單與數量。
-    以地理順序（_city_rank_case）排序，再以字母作次序。
+    只統計「上架中的司機」的出發地/目的地清單與數量（依 Location 合併：自填的地點算在最接近的城市）。
+    以地理順序（Location.rank）排序，再以名稱作次序。計數由 facets.py 維護，不用每次 GROUP BY 司機表。
     回傳：(DEP_CHOICES, DES_CHOICES, DEP_WITH_COUNT, DES_WITH_COUNT)
     """
-    base = DriverTrip.objects.using("find_db").filter(is_active=True)
-
-    dep_ct = (
-        base.exclude(departure__isnull=True)
-            .exclude(departure__exact="")
-            .values("departure")
-            .annotate(n=Count("id"))
-            .annotate(rank=_city_rank_case("departure"))
-            .order_by("rank", "departure")
-    )
-    des_ct = (
-        base.exclude(destination__isnull=True)
-            .exclude(destination__exact="")
-            .values("destination")
-            .annotate(n=Count("id"))
-            .annotate(rank=_city_rank_case("destination"))
-            .order_by("rank", "destination")
-    )
-
-    DEP_WITH_COUNT = [(row["departure"], row["n"])   for row in dep_ct]
-    DES_WITH_COUNT = [(row["destination"], row["n"]) for row in des_ct]
+    DEP_WITH_COUNT = location_facets("dep", DB_ALIAS)
+    DES_WITH_COUNT = location_facets("des", DB_ALIAS)
 
     DEP_CHOICES = [name for name, _ in DEP_WITH_COUNT]
     DES_CHOICES = [name for name, _ in DES_WITH_COUNT]
@@ -1386,61 +1106,36 @@ def get_active_location_choices():
 
 # === view ===
 def index(request):
-    sort = request.GET.get("sort", "date_desc")
-    order_by = get_order_by(sort)
+    sort = normalize_sort(request.GET.get("sort"))
 
     # 組 filters
     filters = _extract_filters_from_request(request)
 
-    # 司機卡片（已 prefetch pending_list / accepted_list）
-    drivers = driver_cards_qs(
-        only_active=True,
-        order_by=order_by,
-        sort=sort,
-        filters=filters,
-    )
+    # 司機卡片只渲染第一頁（依資料版本快取）；往下捲再打 driver_page
+    page = driver_card_page(sort=sort, filters=filters)
+    next_cursor = page.next
 
-    # 供日期多選用的選項（純字串）
-    DATE_CHOICES = sorted({ d.date.isoformat() for d in drivers if getattr(d, "date", None) })
-    RET_CHOICES  = sorted({ d.return_date.isoformat() for d in drivers if getattr(d, "return_date", None) })
+    # 供日期多選用的選項（純字串）：整個篩選結果，不是只有第一頁
+    DATE_CHOICES, RET_CHOICES = get_date_choices(filters)
 
     # 乘客（左上角區塊）
     passengers = (
         PassengerRequest.objects.using("find_db")
-        .filter(is_matched=False, driver__isnull=True)
+        .filter(is_matched=False, driver__isnull=True, is_waitlisted=False)
         .order_by("-id")
     )
 
     # 出發地/目的地（多選來源）＋數量（用地理排序）
-    base = DriverTrip.objects.using("find_db").filter(is_active=True)
-
-    dep_ct = (
-        base.exclude(departure__isnull=True).exclude(departure__exact="")
-            .values("departure")
-            .annotate(n=Count("id"))
-            .annotate(rank=_city_rank_case("departure"))
-            .order_by("rank", "departure")
-    )
-    des_ct = (
-        base.exclude(destination__isnull=True).exclude(destination__exact="")
-            .values("destination")
-            .annotate(n=Count("id"))
-            .annotate(rank=_city_rank_case("destination"))
-            .order_by("rank", "destination")
-    )
-
-    DEP_WITH_COUNT = [(row["departure"], row["n"])   for row in dep_ct]
-    DES_WITH_COUNT = [(row["destination"], row["n"]) for row in des_ct]
-    DEP_CHOICES = [name for name, _ in DEP_WITH_COUNT]
-    DES_CHOICES = [name for name, _ in DES_WITH_COUNT]
+    DEP_CHOICES, DES_CHOICES, DEP_WITH_COUNT, DES_WITH_COUNT = get_active_location_choices()
 
     # ▶▶ 如果是部分請求（AJAX / _partial=1），只回傳司機清單的 HTML
     is_partial = request.GET.get("_partial") == "1" or request.headers.get("x-requested-with") == "XMLHttpRequest"
     if is_partial:
-        drivers_html = render_to_string("Find/_driver_list.html", {"drivers": drivers}, request)
+        drivers_html = render_to_string("Find/_driver_list.html", {"cards_html": page.html}, request)
         return JsonResponse({
             "ok": True,
             "drivers_html": drivers_html,
+            "next": next_cursor,
             # 若你想一起回傳篩選來源（例如「動態數量」），也可以加在這裡
             # "dep_with_count": DEP_WITH_COUNT,
             # "des_with_count": DES_WITH_COUNT,
@@ -1448,13 +1143,14 @@ def index(request):
 
     # ---------- AJAX：回傳 partial（不刷新整頁） ----------
     if request.headers.get("x-requested-with") == "XMLHttpRequest":
-        drivers_html = render_to_string("Find/_driver_list.html", {"drivers": drivers})
+        drivers_html = render_to_string("Find/_driver_list.html", {"cards_html": page.html})
         passengers_html = render_to_string("Find/_passenger_list.html", {"passengers": passengers})
         return JsonResponse({
             "type": "send.update",
             "drivers_html": drivers_html,
             "passengers_html": passengers_html,
             "sort": sort,
+            "next": next_cursor,
         })
 
     # ---------- 首次載入：整頁 render ----------
@@ -1462,9 +1158,10 @@ def index(request):
         request,
         "Find/index.html",
         {
-            "drivers": drivers,
+            "cards_html": page.html,            # 第一頁的卡片（_driver_list.html 直接輸出）
             "passengers": passengers,
             "sort": sort,
+            "next_cursor": next_cursor,         # 下一頁的 cursor（None = 沒有下一頁）
             "filters": filters,                 # 給前端回填與 chips
             "DATE_CHOICES": DATE_CHOICES,
             "RET_CHOICES": RET_CHOICES,
@@ -1476,6 +1173,37 @@ def index(request):
     )
 
 
+def driver_page(request):
+    """
+    無限捲動：GET ?after=<cursor>&sort=...&(跟首頁一樣的篩選參數)
+    回傳 {"ok", "html": 這一頁的 _driver_card.html, "ids", "next": 下一頁的 cursor 或 null}
+    """
+    sort = normalize_sort(request.GET.get("sort"))
+    filters = _extract_filters_from_request(request)
+    cursor = request.GET.get("after") or ""
+    try:
+        after = decode_cursor(cursor, sort) if cursor else None
+    except InvalidCursor as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+
+    page = driver_card_page(sort=sort, filters=filters, after=after)
+    return JsonResponse({
+        "ok": True,
+        "html": page.html,
+        "ids": list(page.ids),
+        "next": page.next,
+    })
+
+
+def driver_facets(request):
+    """
+    篩選面板的 drill-down 計數：GET 參數同首頁（dep / des / date / ret / gender / need_seats / fare_* / q）
+    每個維度的計數都套用「其他維度」的篩選；格式見 facets.drilldown_counts
+    """
+    filters = _extract_filters_from_request(request)
+    return JsonResponse({"ok": True, **drilldown_counts(filters, DB_ALIAS)})
+
+
 # -------------------
 # 找人（乘客需求）
 # -------------------
@@ -1493,13 +1221,9 @@ def find_people(request):
             note=request.POST.get("note", "")
         )
 
-        # 找符合的司機（但不自動媒合）
-        matches = DriverTrip.objects.using("find_db").filter(
-            departure=new_passenger.departure,
-            destination=new_passenger.destination,
-            date=new_passenger.date,
-            is_active=True
-        )
+        # 找符合的司機（但不自動媒合）：同路線 + 順路（routes.py）
+        new_passenger.refresh_from_db(using="find_db", fields=["date"])   # POST 進來的是字串
+        matches = drivers_on_route(new_passenger, using="find_db")
 
         return render(request, "Find/match_driver.html", {
             "passenger": new_passenger,
@@ -1575,7 +1299,7 @@ def find_car(request):
 
         # …通過檢查才寫入 DB
         # DriverTrip.objects.using("find_db").create( ... )
-        broadcast_driver_card(d.id)
+        touch(drivers=[d.id])
         # 若是 AJAX 送出可回 JSON；否則回首頁
         if request.headers.get("x-requested-with") == "XMLHttpRequest":
             return JsonResponse({"ok": True, "id": d.id})
@@ -1637,6 +1361,7 @@ def passenger_manage(request, passenger_id):
 # -------------------
 
 @require_POST
+@collect_changes
 def join_driver(request, driver_id: int):
     is_ajax = (request.headers.get("x-requested-with") == "XMLHttpRequest")
 
@@ -1656,24 +1381,27 @@ def join_driver(request, driver_id: int):
         except Exception:
             willing_to_pay = None
 
-    # ===== 交易 + 鎖行避免搶位 =====
-    with transaction.atomic(using="find_db"):
-        # 鎖住該司機（同時避免被接受時併發超載）
-        d = get_object_or_404(
-            DriverTrip.objects.using("find_db").select_for_update(), id=driver_id
-        )
+    # ===== 不鎖司機列：待確認不佔位，真正扣座位是司機接受時的條件式 UPDATE（seats.py）=====
+    d = get_object_or_404(
+        DriverTrip.objects.using("find_db").only("id", "is_active", "date"),
+        id=driver_id,
+    )
 
-        if not d.is_active:
-            msg = "此行程已下架或已滿"
-            return JsonResponse({"ok": False, "error": msg}, status=400) if is_ajax else redirect("find_index")
+    # 下架的行程不收；只有「坐滿了自動下架」的可以排候補（有人退出就會遞補、重新上架）
+    if not d.is_active and seats_left(d.id, "find_db") > 0:     # 有座位帳本（ledger.py）時看帳本
+        msg = "此行程已下架"
+        if is_ajax:
+            return JsonResponse({"ok": False, "error": msg}, status=400)
+        return redirect(f"{reverse('find_index')}?{urlencode({'error': msg})}")
 
-        remaining = max(0, (d.seats_total or 0) - (d.seats_filled or 0))
-        if seats_needed > remaining:
-            msg = f"座位不足，剩餘 {remaining} 位"
-            return JsonResponse({"ok": False, "error": msg}, status=400) if is_ajax else redirect("find_index")
+    # 可用座位跟遞補（waitlist.promote）同一個算法：扣掉已佔的和待確認的
+    remaining = max(0, free_seats(d.id, "find_db") or 0)
+    # 座位不夠（滿了自動下架的也算）或已經有人在排 → 排候補（waitlist.py），不再叫乘客一直重送
+    waitlisted = seats_needed > remaining or has_waitlist(d.id, "find_db")
 
-        # 建立「待確認」乘客（不佔位；司機接受時才會加 seats_filled）
-        PassengerRequest.objects.using("find_db").create(
+    # 建立「待確認」乘客（不佔位；司機接受時才會加 seats_filled）；候補的先不掛司機
+    with transaction.atomic(using="find_db"):
+        p = PassengerRequest.objects.using("find_db").create(
             passenger_name = (request.POST.get("passenger_name", "").strip() or "匿名"),
             gender         = (request.POST.get("gender", "X")),
             email          = (request.POST.get("email") or None),
@@ -1686,54 +1414,30 @@ def join_driver(request, driver_id: int):
             return_date    = (request.POST.get("return_date") or None),
             note           = (request.POST.get("note", "").strip()),
             password       = (request.POST.get("password", "0000").strip() or "0000"),
-            driver         = d,
+            driver         = None if waitlisted else d,
             is_matched     = False,
+            is_waitlisted  = waitlisted,
         )
+        entry = None
+        if waitlisted:
+            entry = enqueue(p, d.id, "find_db")
+            # 前面的都坐得下的話，這一位當場就遞補上去
+            if entry.id in {e for e, _ in promote_waitlist(d.id, "find_db")}:
+                entry = None
 
-    # ===== 交易提交後再重新渲染片段並廣播（避免競態）=====
-    channel_layer = get_channel_layer()
-
-    pending_qs  = PassengerRequest.objects.using("find_db").filter(is_matched=False).order_by("-id")
-    accepted_qs = PassengerRequest.objects.using("find_db").filter(is_matched=True ).order_by("-id")
-
-    # ★ to_attr 改成 pending_list / accepted_list，與模板一致
-    drivers_qs = (
-        DriverTrip.objects.using("find_db")
-        .filter(is_active=True)
-        .prefetch_related(
-            Prefetch("passengers", queryset=pending_qs,  to_attr="pending_list"),
-            Prefetch("passengers", queryset=accepted_qs, to_attr="accepted_list"),
-        )
-    )
-    # materialize（可選，但穩）
-    drivers = list(drivers_qs)
-
-    passengers = (
-        PassengerRequest.objects.using("find_db")
-        .filter(is_matched=False, driver__isnull=True)
-        .order_by("-id")
-    )
-
-    drivers_html    = render_to_string("Find/_driver_list.html", {"drivers": drivers})
-    passengers_html = render_to_string("Find/_passenger_list.html", {"passengers": passengers})
-
-    # 全局廣播（其他使用者）
-    async_to_sync(channel_layer.group_send)(
-        "find_group",
-        {
-            "type": "send.update",
-            "drivers_html": drivers_html,
-            "passengers_html": passengers_html,
-        },
-    )
-
-    # 單卡片重繪（自己與他人都會收到 WS，保險再發一次）
-    try:
-        broadcast_driver_card(driver_id)
-    except Exception:
-        pass
+    # ===== 交易已提交：卡片、新乘客、司機管理頁合併成一次背景廣播（回應不必等渲染與 Redis）=====
+    touch(drivers=[driver_id], passengers=[p.id], panels=[driver_id])
 
     # AJAX 就回 {"ok":true}（若你要「自己」立刻替換，也可以把片段一起回）
+    # 排候補：多回 entry_id / token，前端用 WebSocket watch_waitlist 等遞補通知
+    if entry is not None:
+        pos = waitlist_position(entry, "find_db")
+        if is_ajax:
+            return JsonResponse({"ok": True, "waitlisted": True, "entry_id": entry.id, "token": entry.token,
+                                 "position": pos, "remaining": remaining})
+        # 一般表單：候補資訊帶在網址上，首頁讀到後顯示排第幾位並開始 watch_waitlist
+        query = urlencode({"waitlist": entry.id, "token": entry.token, "position": pos, "remaining": remaining})
+        return redirect(f"{reverse('find_index')}?{query}")
     if is_ajax:
         return JsonResponse({"ok": True})
     return redirect("find_index")
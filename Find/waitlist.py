@@ -0,0 +1,136 @@
+"""
+行程候補：座位不夠時排隊，有空位就自動遞補（FIFO）
+
+以前 join_driver 發現 seats_needed > 剩餘座位就直接拒絕，乘客只能一直重送；
+熱門行程一有人被拒絕 / 刪除，大家同時重試，多半又是白跑一趟。
+
+現在：
+  - join_driver 座位不夠（或這趟已經有人在排）→ 建立乘客（先不掛司機、is_waitlisted）+ WaitlistEntry，
+    回傳 entry_id / token / 排第幾位
+  - 釋放座位的那個交易裡呼叫 promote(司機)：pax_reject、pax_delete、driver_pax_bulk 的退回、
+    driver_manage 加座位。依報名順序把坐得下的候補掛到司機的待確認（跟報名成功一樣）
+  - 可用座位 = seats_total - seats_filled - 待確認的人數（free_seats；跟 matching.py 一樣，不會一次塞爆待確認）。
+    join_driver 判斷要不要排候補也用同一個 free_seats，兩邊的算法不會不一致
+  - 嚴格 FIFO：排前面的坐不下，後面的也先等，人數少的不會一直插隊
+  - 候補中的乘客不算未指派（is_waitlisted）：首頁乘客列表、候選乘客、自動媒合都看不到，
+    不會被別的司機配走；萬一乘客已經有司機了（舊資料 / admin 改過）→ 候補直接刪掉
+  - 遞補成功：交易提交後送 waitlist.promoted 給那位乘客（FindConsumer 的 watch_waitlist），
+    前端不必輪詢
+"""
+import secrets
+
+from django.db import transaction
+from django.utils import timezone
+
+from .broadcast import group_send
+from .changes import touch
+from .dispatch import dispatch_on_commit
+from .locations import DB_ALIAS
+from .matching import pending_seats
+from .models import DriverTrip, PassengerRequest, WaitlistEntry
+from .search import reindex_drivers
+from .seats import seats_of
+from .snapshot import bump_data_version
+
+
+def waitlist_group(entry_id) -> str:
+    return f"find_waitlist_{entry_id}"
+
+
+def free_seats(driver_id, using: str = DB_ALIAS):
+    """還能掛到待確認的座位數（可能是負的）；司機不存在回傳 None"""
+    # seats_total 看 find_db（driver_manage 剛在同一個交易裡改過）；已佔座位有帳本就看帳本
+    total = DriverTrip.objects.using(using).filter(id=driver_id).values_list("seats_total", flat=True).first()
+    seats = seats_of(driver_id, using)
+    if total is None or seats is None:
+        return None
+    return total - seats[1] - pending_seats(using, [driver_id]).get(driver_id, 0)
+
+
+def has_waitlist(driver_id, using: str = DB_ALIAS) -> bool:
+    return WaitlistEntry.objects.using(using).filter(driver_id=driver_id, promoted_at__isnull=True).exists()
+
+
+def enqueue(passenger: PassengerRequest, driver_id, using: str = DB_ALIAS) -> WaitlistEntry:
+    """乘客排到這趟行程的候補最後面（乘客本身先不掛司機）"""
+    return WaitlistEntry.objects.using(using).create(
+        driver_id=driver_id, passenger=passenger, token=secrets.token_urlsafe(16))
+
+
+def position(entry: WaitlistEntry, using: str = DB_ALIAS) -> int:
+    """排第幾位（1 起算）；已經遞補了回傳 0"""
+    if entry.promoted_at is not None:
+        return 0
+    return WaitlistEntry.objects.using(using).filter(
+        driver_id=entry.driver_id, promoted_at__isnull=True, id__lte=entry.id).count()
+
+
+def promote(driver_id, using: str = DB_ALIAS) -> list:
+    """
+    有空位時依報名順序把候補掛到司機的待確認；回傳 [(候補 id, 乘客 id)]。
+    在釋放座位的同一個交易裡呼叫；候補列鎖住，同一趟同時遞補也不會重複。
+    """
+    if not driver_id:
+        return []
+    with transaction.atomic(using=using):
+        entries = list(WaitlistEntry.objects.using(using).select_for_update()
+                       .filter(driver_id=driver_id, promoted_at__isnull=True).order_by("id")
+                       .values_list("id", "passenger_id", "passenger__seats_needed", "passenger__driver_id",
+                                    "passenger__is_matched"))
+        if not entries:
+            return []
+        free = free_seats(driver_id, using)
+        if free is None:
+            return []
+
+        promoted, stale = [], []
+        for entry_id, pid, n, current, matched in entries:
+            if current is not None or matched:
+                stale.append(entry_id)
+                continue
+            if n > free:
+                break      # 嚴格 FIFO
+            # 條件式 UPDATE：乘客還在排（沒被配走）才掛上來
+            if PassengerRequest.objects.using(using).filter(
+                    id=pid, driver__isnull=True, is_matched=False).update(driver_id=driver_id, is_waitlisted=False):
+                promoted.append((entry_id, pid))
+                free -= n
+            else:
+                stale.append(entry_id)
+
+        if stale:
+            WaitlistEntry.objects.using(using).filter(id__in=stale).delete()
+            PassengerRequest.objects.using(using).filter(
+                id__in=[pid for entry_id, pid, *_ in entries if entry_id in stale]).update(is_waitlisted=False)
+        if promoted:
+            WaitlistEntry.objects.using(using).filter(id__in=[e for e, _ in promoted]).update(
+                promoted_at=timezone.now())
+            # update() 不觸發 signals：全文索引、資料版本、廣播自己補
+            reindex_drivers([driver_id], using=using)
+            transaction.on_commit(bump_data_version, using=using)
+            touch(drivers=[driver_id], passengers=[pid for _, pid in promoted], panels=[driver_id])
+            for entry_id, pid in promoted:
+                # 只送這一次，佇列滿了也不能丟
+                dispatch_on_commit(notify_promoted, entry_id, driver_id, pid, using=using, inline_if_full=True)
+    return promoted
+
+
+def notify_promoted(entry_id, driver_id, passenger_id):
+    group_send(waitlist_group(entry_id), {
+        "type": "waitlist.promoted",
+        "entry_id": entry_id,
+        "driver_id": driver_id,
+        "passenger_id": passenger_id,
+    })
+
+
+def entry_status(entry_id, token, using: str = DB_ALIAS):
+    """watch_waitlist 用：token 對得上回傳 {"entry_id", "driver_id", "passenger_id", "position"}，否則 None"""
+    try:
+        entry = WaitlistEntry.objects.using(using).get(id=int(entry_id))
+    except (TypeError, ValueError, WaitlistEntry.DoesNotExist):
+        return None
+    if not secrets.compare_digest(entry.token, str(token or "")):
+        return None
+    return {"entry_id": entry.id, "driver_id": entry.driver_id, "passenger_id": entry.passenger_id,
+            "position": position(entry, using)}
@@ -75,6 +75,40 @@ CHANNEL_LAYERS = {
         },
     },
 }
+# Find 即時廣播：合併視窗（毫秒），視窗內的多次變更只渲染、廣播一次
+# 設成 0 = 不合併，每次變更立即廣播
+FIND_BROADCAST_WINDOW_MS = config("FIND_BROADCAST_WINDOW_MS", default=250, cast=int)
+# 廣播內容："delta" = 只送變動的卡片／欄位；"full" = 整份清單 HTML（舊作法）
+FIND_BROADCAST_MODE = config("FIND_BROADCAST_MODE", default="delta")
+# 寫入 API 的提交後廣播改由背景佇列執行："thread" = 背景 worker；"inline" = 呼叫端直接執行
+FIND_DISPATCH_MODE = config("FIND_DISPATCH_MODE", default="thread")
+FIND_DISPATCH_WORKERS = config("FIND_DISPATCH_WORKERS", default=1, cast=int)
+FIND_DISPATCH_MAX_DEPTH = config("FIND_DISPATCH_MAX_DEPTH", default=1000, cast=int)
+# WebSocket 傳輸編碼：前端用 subprotocol（find.deflate / find.msgpack / find.json）協商，依這裡的順序挑
+FIND_WS_ENCODINGS = config("FIND_WS_ENCODINGS", default="deflate,msgpack,json")
+# deflate 每條連線保留當字典的明文長度（2^N bytes，9~15；預設 15 = 32KB）
+FIND_WS_DEFLATE_WBITS = config("FIND_WS_DEFLATE_WBITS", default=15, cast=int)
+# 慢速連線背壓：已送出未 ack 的訊息數上限；超過就只保留每張卡片的最新狀態，最多保留幾個 key
+FIND_WS_MAX_IN_FLIGHT = config("FIND_WS_MAX_IN_FLIGHT", default=8, cast=int)
+FIND_WS_OUTBOX_MAX_KEYS = config("FIND_WS_OUTBOX_MAX_KEYS", default=500, cast=int)
+# 首頁司機清單每頁幾張卡片（第一頁隨首頁渲染，之後往下捲再載入）
+FIND_PAGE_SIZE = config("FIND_PAGE_SIZE", default=30, cast=int)
+# 司機卡片頁的結果快取（依資料版本失效）最多存幾頁；0 = 不快取
+FIND_PAGE_CACHE_SIZE = config("FIND_PAGE_CACHE_SIZE", default=128, cast=int)
+# 順路媒合（Find/routes.py）：乘客與司機的日期最多差幾天；flexible_pickup = NO 的司機最多繞幾站
+FIND_ROUTE_DATE_WINDOW = config("FIND_ROUTE_DATE_WINDOW", default=1, cast=int)
+FIND_ROUTE_MAX_DETOUR = config("FIND_ROUTE_MAX_DETOUR", default=1, cast=int)
+# 座位帳本（Find/ledger.py）："" = 關閉（座位直接在 find_db 扣）；"redis" = 熱門行程的座位放 Redis、
+# 晚一點寫回 find_db；"memory" = 程序內的帳本（單一程序 / 測試 / 壓測用）
+FIND_SEAT_LEDGER = config("FIND_SEAT_LEDGER", default="")
+FIND_SEAT_LEDGER_URL = config(
+    "FIND_SEAT_LEDGER_URL",
+    default=f"redis://{config('REDIS_HOST', default='192.168.0.157')}:{config('REDIS_PORT', default=6379, cast=int)}/1",
+)
+# 帳本寫回 find_db 的間隔（毫秒）；0 = 不開背景寫回，只在上下架判斷 / manage.py seat_ledger --flush 時寫回
+FIND_SEAT_LEDGER_FLUSH_MS = config("FIND_SEAT_LEDGER_FLUSH_MS", default=500, cast=int)
+# /find/metrics/（Prometheus）存取權杖；留空 = 只有 staff 登入（或 DEBUG）看得到
+FIND_METRICS_TOKEN = config("FIND_METRICS_TOKEN", default="")
 # 讓 Django 相信代理傳來的協定
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 # 如果你用反向代理轉 Host，建議也打開